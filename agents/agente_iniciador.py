@@ -1,11 +1,47 @@
-import threading
-from services.api_clients import consultar_lead_kommo, consultar_contato_kommo, enviar_mensagem_evolution
-from services.db_manager import logar_envio_inicial_db, find_comprador_local_id, find_outbound_number, sincronizar_numeros_lead, buscar_proximo_numero_sem_envio
+from concurrent.futures import ThreadPoolExecutor
+
+from services.api_clients import consultar_lead_kommo, consultar_contatos_kommo, enviar_mensagem_evolution
+from services.db_manager import logar_envio_inicial_db, find_comprador_local_id, find_outbound_number, sincronizar_numeros_lead, reivindicar_proximo_numero
+from services.coordenacao import registrar_lease, encerrar_lease
+from config import ID_WORKER, LEASE_SEGUNDOS, ENVIO_ESPERA_MAX_WEBHOOK
 
 from utils.message_manager import selecionar_primeira_mensagem
 from utils.phone_utils import limpar_numero_telefone
 
 
+# Pool compartilhado para sobrepor as consultas ao banco com a busca de contatos no Kommo
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="iniciador")
+
+
+def _buscar_numero_saida(kommo_responsavel_id, uf_cliente):
+    """Resolve o comprador local e o número de saída. Retorna (comprador_local_id, outbound)."""
+    comprador_local_id = find_comprador_local_id(kommo_responsavel_id)
+    if not comprador_local_id:
+        print(f"[AGENTE] Responsável {kommo_responsavel_id} não encontrado.")
+        return None, None
+    return comprador_local_id, find_outbound_number(comprador_local_id, uf_cliente)
+
+
+def _extrair_nome_contato(dados_contato: dict):
+    for cf in dados_contato.get('custom_fields_values') or []:
+        if cf.get('field_name') == 'primeiro_nome' and cf.get('values'):
+            return cf['values'][0].get('value')
+    return dados_contato.get('first_name')
+
+
+def _extrair_telefones(dados_contato: dict) -> list:
+    telefones = []
+    for cf in dados_contato.get('custom_fields_values') or []:
+        if cf.get('field_code') == 'PHONE':
+            for v in cf.get('values', []):
+                num_sujo = str(v.get('value'))
+                num_limpo = limpar_numero_telefone(num_sujo)
+                if len(num_limpo) > 8:
+                    telefones.append(num_limpo)
+            break
+    return telefones
+
+
 def iniciar_verificacao(params: dict):
     """Função principal que o disparador chama."""
     print(f"\n--- [AGENTE INICIADOR] ---")
@@ -25,68 +61,69 @@ def iniciar_verificacao(params: dict):
         pass
     if not uf_cliente: uf_cliente = 'todos'
 
+    id_contato_principal = None
+    ids_contatos = []
+    for c in dados_do_lead.get('_embedded', {}).get('contacts', []):
+        ids_contatos.append(c.get('id'))
+        if c.get('is_main') and not id_contato_principal: id_contato_principal = c.get('id')
+
+    # Banco (comprador + número de saída) e Kommo (contatos) em paralelo
     kommo_responsavel_id = dados_do_lead.get('responsible_user_id')
-    comprador_local_id = find_comprador_local_id(kommo_responsavel_id)
-    if not comprador_local_id:
-        print(f"[AGENTE] Responsável {kommo_responsavel_id} não encontrado.")
-        return
+    futuro_saida = _executor.submit(_buscar_numero_saida, kommo_responsavel_id, uf_cliente)
+    futuro_contatos = _executor.submit(consultar_contatos_kommo, ids_contatos)
 
-    outbound = find_outbound_number(comprador_local_id, uf_cliente)
+    comprador_local_id, outbound = futuro_saida.result()
     if not outbound: return
     evolution_instance_id = outbound['instance_id']
 
-    id_contato_principal = None
-
-    for c in dados_do_lead.get('_embedded', {}).get('contacts', []):
-        if c.get('is_main'): id_contato_principal = c.get('id'); break
-
-
     telefones_brutos_api = []
     nome_contato = params.get('primeiro_nome', 'Cliente')
 
-    if id_contato_principal:
-        dados_contato = consultar_contato_kommo(id_contato_principal)
-        if dados_contato:
-            nome_custom = None
-            for cf in dados_contato.get('custom_fields_values', []):
-                if cf.get('field_name') == 'primeiro_nome' and cf.get('values'):
-                    nome_custom = cf['values'][0].get('value')
-                    break
-            nome_contato = nome_custom or dados_contato.get('first_name') or nome_contato
-
-            for cf in dados_contato.get('custom_fields_values', []):
-                if cf.get('field_code') == 'PHONE':
-                    for v in cf.get('values', []):
-                        num_sujo = str(v.get('value'))
-                        num_limpo = limpar_numero_telefone(num_sujo)
-                        if len(num_limpo) > 8:
-                            telefones_brutos_api.append(num_limpo)
-                    break
-
-    sincronizar_numeros_lead(int(id_lead), telefones_brutos_api)
-
-    telefone_destino = buscar_proximo_numero_sem_envio(int(id_lead))
-
-    if not telefone_destino:
-        print("[AGENTE INICIADOR] Todos os números deste lead já foram contatados. Nada a fazer.")
+    # O nome vem do contato principal; os telefones, de todos os contatos vinculados
+    contatos = sorted(futuro_contatos.result(), key=lambda c: c.get('id') != id_contato_principal)
+    for dados_contato in contatos:
+        if dados_contato.get('id') == id_contato_principal:
+            nome_contato = _extrair_nome_contato(dados_contato) or nome_contato
+        for telefone in _extrair_telefones(dados_contato):
+            if telefone not in telefones_brutos_api:
+                telefones_brutos_api.append(telefone)
+
+    # Lead e números numa transação só; num retry do webhook não regrava nada
+    local_lead_id = sincronizar_numeros_lead(int(id_lead), id_contato_principal, comprador_local_id,
+                                             nome_contato, telefones_brutos_api)
+    if not local_lead_id: return
+
+    # O lease garante que só um worker (scheduler ou webhook) envie para este número
+    numero_reivindicado = reivindicar_proximo_numero(int(id_lead), ID_WORKER, LEASE_SEGUNDOS)
+
+    if not numero_reivindicado:
+        print("[AGENTE INICIADOR] Nenhum número livre para este lead (já contatados ou em envio). Nada a fazer.")
         return
 
-    mensagem_para_enviar = selecionar_primeira_mensagem(nome_contato)
-    print(f"[AGENTE INICIADOR] Enviando msg para: {telefone_destino}")
-
-    resultado = enviar_mensagem_evolution(
-        numero_destino=telefone_destino,
-        mensagem=mensagem_para_enviar,
-        evolution_instance_id=evolution_instance_id
-    )
+    telefone_destino = numero_reivindicado['numero']
+    registrar_lease(numero_reivindicado['id'])
+    # Só o scheduler espera o token o tempo que for; o webhook desiste acima do máximo
+    pelo_scheduler = params.get("service") == "scheduler_autom"
+    resultado = None
+    try:
+        mensagem_para_enviar = selecionar_primeira_mensagem(nome_contato)
+        print(f"[AGENTE INICIADOR] Enviando msg para: {telefone_destino}")
+
+        resultado = enviar_mensagem_evolution(
+            numero_destino=telefone_destino,
+            mensagem=mensagem_para_enviar,
+            evolution_instance_id=evolution_instance_id,
+            espera_max=None if pelo_scheduler else ENVIO_ESPERA_MAX_WEBHOOK
+        )
+    finally:
+        # Com envio, o log limpa o lease. Sem envio no scheduler (falha, limite diário),
+        # o lease apenas expira: serve de espera antes de tentar este número de novo.
+        # Fora do scheduler o número volta na hora para a fila, em 'sem envio'.
+        encerrar_lease(numero_reivindicado['id'], liberar=not resultado and not pelo_scheduler)
 
     if resultado:
-        log_thread = threading.Thread(
-            target=logar_envio_inicial_db,
-            args=(int(id_lead), int(id_contato_principal), comprador_local_id,
-                  nome_contato, telefones_brutos_api, telefone_destino, mensagem_para_enviar)
-        )
-        log_thread.start()
+        # Síncrono: o número só sai de 'sem envio' quando o log é gravado
+        logar_envio_inicial_db(local_lead_id, numero_reivindicado['id'], mensagem_para_enviar)
     else:
         print("[AGENTE] Falha envio.")
 
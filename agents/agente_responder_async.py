@@ -0,0 +1,26 @@
+import asyncio
+import json
+
+from agents.agente_responder_langgraph import app, atualizar_resumo_historico
+
+# Entrada do Agente 2 no modo ASGI. Usa o mesmo grafo do agente_responder_langgraph
+# via app.ainvoke: só a classificação (LLM) é assíncrona. Os nós de ferramenta seguem
+# síncronos (requests/pymysql) e rodam no executor do loop, configurado pelo
+# webhook_server_asgi com ASGI_THREADS.
+
+
+async def iniciar_agente_resposta(input_data: dict):
+    try:
+        input_data['classificacao'] = None
+
+        print("\n------------ INPUT DO AGENTE (ASYNC) ------------")
+        print(json.dumps(input_data, indent=2, default=str))
+
+        resultado = await app.ainvoke(input_data)
+
+        print("\n------------ OUTPUT DO AGENTE (ASYNC) ------------")
+        print(json.dumps(resultado, indent=2, default=str))
+
+        await asyncio.to_thread(atualizar_resumo_historico, input_data)
+    except Exception as e:
+        print(f"[AGENTE RESPONDER] Erro: {e}")
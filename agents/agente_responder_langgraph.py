@@ -1,11 +1,14 @@
 import json
 from typing import TypedDict, Literal
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
 from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END
 
-from config import ID_STATUS_QUALIFICACAO_HUMANA
+from config import ID_STATUS_QUALIFICACAO_HUMANA, HISTORICO_RESUMO_ATIVO
+
+from services.llm_registry import registrar_chain
 
 from utils.text_utils import verificar_match_nome_llm
 
@@ -18,13 +21,15 @@ from services.db_manager import (atualizar_status_contato,
                                  salvar_mensagem_agente,
                                  get_nome_responsavel_por_lead,
                                  get_kommo_id_from_local,
-                                 get_nome_lead_por_id)
+                                 get_nome_lead_por_id,
+                                 salvar_resumo_historico,
+                                 buscar_historico_completo)
 
 from utils.message_manager import (
     selecionar_mensagem_engano,
     get_texto_apresentacao,
     get_mensagem_parente,
-    get_pdf_em_base64
+    get_pdf_para_envio
 )
 
 
@@ -35,6 +40,8 @@ class GraphState(TypedDict):
     numero_remetente: str
     mensagem_recebida: str
     historico_chat: list
+    historico_truncado: bool
+    resumo_historico: str
     instance_id: str
     nome_perfil_whatsapp: str
 
@@ -46,9 +53,6 @@ class ClassificarResposta(BaseModel):
     categoria: Literal["confirmacao", "objecao", "negacao", "parente", "neutro", "nao_identificado"] = Field(...)
 
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.0)
-structured_llm = llm.with_structured_output(ClassificarResposta)
-
 system_prompt = (
     "Você é um classificador responsável por analisar o histórico completo da conversa entre o cliente e o chatbot. "
     "Com base nesse histórico, sua tarefa é identificar **apenas uma** das categorias abaixo:\n\n"
@@ -66,10 +70,47 @@ classification_prompt = ChatPromptTemplate.from_messages([
     ("human", human_prompt)
 ])
 
-classifier_chain = classification_prompt | structured_llm
 
+def _classificar_fake(entrada: dict) -> ClassificarResposta:
+    """Classificação por palavras-chave usada com LLM_BACKEND=fake."""
+    linhas_cliente = [l for l in entrada['historico_formatado'].split('\n') if l.startswith("Cliente: ")]
+    texto = linhas_cliente[-1].lower() if linhas_cliente else ""
+
+    regras = [
+        ("negacao", ["não sou", "nao sou", "engano", "errado"]),
+        ("parente", ["filho", "filha", "pai", "mãe", "mae", "esposa", "marido", "faleceu", "morreu"]),
+        ("objecao", ["quem", "assunto", "do que se trata"]),
+        ("confirmacao", ["sou eu", "sim", "sou ele", "sou ela"]),
+        ("neutro", ["oi", "olá", "ola", "bom dia", "boa tarde", "boa noite", "tudo bem"]),
+    ]
+    for categoria, palavras in regras:
+        if any(p in texto for p in palavras):
+            return ClassificarResposta(categoria=categoria)
+    return ClassificarResposta(categoria="nao_identificado")
+
+
+classifier_chain = registrar_chain(
+    "classificador",
+    lambda llm: classification_prompt | llm.with_structured_output(ClassificarResposta),
+    fake=_classificar_fake,
+    timeout=20
+)
+
+resumo_prompt = ChatPromptTemplate.from_messages([
+    ("system", "Resuma em até 5 frases, em português, o que já foi dito nesta conversa entre o chatbot e o cliente. "
+               "Preserve se o cliente confirmou, negou, questionou ou disse ser parente do titular."),
+    ("human", "Resumo anterior:\n{resumo_anterior}\n\nMensagens recentes:\n{historico_formatado}")
+])
 
-def formatar_historico_para_nota(historico_chat: list, ultima_mensagem_usuario: str) -> str:
+resumo_chain = registrar_chain(
+    "resumo_historico",
+    lambda llm: resumo_prompt | llm | StrOutputParser(),
+    fake=lambda entrada: "Resumo indisponível no modo offline.",
+    max_concorrencia=2
+)
+
+
+def formatar_historico_para_nota(historico_chat: list, ultima_mensagem_usuario: str = None) -> str:
     texto = (
         "\n"
         "════ HISTÓRICO DA CONVERSA ════ \n"
@@ -84,25 +125,35 @@ def formatar_historico_para_nota(historico_chat: list, ultima_mensagem_usuario:
                 texto += f"CLIENTE: {msg['conteudo']}\n"
 
             texto += "─" * 30 + "\n"
-    texto += f"CLIENTE: {ultima_mensagem_usuario}\n"
+    if ultima_mensagem_usuario:
+        texto += f"CLIENTE: {ultima_mensagem_usuario}\n"
 
     texto += "\n═══════════════════════════════"
 
     return texto
 
 
+def historico_para_nota(state: GraphState) -> str:
+    """
+    Histórico da nota do Kommo: a conversa inteira do banco (o state só tem a janela
+    usada pelo classificador). Se a consulta falhar, usa a janela + mensagem atual.
+    """
+    historico = buscar_historico_completo(state['numero_id'])
+    if historico is None:
+        return formatar_historico_para_nota(state['historico_chat'], state['mensagem_recebida'])
+    return formatar_historico_para_nota(historico)
+
 
-# --- 3. Nó de Classificação ---
-def classificar_entrada(state: GraphState):
-    """Nó de entrada. Formata o histórico e classifica a mensagem do usuário."""
-    print(f"\n--- [AGENTE RESPONDER] ---")
-    print(f"[AGENTE RESPONDER] Classificando mensagem para Lead ID: {state['lead_id']}")
 
+def formatar_historico_para_llm(historico_chat: list, mensagem_recebida: str, resumo_historico: str = None) -> str:
+    """Monta o histórico no formato do prompt do classificador."""
     historico_formatado = []
-    msg_usuario_atual = state['mensagem_recebida'].strip()
+    if resumo_historico:
+        historico_formatado.append(f"Resumo da conversa anterior: {resumo_historico}")
+    msg_usuario_atual = mensagem_recebida.strip()
 
-    if state['historico_chat']:
-        for msg in state['historico_chat']:
+    if historico_chat:
+        for msg in historico_chat:
             conteudo_msg = msg['conteudo'].strip()
             remetente = msg['remetente']
 
@@ -117,8 +168,10 @@ def classificar_entrada(state: GraphState):
         if linha.strip():
             historico_formatado.append(f"Cliente: {linha.strip()}")
 
-    historico_str = "\n".join(historico_formatado)
+    return "\n".join(historico_formatado)
 
+
+def imprimir_debug_prompt(historico_str: str):
     print("--- [DEBUG] PROMPT ENVIADO PARA A LLM (CLASSIFICADOR) ---")
     print(f"Histórico Formatado (enviado para LLM):\n{historico_str}")
 
@@ -137,20 +190,45 @@ def classificar_entrada(state: GraphState):
     except Exception as e_debug:
         print(f"Erro ao imprimir debug: {e_debug}")
 
-    try:
-        resultado = classifier_chain.invoke({
-            "historico_formatado": historico_str
-        })
 
-        classificacao = resultado.categoria
-        print(f"[AGENTE RESPONDER] Classificação da LLM: {classificacao}")
+# --- 3. Nó de Classificação ---
+def _preparar_classificacao(state: GraphState) -> str:
+    print(f"\n--- [AGENTE RESPONDER] ---")
+    print(f"[AGENTE RESPONDER] Classificando mensagem para Lead ID: {state['lead_id']}")
+
+    historico_str = formatar_historico_para_llm(
+        state['historico_chat'], state['mensagem_recebida'], state.get('resumo_historico')
+    )
+    imprimir_debug_prompt(historico_str)
+    return historico_str
+
+
+def _falha_classificacao(erro: Exception) -> dict:
+    print(f"[AGENTE RESPONDER] Erro na LLM: {erro}")
+    return {"classificacao": "nao_identificado"}
+
 
+def _resultado_classificacao(resultado: ClassificarResposta) -> dict:
+    print(f"[AGENTE RESPONDER] Classificação da LLM: {resultado.categoria}")
+    return {"classificacao": resultado.categoria}
+
+
+def classificar_entrada(state: GraphState):
+    """Nó de entrada. Formata o histórico e classifica a mensagem do usuário."""
+    historico_str = _preparar_classificacao(state)
+    try:
+        return _resultado_classificacao(classifier_chain.invoke({"historico_formatado": historico_str}))
     except Exception as e:
-        print(f"[AGENTE RESPONDER] Erro na LLM: {e}")
+        return _falha_classificacao(e)
 
-        classificacao = "nao_identificado"
 
-    return {"classificacao": classificacao}
+async def classificar_entrada_async(state: GraphState):
+    """Mesmo nó, usado no app.ainvoke (modo ASGI): a chamada à LLM não prende uma thread."""
+    historico_str = _preparar_classificacao(state)
+    try:
+        return _resultado_classificacao(await classifier_chain.ainvoke({"historico_formatado": historico_str}))
+    except Exception as e:
+        return _falha_classificacao(e)
 
 
 def tool_confirmacao(state: GraphState):
@@ -164,7 +242,7 @@ def tool_confirmacao(state: GraphState):
 
     numero_cliente = state['numero_remetente']
 
-    history_log = formatar_historico_para_nota(state['historico_chat'], state['mensagem_recebida'])
+    history_log = historico_para_nota(state)
 
     texto_nota = (
         f"IDENTIFICAÇÃO POSITIVA VIA CHATBOT\n"
@@ -188,7 +266,7 @@ def tool_objecao(state: GraphState):
 
     nome_responsavel = get_nome_responsavel_por_lead(lead_id)
     texto = get_texto_apresentacao(nome_responsavel)
-    pdf_base64 = get_pdf_em_base64()
+    pdf_base64 = get_pdf_para_envio()
     resultado_envio = None
 
     if pdf_base64:
@@ -197,12 +275,13 @@ def tool_objecao(state: GraphState):
             evolution_instance_id=instance_id,
             base64_data=pdf_base64,
             nome_arquivo="Apresentacao_PrecNet.pdf",
-            caption=texto
+            caption=texto,
+            prioritario=True
         )
 
     if not resultado_envio:
         if pdf_base64: print("[AGENTE RESPONDER] Falha no PDF. Tentando texto puro...")
-        resultado_envio = enviar_mensagem_evolution(numero_remetente, texto, instance_id)
+        resultado_envio = enviar_mensagem_evolution(numero_remetente, texto, instance_id, prioritario=True)
 
     if resultado_envio:
         salvar_mensagem_agente(numero_id, texto)
@@ -214,7 +293,7 @@ def tool_objecao(state: GraphState):
 
         numero_cliente = state['numero_remetente']
 
-        history_log = formatar_historico_para_nota(state['historico_chat'], state['mensagem_recebida'])
+        history_log = historico_para_nota(state)
 
         texto_nota = (
             f"IDENTIFICAÇÃO DE OBJEÇÃO VIA CHATBOT\n"
@@ -241,7 +320,6 @@ def tool_negacao(state: GraphState):
     if nome_wpp and nome_lead_banco:
         eh_engano_fake = verificar_match_nome_llm(nome_lead_banco, nome_wpp)
 
-    history_log = formatar_historico_para_nota(state['historico_chat'], state['mensagem_recebida'])
     kommo_id = get_kommo_id_from_local(lead_id)
 
     if eh_engano_fake:
@@ -250,7 +328,7 @@ def tool_negacao(state: GraphState):
         atualizar_status_contato(numero_id, 'engano_fake')
 
         if kommo_id:
-
+            history_log = historico_para_nota(state)
             texto_nota = (
                 f"ALERTA DE ENGANO FAKE\n"
                 f"O número +{numero_remetente} negou ser a pessoa.\n"
@@ -262,13 +340,14 @@ def tool_negacao(state: GraphState):
     else:
         print("Negação legítima (Nomes não batem ou sem nome no Wpp). Enviando desculpas.")
         msg = selecionar_mensagem_engano()
-        res = enviar_mensagem_evolution(numero_remetente, msg, instance_id)
+        res = enviar_mensagem_evolution(numero_remetente, msg, instance_id, prioritario=True)
 
         if res:
             salvar_mensagem_agente(numero_id, msg)
             atualizar_status_contato(numero_id, 'negado')
 
             if kommo_id:
+                history_log = historico_para_nota(state)
                 texto_nota = (
                     f"IDENTIFICAÇÃO DE ENGANO (NÚMERO ERRADO)\n"
                     f"O número +{numero_remetente} informou que não pertence ao titular.\n"
@@ -299,7 +378,7 @@ def tool_parente(state: GraphState):
     msg = get_mensagem_parente(nome_responsavel, nome_lead)
 
 
-    pdf_base64 = get_pdf_em_base64()
+    pdf_base64 = get_pdf_para_envio()
     resultado_envio = None
 
     if pdf_base64:
@@ -308,12 +387,13 @@ def tool_parente(state: GraphState):
             evolution_instance_id=instance_id,
             base64_data=pdf_base64,
             nome_arquivo="Apresentacao_PrecNet.pdf",
-            caption=msg
+            caption=msg,
+            prioritario=True
         )
 
     if not resultado_envio:
         if pdf_base64: print("[AGENTE RESPONDER] Falha no PDF. Tentando texto puro...")
-        resultado_envio = enviar_mensagem_evolution(numero_remetente, msg, instance_id)
+        resultado_envio = enviar_mensagem_evolution(numero_remetente, msg, instance_id, prioritario=True)
 
     if resultado_envio:
         salvar_mensagem_agente(numero_id, msg)
@@ -323,7 +403,7 @@ def tool_parente(state: GraphState):
         if kommo_id:
             atualizar_status_lead_kommo(kommo_id, ID_STATUS_QUALIFICACAO_HUMANA)
 
-            history_log = formatar_historico_para_nota(state['historico_chat'], state['mensagem_recebida'])
+            history_log = historico_para_nota(state)
 
             texto_nota = (
                 f"INTERAÇÃO COM PARENTE/CONHECIDO\n"
@@ -372,9 +452,12 @@ def should_route(state: GraphState):
 
 
 # --- Montagem do Grafo ---
+# Um grafo só para os dois modos: app.invoke (Flask) e app.ainvoke (ASGI).
+# No ainvoke o classificador roda a versão async; os nós de ferramenta são
+# síncronos e o LangGraph os executa em threads do executor.
 workflow = StateGraph(GraphState)
 
-workflow.add_node("classificar_entrada", classificar_entrada)
+workflow.add_node("classificar_entrada", RunnableLambda(classificar_entrada, afunc=classificar_entrada_async))
 workflow.add_node("tool_confirmacao", tool_confirmacao)
 workflow.add_node("tool_objecao", tool_objecao)
 workflow.add_node("tool_negacao", tool_negacao)
@@ -408,6 +491,26 @@ workflow.add_edge("tool_nao_identificado", END)
 app = workflow.compile()
 
 
+def atualizar_resumo_historico(input_data: dict):
+    """
+    Quando a janela de histórico cortou mensagens antigas, atualiza o resumo
+    acumulado do número para que elas continuem representadas no prompt.
+    """
+    if not HISTORICO_RESUMO_ATIVO or not input_data.get('historico_truncado'):
+        return
+
+    try:
+        historico_str = formatar_historico_para_llm(input_data['historico_chat'], input_data['mensagem_recebida'])
+        resumo = resumo_chain.invoke({
+            "resumo_anterior": input_data.get('resumo_historico') or "(nenhum)",
+            "historico_formatado": historico_str
+        }).strip()
+        salvar_resumo_historico(input_data['numero_id'], resumo)
+        print("[AGENTE RESPONDER] Resumo do histórico atualizado.")
+    except Exception as e:
+        print(f"[AGENTE RESPONDER] Erro ao atualizar resumo do histórico: {e}")
+
+
 def iniciar_agente_resposta(input_data: dict):
     try:
         input_data['classificacao'] = None
@@ -417,5 +520,7 @@ def iniciar_agente_resposta(input_data: dict):
 
         print("\n------------ OUTPUT DO AGENTE ------------")
         print(json.dumps(app.invoke(input_data), indent=2, default=str))
+
+        atualizar_resumo_historico(input_data)
     except Exception as e:
         print(f"[AGENTE RESPONDER] Erro: {e}")
\ No newline at end of file
@@ -1,4 +1,7 @@
-from services.db_manager import buscar_contexto_conversa, salvar_mensagem_usuario
+import re
+
+from services.api_clients import invalidar_lead_kommo
+from services.db_manager import buscar_contexto_conversa, salvar_mensagem_usuario, notificar_fila
 from agents.agente_iniciador import iniciar_verificacao as run_agente_iniciador
 from agents.agente_responder_langgraph import iniciar_agente_resposta as run_agente_responder
 from utils.debounce_manager import adicionar_mensagem_buffer
@@ -63,6 +66,52 @@ def extrair_conteudo_mensagem(msg_obj):
 
     return texto
 
+# Campos do webhook do Kommo (form): leads[status][0][id], leads[add][0][updated_at]...
+_CAMPO_LEAD_WEBHOOK = re.compile(r'^leads\[(status|add)\]\[(\d+)\]\[(id|updated_at|last_modified)\]$')
+
+
+def invalidar_cache_webhook_kommo(data) -> int:
+    """
+    Invalida no cache do Kommo os leads citados em leads[status]/leads[add].
+    Retorna quantos leads o webhook trouxe.
+    """
+    leads = {}
+    for chave in data.keys():
+        campo = _CAMPO_LEAD_WEBHOOK.match(chave)
+        if campo:
+            leads.setdefault(campo.group(1, 2), {})[campo.group(3)] = data[chave]
+
+    for lead in leads.values():
+        if lead.get('id'):
+            invalidar_lead_kommo(lead['id'], lead.get('updated_at') or lead.get('last_modified'))
+    return len(leads)
+
+
+def extrair_remote_jid(data: dict):
+    """
+    Resolve o JID real do remetente (trocando LID pelo JID alternativo).
+    Retorna None para mensagens enviadas por nós ou sem remetente válido.
+    """
+    key_data = data.get('data', {}).get('key', {})
+
+    raw_remote_jid = key_data.get('remoteJid')
+    raw_remote_jid_alt = key_data.get('remoteJidAlt')
+
+    if raw_remote_jid and "@lid" in raw_remote_jid:
+        if raw_remote_jid_alt and "@s.whatsapp.net" in raw_remote_jid_alt:
+            remote_jid = raw_remote_jid_alt
+        else:
+            print("[APP HANDLER] ERRO CRÍTICO: Recebido LID sem JID alternativo.")
+            return None
+    else:
+        remote_jid = raw_remote_jid
+
+    if key_data.get('fromMe') is True or not remote_jid:
+        return None
+
+    return remote_jid
+
+
 def processar_disparo_kommo(params: dict):
     """
     Ponto de entrada para o fluxo do Kommo (Agente 1).
@@ -72,6 +121,9 @@ def processar_disparo_kommo(params: dict):
         run_agente_iniciador(params)
     except Exception as e:
         print(f"[APP HANDLER] Erro crítico no Agente 1: {e}")
+    finally:
+        # Os demais números do lead entraram na fila: acorda o scheduler
+        notificar_fila()
 
 
 def processar_resposta_evolution(data: dict):
@@ -83,21 +135,9 @@ def processar_resposta_evolution(data: dict):
         instancia_recebida = data.get("instance")
         mensagem_data = data.get('data', {})
         push_name = mensagem_data.get('pushName', '')
-        key_data = mensagem_data.get('key', {})
-
-        raw_remote_jid = key_data.get('remoteJid')
-        raw_remote_jid_alt = data.get('data', {}).get('key', {}).get('remoteJidAlt')
-
-        if raw_remote_jid and "@lid" in raw_remote_jid:
-            if raw_remote_jid_alt and "@s.whatsapp.net" in raw_remote_jid_alt:
-                remote_jid = raw_remote_jid_alt
-            else:
-                print("[APP HANDLER] ERRO CRÍTICO: Recebido LID sem JID alternativo.")
-                return
-        else:
-            remote_jid = raw_remote_jid
 
-        if key_data.get('fromMe') is True or not remote_jid:
+        remote_jid = extrair_remote_jid(data)
+        if not remote_jid:
             return
 
         numero_remetente_limpo = remote_jid.split('@')[0].lstrip('+')
@@ -134,6 +174,8 @@ def processar_resposta_evolution(data: dict):
             "lead_id": contexto['lead_id'],
             "numero_id": contexto['numero_id'],
             "historico_chat": contexto['historico_chat'],
+            "historico_truncado": contexto['historico_truncado'],
+            "resumo_historico": contexto['resumo_historico'],
             "numero_remetente": numero_remetente_limpo,
             "mensagem_recebida": mensagem_recebida,
             "instance_id": instancia_recebida,
@@ -1,4 +1,5 @@
 import os
+import socket
 
 
 KOMMO_API_TOKEN = os.getenv("KOMMO_API_TOKEN")
@@ -9,11 +10,114 @@ EVOLUTION_API_URL = os.getenv("EVOLUTION_API_BASE_URL")
 EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_AUTHENTICATION_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# LLM_BACKEND=fake roda os agentes sem chamar a OpenAI (testes e benchmarks offline)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+LLM_MODELO = os.getenv("LLM_MODELO", "gpt-4o-mini")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_CONCORRENCIA = int(os.getenv("LLM_MAX_CONCORRENCIA", "10"))
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+
+# Cache persistente (SQLite) das respostas determinísticas da LLM (gênero, match de nomes)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite3"))
+LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX", "50000"))
+
+# URL pública do PDF de apresentação. Se definida, os envios mandam a URL em vez do Base64
+PDF_MIDIA_URL = os.getenv("PDF_MIDIA_URL")
+
 
 DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+
+LEAD_CACHE_TTL = float(os.getenv("LEAD_CACHE_TTL", "300"))
+LEAD_CACHE_MAX = int(os.getenv("LEAD_CACHE_MAX", "5000"))
+
+
+# Janela de histórico enviada ao classificador (tokens estimados como caracteres / 4)
+HISTORICO_MAX_MENSAGENS = int(os.getenv("HISTORICO_MAX_MENSAGENS", "40"))
+HISTORICO_MAX_TOKENS = int(os.getenv("HISTORICO_MAX_TOKENS", "2000"))
+HISTORICO_RESUMO_ATIVO = os.getenv("HISTORICO_RESUMO_ATIVO", "false").lower() == "true"
+
+
+KOMMO_WORKERS = int(os.getenv("KOMMO_WORKERS", "4"))
+KOMMO_FILA_MAX = int(os.getenv("KOMMO_FILA_MAX", "200"))
+KOMMO_FILA_POLITICA = os.getenv("KOMMO_FILA_POLITICA", "rejeitar")
+
+# Cache dos payloads de leads/contatos do Kommo (segundos). Dentro de KOMMO_CACHE_TTL
+# responde sem chamar a API; depois disso revalida (ETag) até KOMMO_CACHE_IDADE_MAX.
+KOMMO_CACHE_TTL = float(os.getenv("KOMMO_CACHE_TTL", "120"))
+KOMMO_CACHE_IDADE_MAX = float(os.getenv("KOMMO_CACHE_IDADE_MAX", "3600"))
+KOMMO_CACHE_MAX = int(os.getenv("KOMMO_CACHE_MAX", "5000"))
+
+EVOLUTION_WORKERS = int(os.getenv("EVOLUTION_WORKERS", "8"))
+EVOLUTION_FILA_MAX = int(os.getenv("EVOLUTION_FILA_MAX", "500"))
+EVOLUTION_FILA_POLITICA = os.getenv("EVOLUTION_FILA_POLITICA", "rejeitar")
+
+# Modo ASGI: threads que rodam o código síncrono do Agente 2 (nós de ferramenta com
+# requests e pymysql). O padrão do asyncio (núcleos + 4) enfileira as ferramentas.
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "32"))
+
+# Workers que executam o Agente 2 quando o debounce de uma conversa estoura
+DEBOUNCE_WORKERS = int(os.getenv("DEBOUNCE_WORKERS", "8"))
+DEBOUNCE_FILA_MAX = int(os.getenv("DEBOUNCE_FILA_MAX", "1000"))
+
+# Janela adaptativa do debounce: varia entre MIN e MAX conforme o ritmo de digitação do usuário
+DEBOUNCE_JANELA_MIN = float(os.getenv("DEBOUNCE_JANELA_MIN", "2"))
+DEBOUNCE_JANELA_MAX = float(os.getenv("DEBOUNCE_JANELA_MAX", "10"))
+# Espera total máxima desde a primeira mensagem do buffer (quem não para de digitar)
+DEBOUNCE_ESPERA_MAX_TOTAL = float(os.getenv("DEBOUNCE_ESPERA_MAX_TOTAL", "30"))
+
+# Journal dos buffers de debounce: "arquivo" (sobrevive a reinícios) ou "nenhum" (só memória)
+DEBOUNCE_JOURNAL = os.getenv("DEBOUNCE_JOURNAL", "arquivo").lower()
+DEBOUNCE_JOURNAL_PATH = os.getenv("DEBOUNCE_JOURNAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "debounce_journal.log"))
+DEBOUNCE_JOURNAL_COMPACTAR = int(os.getenv("DEBOUNCE_JOURNAL_COMPACTAR", "5000"))
+
+
+# Scheduler de envios: "unitario" (um lead a cada 3-6 min) ou "lote" (vários leads em paralelo)
+SCHEDULER_MODO = os.getenv("SCHEDULER_MODO", "unitario").lower()
+SCHEDULER_LOTE = int(os.getenv("SCHEDULER_LOTE", "20"))
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "8"))
+# Espera máxima entre buscas na fila; trabalho novo (webhook do Kommo) acorda o scheduler antes
+SCHEDULER_CICLO = float(os.getenv("SCHEDULER_CICLO", "30"))
+SCHEDULER_VARREDURA_INTERVALO = float(os.getenv("SCHEDULER_VARREDURA_INTERVALO", "300"))
+# De quanto em quanto tempo o scheduler confere a sequência de eventos da fila no banco
+SCHEDULER_POLL_EVENTOS = float(os.getenv("SCHEDULER_POLL_EVENTOS", "2"))
+SCHEDULER_ENCERRAMENTO_TIMEOUT = float(os.getenv("SCHEDULER_ENCERRAMENTO_TIMEOUT", "60"))
+
+# Identifica este processo nos leases da fila (claimed_by) ao rodar vários schedulers/webhooks
+ID_WORKER = os.getenv("ID_WORKER") or f"{socket.gethostname()}-{os.getpid()}"
+# Duração do lease de um número reivindicado; renovado a cada terço enquanto o processo estiver vivo
+LEASE_SEGUNDOS = int(os.getenv("LEASE_SEGUNDOS", "600"))
+
+# Token bucket de envios por instância de saída (padrões; cada instância pode sobrescrever
+# envios_por_hora / rajada / limite_diario na tabela limites_envio)
+ENVIO_TAXA_POR_HORA = float(os.getenv("ENVIO_TAXA_POR_HORA", "12"))
+ENVIO_RAJADA = int(os.getenv("ENVIO_RAJADA", "1"))
+ENVIO_LIMITE_DIARIO = int(os.getenv("ENVIO_LIMITE_DIARIO", "150"))
+ENVIO_JITTER = float(os.getenv("ENVIO_JITTER", "60"))
+# Espera máxima (s) por um token fora do scheduler (ex.: webhook do Kommo). Acima disso
+# o envio fica para o scheduler, em vez de prender o worker do webhook.
+ENVIO_ESPERA_MAX_WEBHOOK = float(os.getenv("ENVIO_ESPERA_MAX_WEBHOOK", "30"))
+
+
+# Templates de mensagem em memória: recarga do banco e gravação dos contadores de uso (segundos)
+TEMPLATES_RECARGA = float(os.getenv("TEMPLATES_RECARGA", "300"))
+TEMPLATES_FLUSH = float(os.getenv("TEMPLATES_FLUSH", "30"))
+
+
+# Write-behind de mensagens/status: janela de agrupamento (ms) e tamanho máximo do lote
+ESCRITA_JANELA_MS = float(os.getenv("ESCRITA_JANELA_MS", "5"))
+ESCRITA_LOTE_MAX = int(os.getenv("ESCRITA_LOTE_MAX", "200"))
+# Tentativas de um lote que falhou (com espera crescente) e arquivo das operações que não gravaram
+ESCRITA_TENTATIVAS = int(os.getenv("ESCRITA_TENTATIVAS", "3"))
+ESCRITA_FALHAS_PATH = os.getenv("ESCRITA_FALHAS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fila_escrita_falhas.jsonl"))
+
 
 ID_STATUS_QUALIFICACAO_HUMANA = 96744300
\ No newline at end of file
@@ -1,146 +1,270 @@
+import signal
+import threading
 import time
-import random
 from dotenv import load_dotenv
 load_dotenv()
 import config
 
 
 from services.db_manager import (
-    buscar_proximo_lead_fila,
+    reivindicar_lote_fila,
+    ler_sequencia_fila,
     buscar_leads_para_finalizar_automaticamente,
-    marcar_lead_como_concluido,
+    marcar_leads_como_concluidos,
     buscar_leads_expirados_24h
 )
 
 from services.api_clients import (
-    atualizar_status_lead_kommo,
-    criar_nota_lead_kommo
+    atualizar_status_leads_kommo,
+    criar_notas_leads_kommo
 )
 
 from agents.agente_iniciador import iniciar_verificacao
+from services.coordenacao import LockLideranca, registrar_lease, encerrar_lease
+from utils.rate_limiter import limitador_envios
+from utils.worker_pool import PoolTrabalho
 
 
-def calcula_tempo_de_espera():
-    minutos = random.uniform(3, 6)
-    segundos = int(minutos * 60)
-    return segundos
+# Leads locais já despachados no modo lote que ainda não terminaram
+_leads_em_andamento = set()
+_lock_andamento = threading.Lock()
 
+# Com vários schedulers rodando, só o líder faz as varreduras de finalização/expiração
+lideranca_varredura = LockLideranca("scheduler_envios_varredura")
 
-def move_leads_expirados():
+# _despertar: chegou trabalho (sequência da fila mudou ou abriu vaga no pool)
+# _parar: pedido de encerramento (SIGTERM/SIGINT)
+_despertar = threading.Event()
+_parar = threading.Event()
+
+
+def _loop_vigia_fila():
+    """Confere a sequência de eventos da fila no banco e acorda o scheduler quando ela muda."""
+    ultima = ler_sequencia_fila()
+    while not _parar.wait(config.SCHEDULER_POLL_EVENTOS):
+        atual = ler_sequencia_fila()
+        if atual is not None and atual != ultima:
+            ultima = atual
+            print("[SCHEDULER] Novos números na fila. Acordando...")
+            _despertar.set()
+
+
+def _aguardar_trabalho():
+    """Dorme até chegar trabalho, passar SCHEDULER_CICLO ou pedirem o encerramento."""
+    _despertar.wait(config.SCHEDULER_CICLO)
+    _despertar.clear()
+
+
+def _pedir_parada(signum, frame):
+    print("\n[SCHEDULER] Encerrando: terminando os envios em andamento...")
+    _parar.set()
+    _despertar.set()
+    # Workers esperando token do limite de envios desistem na hora (o token é devolvido)
+    limitador_envios.interromper()
+
+
+def _varrer_se_preciso(ultima_varredura):
+    if ultima_varredura is None or time.monotonic() - ultima_varredura >= config.SCHEDULER_VARREDURA_INTERVALO:
+        executar_varreduras()
+        return time.monotonic()
+    return ultima_varredura
+
+
+def executar_varreduras():
+    if not lideranca_varredura.sou_lider():
+        print("[SCHEDULER] Outro processo é o líder das varreduras. Pulando.")
+        return
+    try:
+        concluidos = move_leads_finalizados()
+        move_leads_expirados(ignorar=concluidos)
+    except Exception as e:
+        print(f"[SCHEDULER] Erro na varredura: {e}")
+
+
+def _encerrar_leads_em_lote(leads: list, texto_nota: str) -> set:
     """
-    Move leads com mais de 24h de criação para Qualificação Humana.
+    Move os leads para Qualificação Humana no Kommo (em lote), cria a nota
+    e conclui localmente só os que o Kommo aceitou.
+    `leads` é uma lista de (local_id, kommo_id). Retorna os ids locais concluídos.
     """
-    print("[SCHEDULER]- Verificando leads expirados (+24h)...")
-    leads_vencidos = buscar_leads_expirados_24h()
+    local_por_kommo = {int(kommo_id): local_id for local_id, kommo_id in leads}
 
-    if not leads_vencidos:
-        return
+    movidos = atualizar_status_leads_kommo(list(local_por_kommo), config.ID_STATUS_QUALIFICACAO_HUMANA)
+    for kommo_id in local_por_kommo:
+        if kommo_id not in movidos:
+            print(f"[SCHEDULER] - Falha ao atualizar Kommo para o lead {kommo_id}. Tentará no próximo ciclo.")
 
-    print(f"[SCHEDULER] Processando {len(leads_vencidos)} leads vencidos.")
+    if not movidos:
+        return set()
 
-    for lead in leads_vencidos:
-        local_id = lead['id']
-        kommo_id = lead['kommo_lead_id']
+    com_nota = criar_notas_leads_kommo([(kommo_id, texto_nota) for kommo_id in movidos])
+    if len(com_nota) < len(movidos):
+        print(f"[SCHEDULER] - {len(movidos) - len(com_nota)} leads ficaram sem a nota no Kommo.")
 
-        print(f"[SCHEDULER] Expirando Lead {kommo_id}...")
+    concluidos = {local_por_kommo[kommo_id] for kommo_id in movidos}
+    marcar_leads_como_concluidos(list(concluidos))
+    return concluidos
 
-        sucesso = atualizar_status_lead_kommo(kommo_id, config.ID_STATUS_QUALIFICACAO_HUMANA)
 
-        if sucesso:
-            texto_nota = (
-                "TIMEOUT AUTOMÁTICO (24H)\n"
-                "Passaram-se 24 horas desde a entrada do lead e não houve uma "
-                "identificação positiva clara nos números testados.\n"
-                "O Lead foi movido para Qualificação Humana para análise manual."
-            )
-            criar_nota_lead_kommo(kommo_id, texto_nota)
+def move_leads_expirados(ignorar: set = None):
+    """
+    Move leads com mais de 24h de criação para Qualificação Humana.
+    `ignorar` são ids locais já encerrados nesta varredura (não recebem uma segunda nota).
+    """
+    print("[SCHEDULER]- Verificando leads expirados (+24h)...")
+    leads_vencidos = [
+        lead for lead in buscar_leads_expirados_24h()
+        if not ignorar or lead['id'] not in ignorar
+    ]
 
-            marcar_lead_como_concluido(local_id)
-        else:
-            print(f"[SCHEDULER] - Falha ao atualizar Kommo para o lead {kommo_id}.")
+    if not leads_vencidos:
+        return set()
+
+    print(f"[SCHEDULER] Processando {len(leads_vencidos)} leads vencidos.")
+
+    texto_nota = (
+        "TIMEOUT AUTOMÁTICO (24H)\n"
+        "Passaram-se 24 horas desde a entrada do lead e não houve uma "
+        "identificação positiva clara nos números testados.\n"
+        "O Lead foi movido para Qualificação Humana para análise manual."
+    )
+    concluidos = _encerrar_leads_em_lote(
+        [(lead['id'], lead['kommo_lead_id']) for lead in leads_vencidos], texto_nota
+    )
+    print(f"[SCHEDULER] {len(concluidos)}/{len(leads_vencidos)} leads vencidos encerrados.")
+    return concluidos
 
 
 def move_leads_finalizados():
     """
     Verifica leads onde todos os números já foram processados
     e move eles para a Qualificação Humana.
+    Retorna os ids locais encerrados.
     """
     print("[SCHEDULER] Verificando leads para encerramento automático...")
     leads_esgotados = buscar_leads_para_finalizar_automaticamente()
 
     if not leads_esgotados:
         print("[SCHEDULER] Nenhum lead para encerrar.")
-        return
+        return set()
 
     print(f"[SCHEDULER] Encontrados {len(leads_esgotados)} leads para encerrar.")
 
-    for lead in leads_esgotados:
-        local_id = lead['lead_id']
-        kommo_id = lead['kommo_lead_id']
-
-        print(f"[SCHEDULER] - Encerrando Lead {kommo_id} (Todos os números processados).")
+    concluidos = _encerrar_leads_em_lote(
+        [(lead['lead_id'], lead['kommo_lead_id']) for lead in leads_esgotados],
+        "IDENTIFICAÇÃO FINALIZADA\nTodos os números vinculados a este lead foram contatados e finalizados."
+    )
+    print(f"[SCHEDULER] {len(concluidos)}/{len(leads_esgotados)} leads encerrados (Todos os números processados).")
+    return concluidos
 
-        sucesso_kommo = atualizar_status_lead_kommo(
-            kommo_id,
-            config.ID_STATUS_QUALIFICACAO_HUMANA
-        )
 
-        if sucesso_kommo:
-            criar_nota_lead_kommo(
-                kommo_id,
-                "IDENTIFICAÇÃO FINALIZADA\nTodos os números vinculados a este lead foram contatados e finalizados."
-            )
-            marcar_lead_como_concluido(local_id)
-        else:
-            print(f"[SCHEDULER]Falha ao atualizar Kommo para o lead {kommo_id}. Tentará no próximo ciclo.")
+def _processar_item_fila(item: dict):
+    lead_id = item['kommo_lead_id']
+    try:
+        if _parar.is_set():
+            # Encerrando: o item nem começou, devolve o número à fila
+            encerrar_lease(item['numero_id'], liberar=True)
+            return
+
+        payload = {
+            "id_lead": lead_id,
+            "service": "scheduler_autom",
+            "primeiro_nome": "Cliente"
+        }
+        print(f"[SCHEDULER] Executando Agente Iniciador para o Lead {lead_id}...")
+        iniciar_verificacao(payload)
+        print(f"[SCHEDULER] Processamento do Lead {lead_id} finalizado.")
+    finally:
+        # Normalmente o lease só para de ser renovado e expira (espera antes de tentar
+        # de novo um número que falhou). Encerrando, o número volta à fila na hora;
+        # se o envio saiu, o log já limpou o lease e isso não muda nada.
+        encerrar_lease(item['numero_id'], liberar=_parar.is_set())
+        with _lock_andamento:
+            _leads_em_andamento.discard(item['lead_id_local'])
+        _despertar.set()
 
 
 def worker_loop():
     """
+    Modo unitário: processa um lead por vez, em sequência, enquanto houver fila.
+    Com a fila vazia, dorme até o webhook do Kommo avisar que chegou trabalho.
+    O ritmo anti-bloqueio é o limite de envios de cada instância de saída.
     Critérios: Lead 'Em tratativa' | Número 'sem envio'
     """
     print("---INICIANDO SCHEDULER DE ENVIOS ---")
-    while True:
-        tempo_espera = calcula_tempo_de_espera()
-        minutos_display = tempo_espera // 60
-        segundos_display = tempo_espera % 60
+    ultima_varredura = None
 
-        print(f"\n[Aguardando {minutos_display}m {segundos_display}s para o próximo ciclo...")
-        time.sleep(tempo_espera)
+    while not _parar.is_set():
+        ultima_varredura = _varrer_se_preciso(ultima_varredura)
 
+        print("[SCHEDULER]Buscando próximo lead na fila...")
+        itens = []
         try:
-            move_leads_finalizados()
-            move_leads_expirados()
+            itens = reivindicar_lote_fila(1, config.ID_WORKER, config.LEASE_SEGUNDOS)
+
+            if itens:
+                item = itens[0]
+                print(f"[SCHEDULER] Lead encontrado! ID Kommo: {item['kommo_lead_id']}")
+                registrar_lease(item['numero_id'])
+                _processar_item_fila(item)
+            else:
+                print("[SCHEDULER] Fila vazia. Nenhum número pendente encontrado.")
+
         except Exception as e:
-            print(f"[SCHEDULER] Erro na varredura: {e}")
+            print(f"[SCHEDULER]Erro crítico no loop: {e}")
 
-        print("[SCHEDULER]Buscando próximo lead na fila...")
+        if not itens:
+            _aguardar_trabalho()
 
-        try:
-            proximo_item = buscar_proximo_lead_fila()
 
-            if proximo_item:
-                lead_id = proximo_item['kommo_lead_id']
-                print(f"[SCHEDULER] Lead encontrado! ID Kommo: {lead_id}")
-                payload = {
-                    "id_lead": lead_id,
-                    "service": "scheduler_autom",
-                    "primeiro_nome": "Cliente"
-                }
+def worker_loop_lote():
+    """
+    Modo lote: reivindica até SCHEDULER_LOTE leads da fila e os despacha para
+    um pool de workers. Acorda quando chega trabalho ou abre vaga no pool.
+    O ritmo anti-bloqueio é o limite de envios de cada instância de saída
+    (utils/rate_limiter.py), então a vazão cresce com o número de instâncias.
+    """
+    print(f"---INICIANDO SCHEDULER DE ENVIOS (MODO LOTE: {config.SCHEDULER_LOTE} leads, "
+          f"{config.SCHEDULER_WORKERS} workers) ---")
+    pool = PoolTrabalho("scheduler", config.SCHEDULER_WORKERS, config.SCHEDULER_LOTE)
+    ultima_varredura = None
 
-                print(f"[SCHEDULER] Executando Agente Iniciador...")
-                iniciar_verificacao(payload)
-                print(f"[SCHEDULER]Processamento do Lead {lead_id} finalizado.")
+    while not _parar.is_set():
+        ultima_varredura = _varrer_se_preciso(ultima_varredura)
 
-            else:
-                print("[SCHEDULER] Fila vazia. Nenhum número pendente encontrado.")
+        try:
+            with _lock_andamento:
+                vagas = config.SCHEDULER_LOTE - len(_leads_em_andamento)
+
+            if vagas > 0:
+                itens = reivindicar_lote_fila(vagas, config.ID_WORKER, config.LEASE_SEGUNDOS)
+                if itens:
+                    print(f"[SCHEDULER] {len(itens)} leads reivindicados da fila.")
+
+                for item in itens:
+                    registrar_lease(item['numero_id'])
+                    with _lock_andamento:
+                        _leads_em_andamento.add(item['lead_id_local'])
+                    if not pool.enviar(_processar_item_fila, item):
+                        encerrar_lease(item['numero_id'], liberar=True)
+                        with _lock_andamento:
+                            _leads_em_andamento.discard(item['lead_id_local'])
 
         except Exception as e:
             print(f"[SCHEDULER]Erro crítico no loop: {e}")
 
+        _aguardar_trabalho()
+
+    pool.encerrar(config.SCHEDULER_ENCERRAMENTO_TIMEOUT)
+
 
 if __name__ == "__main__":
-    try:
+    signal.signal(signal.SIGTERM, _pedir_parada)
+    signal.signal(signal.SIGINT, _pedir_parada)
+    threading.Thread(target=_loop_vigia_fila, name="vigia-fila", daemon=True).start()
+
+    if config.SCHEDULER_MODO == "lote":
+        worker_loop_lote()
+    else:
         worker_loop()
-    except KeyboardInterrupt:
-        print("\n[SCHEDULER] Parando o robô...")
\ No newline at end of file
+    print("[SCHEDULER] Parado.")
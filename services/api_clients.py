@@ -1,13 +1,27 @@
+import atexit
+import threading
+import time
+from urllib.parse import urlsplit
+
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
 from config import (
     KOMMO_API_TOKEN, KOMMO_API_SUBDOMAIN,
-    EVOLUTION_API_URL, EVOLUTION_API_KEY
+    EVOLUTION_API_URL, EVOLUTION_API_KEY,
+    HTTP_POOL_SIZE, KOMMO_CACHE_TTL, KOMMO_CACHE_IDADE_MAX, KOMMO_CACHE_MAX
 )
+from utils.cache import CacheTTL
+from utils.rate_limiter import limitador_envios
+
+# Uma Session por host (Kommo, Evolution...), compartilhada entre as threads.
+# Reaproveita conexões TCP/TLS em vez de refazer o handshake a cada envio.
+_sessoes = {}
+_sessoes_lock = threading.Lock()
+
 
-def get_robust_session():
+def _criar_sessao():
     session = requests.Session()
     retry_strategy = Retry(
         total=3,
@@ -15,22 +29,64 @@ def get_robust_session():
         status_forcelist=[429, 500, 502, 503, 504],
         allowed_methods=["POST", "GET"]
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=HTTP_POOL_SIZE,
+        pool_block=False,
+        max_retries=retry_strategy
+    )
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     return session
 
 
+def get_robust_session(url: str):
+    """Retorna a Session compartilhada do host da URL, criando-a na primeira vez."""
+    partes = urlsplit(url)
+    chave = (partes.scheme, partes.netloc)
+
+    session = _sessoes.get(chave)
+    if session:
+        return session
+
+    with _sessoes_lock:
+        session = _sessoes.get(chave)
+        if not session:
+            session = _criar_sessao()
+            _sessoes[chave] = session
+        return session
+
+
+def fechar_sessoes():
+    """Fecha todas as Sessions abertas (usado no encerramento do processo)."""
+    with _sessoes_lock:
+        for session in _sessoes.values():
+            session.close()
+        _sessoes.clear()
+
+
+atexit.register(fechar_sessoes)
+
 
 def enviar_mensagem_evolution(
         numero_destino: str,
         mensagem: str,
-        evolution_instance_id: str
+        evolution_instance_id: str,
+        prioritario: bool = False,
+        espera_max: float = None
 ):
+    """
+    Envia um texto pela instância. Respeita o limite de envios da instância:
+    prospecção espera o token (até `espera_max`, se informado); respostas
+    (prioritario=True) não esperam. Se o envio falhar, o token é devolvido.
+    """
     if not EVOLUTION_API_URL or not EVOLUTION_API_KEY:
         print("[API CLIENTS] Erro: Configurações da Evolution API não carregadas.")
         return None
 
+    if not limitador_envios.consumir(evolution_instance_id, prioritario, espera_max):
+        return None
+
     url = f"{EVOLUTION_API_URL}/message/sendText/{evolution_instance_id}"
     numero_formatado = numero_destino.lstrip('+')
 
@@ -47,13 +103,17 @@ def enviar_mensagem_evolution(
 
     print(f"[API CLIENTS] Enviando TEXTO (Instância: {evolution_instance_id}) para: {numero_formatado}...")
 
+    enviado = False
     try:
-        session = get_robust_session()
+        session = get_robust_session(url)
         response = session.post(url, headers=headers, json=data, timeout=30)
         response.raise_for_status()
+        enviado = True
         return response.json()
     except Exception as e:
         print(f"[API CLIENTS] Erro envio Evolution: {e}")
+        if not enviado:
+            limitador_envios.devolver(evolution_instance_id)
     return None
 
 
@@ -62,13 +122,17 @@ def enviar_midia_base64_evolution(
         evolution_instance_id: str,
         base64_data: str,
         nome_arquivo: str,
-        caption: str = ""
+        caption: str = "",
+        prioritario: bool = False
 ):
 
     if not EVOLUTION_API_URL or not EVOLUTION_API_KEY:
         print("[API CLIENTS] Erro: Configurações Evolution ausentes.")
         return None
 
+    if not limitador_envios.consumir(evolution_instance_id, prioritario):
+        return None
+
     url = f"{EVOLUTION_API_URL}/message/sendMedia/{evolution_instance_id}"
     numero_formatado = numero_destino.lstrip('+')
 
@@ -95,11 +159,13 @@ def enviar_midia_base64_evolution(
 
     print(f"[API CLIENTS] Enviando PDF via Base64 (Instância: {evolution_instance_id})...")
 
+    enviado = False
     try:
-        session = get_robust_session()
+        session = get_robust_session(url)
         response = session.post(url, headers=headers, json=data, timeout=60)
 
         response.raise_for_status()
+        enviado = True
         print("[API CLIENTS] PDF enviado com sucesso.")
         return response.json()
 
@@ -113,30 +179,153 @@ def enviar_midia_base64_evolution(
         except:
             pass
 
+    # O envio não saiu: o token volta, e o fallback para texto consome só o dele
+    if not enviado:
+        limitador_envios.devolver(evolution_instance_id)
     return None
 
-def _fazer_requisicao_kommo(url: str):
+def _fazer_requisicao_kommo(url: str, params=None, etag: str = None):
+    """
+    GET no Kommo. Com `etag`, faz a requisição condicional (If-None-Match).
+    Retorna (json ou None, etag da resposta, nao_modificado).
+    """
     if not KOMMO_API_TOKEN or not KOMMO_API_SUBDOMAIN:
-        return None
+        return None, None, False
     headers = {"Authorization": f"Bearer {KOMMO_API_TOKEN}"}
+    if etag:
+        headers["If-None-Match"] = etag
+    with _lock_metricas_kommo:
+        _metricas_kommo["chamadas_api"] += 1
     try:
-        session = get_robust_session()
-        response = session.get(url, headers=headers, timeout=20)
+        session = get_robust_session(url)
+        response = session.get(url, headers=headers, params=params, timeout=20)
         response.raise_for_status()
-        return response.json()
+        if response.status_code == 304:
+            return None, etag, True
+        if response.status_code == 204:
+            # O Kommo responde 204 (sem corpo) quando o filtro não encontra nada
+            return None, None, False
+        return response.json(), response.headers.get("ETag"), False
     except Exception as e:
         print(f"[API CLIENTS] Erro Kommo: {e}")
-    return None
+    return None, None, False
+
+
+# Cache dos payloads do Kommo (o limite da API é ~7 req/s por conta).
+# Cada entrada guarda {'dados', 'etag', 'updated_at', 'verificado_em'}:
+# - até KOMMO_CACHE_TTL desde a última verificação responde direto da memória;
+# - depois disso o lead é revalidado com If-None-Match (304 renova a entrada);
+# - o CacheTTL descarta a entrada de vez após KOMMO_CACHE_IDADE_MAX sem verificação.
+# Os webhooks leads[status]/leads[add] e os PATCHs deste processo invalidam o lead.
+cache_kommo_leads = CacheTTL(ttl=KOMMO_CACHE_IDADE_MAX, tamanho_maximo=KOMMO_CACHE_MAX)
+cache_kommo_contatos = CacheTTL(ttl=KOMMO_CACHE_IDADE_MAX, tamanho_maximo=KOMMO_CACHE_MAX)
+
+_lock_metricas_kommo = threading.Lock()
+_metricas_kommo = {"chamadas_api": 0, "economizadas": 0, "revalidadas_304": 0, "invalidacoes": 0}
+
+
+def _entrada_fresca(entrada) -> bool:
+    return entrada is not None and time.monotonic() - entrada['verificado_em'] < KOMMO_CACHE_TTL
+
+
+def _contar_kommo(metrica: str, quantidade: int = 1):
+    with _lock_metricas_kommo:
+        _metricas_kommo[metrica] += quantidade
+
+
+def _guardar_kommo(cache: CacheTTL, chave, dados: dict, etag: str = None):
+    cache.set(chave, {
+        'dados': dados,
+        'etag': etag,
+        'updated_at': dados.get('updated_at'),
+        'verificado_em': time.monotonic()
+    })
+
+
+def _como_inteiro(valor):
+    """int(valor), ou None se vier vazio ou inválido (campos de formulário do webhook)."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def invalidar_lead_kommo(id_lead, updated_at=None):
+    """
+    Descarta o lead do cache. Com `updated_at` (vindo do webhook), mantém a entrada
+    se ela já for dessa versão ou mais nova; sem ele (ou inválido), descarta sempre.
+    """
+    chave = _como_inteiro(id_lead)
+    if chave is None:
+        return
+    versao = _como_inteiro(updated_at)
+    if versao is not None:
+        entrada = cache_kommo_leads.get(chave)
+        versao_cache = _como_inteiro(entrada['updated_at']) if entrada else None
+        if versao_cache is not None and versao_cache >= versao:
+            return
+    cache_kommo_leads.invalidar(chave)
+    _contar_kommo("invalidacoes")
+
+
+def get_metricas_cache_kommo() -> dict:
+    with _lock_metricas_kommo:
+        metricas = dict(_metricas_kommo)
+    consultas = metricas["economizadas"] + metricas["chamadas_api"]
+    metricas["hit_rate"] = round(metricas["economizadas"] / consultas, 4) if consultas else 0.0
+    metricas["leads"] = cache_kommo_leads.metricas()
+    metricas["contatos"] = cache_kommo_contatos.metricas()
+    return metricas
 
 
 def consultar_lead_kommo(id_lead: str):
+    chave = int(id_lead)
+    entrada = cache_kommo_leads.get(chave)
+    if _entrada_fresca(entrada):
+        _contar_kommo("economizadas")
+        return entrada['dados']
+
     url = f"https://{KOMMO_API_SUBDOMAIN}.kommo.com/api/v4/leads/{id_lead}?with=contacts"
-    return _fazer_requisicao_kommo(url)
+    dados, etag, nao_modificado = _fazer_requisicao_kommo(url, etag=entrada['etag'] if entrada else None)
+    if nao_modificado:
+        _contar_kommo("revalidadas_304")
+        _guardar_kommo(cache_kommo_leads, chave, entrada['dados'], entrada['etag'])
+        return entrada['dados']
+    if dados:
+        _guardar_kommo(cache_kommo_leads, chave, dados, etag)
+    return dados
 
 
-def consultar_contato_kommo(id_contato: str):
-    url = f"https://{KOMMO_API_SUBDOMAIN}.kommo.com/api/v4/contacts/{id_contato}"
-    return _fazer_requisicao_kommo(url)
+def consultar_contatos_kommo(ids_contatos: list):
+    """
+    Busca vários contatos numa única chamada (GET /contacts?filter[id][]=...).
+    Os que estão frescos no cache não são pedidos de novo.
+    Retorna a lista de contatos (vazia se nenhum for encontrado).
+    """
+    if not ids_contatos:
+        return []
+
+    encontrados = {}
+    faltando = []
+    for id_contato in ids_contatos:
+        entrada = cache_kommo_contatos.get(int(id_contato))
+        if _entrada_fresca(entrada):
+            encontrados[int(id_contato)] = entrada['dados']
+        else:
+            faltando.append(int(id_contato))
+
+    if not faltando:
+        _contar_kommo("economizadas")
+    else:
+        url = f"https://{KOMMO_API_SUBDOMAIN}.kommo.com/api/v4/contacts"
+        params = [("filter[id][]", id_contato) for id_contato in faltando]
+        params.append(("limit", 250))
+        resposta, _, _ = _fazer_requisicao_kommo(url, params)
+        for contato in (resposta or {}).get('_embedded', {}).get('contacts', []):
+            _guardar_kommo(cache_kommo_contatos, int(contato['id']), contato)
+            encontrados[int(contato['id'])] = contato
+
+    return [encontrados[int(i)] for i in ids_contatos if int(i) in encontrados]
 
 
 def atualizar_status_lead_kommo(id_lead: int, novo_status_id: int):
@@ -161,9 +350,10 @@ def atualizar_status_lead_kommo(id_lead: int, novo_status_id: int):
     print(f"[API CLIENTS] Atualizando Lead {id_lead} no Kommo para status {novo_status_id}...")
 
     try:
-        session = get_robust_session()
+        session = get_robust_session(url)
         response = session.patch(url, headers=headers, json=data, timeout=20)
         response.raise_for_status()
+        invalidar_lead_kommo(id_lead)
         print("[API CLIENTS] Status do Lead atualizado com sucesso.")
         return response.json()
     except Exception as e:
@@ -201,7 +391,7 @@ def criar_nota_lead_kommo(id_lead_kommo: int, texto_nota: str):
     print(f"[API CLIENTS] Criando nota no Lead {id_lead_kommo}...")
 
     try:
-        session = get_robust_session()
+        session = get_robust_session(url)
         response = session.post(url, headers=headers, json=data, timeout=20)
         response.raise_for_status()
         print("[API CLIENTS] Nota criada com sucesso.")
@@ -213,4 +403,108 @@ def criar_nota_lead_kommo(id_lead_kommo: int, texto_nota: str):
         except:
             pass
 
-    return None
\ No newline at end of file
+    return None
+
+# Limite de entidades por chamada nos endpoints em lote do Kommo
+LIMITE_LOTE_KOMMO = 250
+
+
+def atualizar_status_leads_kommo(ids_leads: list, novo_status_id: int) -> set:
+    """
+    Atualiza o status de vários leads com PATCH /api/v4/leads (até 250 por chamada).
+    Se um lote for recusado, tenta os leads dele um a um para isolar o problemático.
+    Retorna o conjunto de ids atualizados com sucesso.
+    """
+    if not KOMMO_API_TOKEN or not KOMMO_API_SUBDOMAIN:
+        print("[API CLIENTS] Erro: Configurações do Kommo não carregadas.")
+        return set()
+
+    url = f"https://{KOMMO_API_SUBDOMAIN}.kommo.com/api/v4/leads"
+    headers = {
+        "Authorization": f"Bearer {KOMMO_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+
+    atualizados = set()
+    for i in range(0, len(ids_leads), LIMITE_LOTE_KOMMO):
+        lote = [int(id_lead) for id_lead in ids_leads[i:i + LIMITE_LOTE_KOMMO]]
+        data = [{"id": id_lead, "status_id": novo_status_id} for id_lead in lote]
+
+        print(f"[API CLIENTS] Atualizando {len(lote)} leads no Kommo para status {novo_status_id}...")
+        response = None
+        try:
+            session = get_robust_session(url)
+            response = session.patch(url, headers=headers, json=data, timeout=60)
+            response.raise_for_status()
+            retornados = response.json().get('_embedded', {}).get('leads', [])
+            confirmados = {int(lead['id']) for lead in retornados if lead.get('id') in lote}
+            atualizados.update(confirmados)
+            for id_lead in lote:
+                invalidar_lead_kommo(id_lead)
+            if len(confirmados) < len(lote):
+                print(f"[API CLIENTS] Kommo não confirmou {len(lote) - len(confirmados)} leads do lote: "
+                      f"{sorted(set(lote) - confirmados)}")
+            continue
+        except Exception as e:
+            print(f"[API CLIENTS] Erro no lote de leads do Kommo: {e}")
+            try:
+                print(response.text)
+            except:
+                pass
+
+        print(f"[API CLIENTS] Refazendo o lote de {len(lote)} leads um a um...")
+        falhas = []
+        for id_lead in lote:
+            if atualizar_status_lead_kommo(id_lead, novo_status_id):
+                atualizados.add(id_lead)
+            else:
+                falhas.append(id_lead)
+        if falhas:
+            print(f"[API CLIENTS] {len(falhas)} leads não foram atualizados no Kommo: {falhas}")
+
+    return atualizados
+
+
+def criar_notas_leads_kommo(notas: list) -> set:
+    """
+    Cria notas em vários leads com POST /api/v4/leads/notes (até 250 por chamada).
+    `notas` é uma lista de (id_lead, texto). Retorna os ids dos leads que receberam a nota.
+    """
+    if not KOMMO_API_TOKEN or not KOMMO_API_SUBDOMAIN:
+        print("[API CLIENTS] Erro: Configurações do Kommo não carregadas.")
+        return set()
+
+    url = f"https://{KOMMO_API_SUBDOMAIN}.kommo.com/api/v4/leads/notes"
+    headers = {
+        "Authorization": f"Bearer {KOMMO_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+
+    com_nota = set()
+    for i in range(0, len(notas), LIMITE_LOTE_KOMMO):
+        lote = notas[i:i + LIMITE_LOTE_KOMMO]
+        data = [
+            {"entity_id": int(id_lead), "note_type": "common", "params": {"text": texto}}
+            for id_lead, texto in lote
+        ]
+
+        print(f"[API CLIENTS] Criando {len(lote)} notas no Kommo...")
+        response = None
+        try:
+            session = get_robust_session(url)
+            response = session.post(url, headers=headers, json=data, timeout=60)
+            response.raise_for_status()
+            retornadas = response.json().get('_embedded', {}).get('notes', [])
+            confirmadas = {int(nota['entity_id']) for nota in retornadas if nota.get('entity_id')}
+            com_nota.update(confirmadas)
+            sem_nota = {int(id_lead) for id_lead, _ in lote} - confirmadas
+            if sem_nota:
+                print(f"[API CLIENTS] Kommo não confirmou a nota de {len(sem_nota)} leads: {sorted(sem_nota)}")
+        except Exception as e:
+            print(f"[API CLIENTS] Erro no lote de notas do Kommo: {e}")
+            try:
+                print(response.text)
+            except:
+                pass
+
+    return com_nota
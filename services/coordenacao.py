@@ -0,0 +1,104 @@
+import threading
+import time
+
+from config import ID_WORKER, LEASE_SEGUNDOS
+from services.db_manager import renovar_leases, liberar_lease_numero
+from services.db_pool import conexao_dedicada
+
+# Coordenação entre vários processos (schedulers e webhooks, na mesma máquina ou não):
+# - Leases: o número reivindicado fica com claimed_by = ID_WORKER até o envio.
+#   Uma thread renova os leases deste processo; se ele cair, o lease expira
+#   e outro worker pode pegar o número.
+# - Liderança: as varreduras rodam só no processo que segura o GET_LOCK do MySQL.
+
+_leases_ativos = set()
+_lock = threading.Lock()
+_thread_renovacao = None
+
+
+def _garantir_renovacao():
+    global _thread_renovacao
+    if _thread_renovacao is None:
+        _thread_renovacao = threading.Thread(target=_loop_renovacao, name="renovacao-leases", daemon=True)
+        _thread_renovacao.start()
+
+
+def _loop_renovacao():
+    while True:
+        time.sleep(LEASE_SEGUNDOS / 3)
+        with _lock:
+            numero_ids = list(_leases_ativos)
+        if numero_ids:
+            renovar_leases(ID_WORKER, numero_ids, LEASE_SEGUNDOS)
+
+
+def registrar_lease(numero_id: int):
+    """Passa a renovar o lease do número enquanto o processo estiver vivo."""
+    with _lock:
+        _garantir_renovacao()
+        _leases_ativos.add(numero_id)
+
+
+def encerrar_lease(numero_id: int, liberar: bool = False):
+    """
+    Para de renovar o lease. Com liberar=True o número volta à fila na hora
+    (usar só quando nada foi enviado); senão o lease apenas expira.
+    """
+    with _lock:
+        _leases_ativos.discard(numero_id)
+    if liberar:
+        liberar_lease_numero(numero_id, ID_WORKER)
+
+
+def get_metricas_leases() -> dict:
+    with _lock:
+        return {"id_worker": ID_WORKER, "leases_ativos": len(_leases_ativos)}
+
+
+class LockLideranca:
+    """
+    Eleição de líder com GET_LOCK do MySQL. O lock pertence a uma conexão
+    dedicada (fora do pool) e some sozinho se o processo ou a conexão cair,
+    aí outro processo assume na próxima checagem.
+    """
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self._conn = None
+
+    def _fechar(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def sou_lider(self) -> bool:
+        if self._conn:
+            try:
+                with self._conn.cursor() as cursor:
+                    cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.nome,))
+                    if cursor.fetchone()[0] == 1:
+                        return True
+            except Exception as e:
+                print(f"[COORDENACAO] Conexão do lock '{self.nome}' perdida: {e}")
+            self._fechar()
+
+        conn = None
+        try:
+            conn = conexao_dedicada()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (self.nome,))
+                if cursor.fetchone()[0] == 1:
+                    self._conn = conn
+                    print(f"[COORDENACAO] {ID_WORKER} assumiu a liderança de '{self.nome}'.")
+                    return True
+            conn.close()
+        except Exception as e:
+            print(f"[COORDENACAO] Erro ao disputar a liderança de '{self.nome}': {e}")
+            if conn:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        return False
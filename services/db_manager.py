@@ -1,23 +1,121 @@
 import pymysql
-from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
-from utils.phone_utils import limpar_numero_telefone
+from config import HISTORICO_MAX_MENSAGENS, HISTORICO_MAX_TOKENS, LEAD_CACHE_TTL, LEAD_CACHE_MAX, ENVIO_LIMITE_DIARIO
+from services.db_pool import pool
+from services.fila_escrita import fila_escrita
+from utils.cache import CacheTTL
+from utils.phone_utils import limpar_numero_telefone, normalizar_numero_telefone
 
 def get_db_connection():
+    """
+    Empresta uma conexão do pool. O conn.close() dos chamadores
+    devolve a conexão ao pool em vez de fechar o socket.
+    """
     try:
-        conn = pymysql.connect(
-            host=DB_HOST, user=DB_USER, password=DB_PASSWORD,
-            database=DB_NAME, connect_timeout=10, charset='utf8mb4'
-        )
-        return conn
+        return pool.obter()
+    except TimeoutError as err:
+        print(f"[DB MANAGER] Pool de conexões esgotado: {err}")
+        return None
     except pymysql.Error as err:
         print(f"[DB MANAGER] Erro ao conectar ao MySQL: {err}")
         return None
 
 
-def logar_envio_inicial_db(kommo_lead_id: int, kommo_contact_id: int, comprador_local_id: int, nome_contato: str,
-        telefones_encontrados: list, telefone_usado: str, mensagem_enviada: str
-):
-    """Salva o lead, os números e a primeira mensagem no banco de dados."""
+# Últimas N mensagens do número, via índice (numero_id, data_envio).
+# Busca N+1 para saber se a conversa foi truncada.
+SQL_HISTORICO_JANELA = """
+SELECT conteudo, remetente FROM (
+    SELECT id, conteudo, remetente, data_envio
+    FROM mensagens
+    WHERE numero_id = %s
+    ORDER BY data_envio DESC, id DESC
+    LIMIT %s
+) ultimas
+ORDER BY data_envio ASC, id ASC;
+"""
+
+
+def aplicar_janela_historico(historico: list):
+    """
+    Corta o histórico (em ordem cronológica, com até N+1 linhas) para as últimas
+    HISTORICO_MAX_MENSAGENS mensagens e para o orçamento de HISTORICO_MAX_TOKENS.
+    Retorna (historico, truncado).
+    """
+    truncado = len(historico) > HISTORICO_MAX_MENSAGENS
+    historico = historico[-HISTORICO_MAX_MENSAGENS:] if HISTORICO_MAX_MENSAGENS > 0 else historico
+
+    if HISTORICO_MAX_TOKENS > 0:
+        tokens = 0
+        inicio = len(historico)
+        while inicio > 0:
+            tokens += len(historico[inicio - 1]['conteudo'] or '') // 4 + 1
+            if tokens > HISTORICO_MAX_TOKENS:
+                break
+            inicio -= 1
+        if inicio > 0:
+            truncado = True
+            historico = historico[inicio:]
+
+    return historico, truncado
+
+
+def get_metricas_pool():
+    """Retorna as métricas do pool (em uso, aguardando, criadas, recicladas...)."""
+    return pool.metricas()
+
+
+# Metadados do lead (kommo id, nome do contato, nome do comprador) por ID local.
+# Invalidado pelas funções que escrevem no lead.
+cache_leads = CacheTTL(ttl=LEAD_CACHE_TTL, tamanho_maximo=LEAD_CACHE_MAX)
+
+SQL_METADADOS_LEAD = """
+SELECT
+    l.kommo_lead_id,
+    l.nome_contato,
+    c.nome as nome_responsavel
+FROM leads l
+LEFT JOIN compradores c ON l.comprador_id = c.id
+WHERE l.id = %s
+LIMIT 1
+"""
+
+
+def get_metricas_cache_leads():
+    return cache_leads.metricas()
+
+
+def buscar_metadados_lead(local_lead_id: int):
+    """
+    Retorna {'kommo_lead_id', 'nome_contato', 'nome_responsavel'} do lead
+    numa única consulta, servindo do cache quando possível.
+    """
+    metadados = cache_leads.get(local_lead_id)
+    if metadados:
+        return metadados
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor.execute(SQL_METADADOS_LEAD, (local_lead_id,))
+        metadados = cursor.fetchone()
+        cache_leads.set(local_lead_id, metadados)
+        return metadados
+    except Exception as e:
+        print(f"[DB MANAGER] Erro ao buscar metadados do lead: {e}")
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+    return None
+
+
+def logar_envio_inicial_db(local_lead_id: int, local_numero_id: int, mensagem_enviada: str):
+    """
+    Registra a primeira mensagem enviada: lead em tratativa, mensagem salva e número
+    'aguardando resposta' (liberando o lease), numa transação. O lead e os números já
+    foram gravados por sincronizar_numeros_lead antes do envio.
+    """
     print("[DB MANAGER] Logando envio inicial...")
     conn = None
     cursor = None
@@ -27,40 +125,28 @@ def logar_envio_inicial_db(kommo_lead_id: int, kommo_contact_id: int, comprador_
             raise Exception("Falha ao obter conexão com o DB.")
         cursor = conn.cursor()
 
-        sql_lead = """
-        INSERT INTO leads (kommo_lead_id, kommo_contact_id, comprador_id, nome_contato, status)
-        VALUES (%s, %s, %s, %s, 'Em tratativa')
-        ON DUPLICATE KEY UPDATE 
-            kommo_contact_id = VALUES(kommo_contact_id), 
-            comprador_id = VALUES(comprador_id),
-            nome_contato = VALUES(nome_contato),
-            status = IF(status = 'Concluído', 'Concluído', VALUES(status))
-        """
-        cursor.execute(sql_lead, (kommo_lead_id, kommo_contact_id, comprador_local_id, nome_contato))
-
-        cursor.execute("SELECT id FROM leads WHERE kommo_lead_id = %s", (kommo_lead_id,))
-        local_lead_id = cursor.fetchone()[0]
-
-        sql_numero = "INSERT IGNORE INTO contato_numeros (lead_id, numero) VALUES (%s, %s)"
-        for numero in telefones_encontrados:
-            cursor.execute(sql_numero, (local_lead_id, numero))
-
-        cursor.execute("SELECT id FROM contato_numeros WHERE lead_id = %s AND numero = %s",
-                       (local_lead_id, telefone_usado))
-        local_numero_id = cursor.fetchone()[0]
+        sql_lead = "UPDATE leads SET status = IF(status = 'Concluído', 'Concluído', 'Em tratativa') WHERE id = %s"
+        cursor.execute(sql_lead, (local_lead_id,))
 
         sql_mensagem = "INSERT INTO mensagens (numero_id, conteudo, remetente) VALUES (%s, %s, 'agente')"
         cursor.execute(sql_mensagem, (local_numero_id, mensagem_enviada))
 
-        sql_status = "UPDATE contato_numeros SET status = 'aguardando resposta' WHERE id = %s"
+        sql_status = """
+        UPDATE contato_numeros
+        SET status = 'aguardando resposta', claimed_by = NULL, claimed_until = NULL
+        WHERE id = %s
+        """
         cursor.execute(sql_status, (local_numero_id,))
 
         conn.commit()
-        print(f"[DB MANAGER] Log salvo com sucesso para o Lead {kommo_lead_id}.")
+        cache_leads.invalidar(local_lead_id)
+        print(f"[DB MANAGER] Log salvo com sucesso para o Lead {local_lead_id}.")
+        return True
 
     except Exception as e:
         print(f"[DB MANAGER] ERRO CRÍTICO ao salvar log: {e}")
         if conn: conn.rollback()
+        return False
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
@@ -74,10 +160,7 @@ def buscar_contexto_conversa(numero_remetente_limpo: str):
     conn = None
     cursor = None
 
-    termo_busca_1 = f"+{numero_remetente_limpo}"
-    termo_busca_2 = None
-    if numero_remetente_limpo.startswith('55') and len(numero_remetente_limpo) == 12:
-        termo_busca_2 = f"+{numero_remetente_limpo[0:4]}9{numero_remetente_limpo[4:]}"
+    numero_normalizado = normalizar_numero_telefone(numero_remetente_limpo)
 
     try:
         conn = get_db_connection()
@@ -89,34 +172,44 @@ def buscar_contexto_conversa(numero_remetente_limpo: str):
             l.id as lead_id, 
             cn.id as numero_id,
             cn.numero as numero_encontrado,
-            cn.status as status_atual  -- <--- NOVO CAMPO RECUPERADO
+            cn.status as status_atual,  -- <--- NOVO CAMPO RECUPERADO
+            cn.resumo_historico
         FROM 
             contato_numeros cn
         JOIN 
             leads l ON cn.lead_id = l.id
         WHERE 
-            TRIM(cn.numero) = %s OR TRIM(cn.numero) = %s
+            cn.numero_normalizado = %s
         LIMIT 1;
         """
-        cursor.execute(sql_find_lead, (termo_busca_1, termo_busca_2))
+        cursor.execute(sql_find_lead, (numero_normalizado,))
         ids = cursor.fetchone()
 
         if not ids:
-            raise Exception(f"Nenhum lead encontrado para {termo_busca_1}")
+            raise Exception(f"Nenhum lead encontrado para +{numero_normalizado}")
+
+        # Leitura das próprias escritas: se ainda há mensagem/status deste número na
+        # fila_escrita, espera a gravação e relê num snapshot novo (commit encerra o atual)
+        if fila_escrita.tem_pendencias(ids['numero_id']):
+            fila_escrita.aguardar(ids['numero_id'])
+            conn.commit()
+            cursor.execute(sql_find_lead, (numero_normalizado,))
+            ids = cursor.fetchone()
 
         lead_id = ids['lead_id']
         numero_id = ids['numero_id']
         status_atual = ids['status_atual']
 
-        sql_find_history = "SELECT conteudo, remetente FROM mensagens WHERE numero_id = %s ORDER BY data_envio ASC;"
-        cursor.execute(sql_find_history, (numero_id,))
-        historico = cursor.fetchall()
+        cursor.execute(SQL_HISTORICO_JANELA, (numero_id, HISTORICO_MAX_MENSAGENS + 1))
+        historico, truncado = aplicar_janela_historico(list(cursor.fetchall()))
 
         return {
             "lead_id": lead_id,
             "numero_id": numero_id,
             "status_atual": status_atual,
-            "historico_chat": list(historico)
+            "historico_chat": historico,
+            "historico_truncado": truncado,
+            "resumo_historico": ids['resumo_historico']
         }
 
     except Exception as e:
@@ -127,72 +220,67 @@ def buscar_contexto_conversa(numero_remetente_limpo: str):
         if conn: conn.close()
 
 
-def salvar_mensagem_usuario(numero_id: int, conteudo: str):
-    """Salva a mensagem recebida do usuário e atualiza o status."""
+def buscar_historico_completo(numero_id: int):
+    """
+    Todas as mensagens do número, em ordem (para as notas do Kommo, não para a LLM).
+    Espera antes as escritas pendentes do número na fila_escrita.
+    Retorna a lista de {conteudo, remetente} ou None em caso de erro.
+    """
     conn = None
     cursor = None
     try:
+        fila_escrita.aguardar(numero_id)
         conn = get_db_connection()
         if not conn:
             raise Exception("Falha na conexão com DB.")
-        cursor = conn.cursor()
-
-        sql_msg = "INSERT INTO mensagens (numero_id, conteudo, remetente) VALUES (%s, %s, 'usuario')"
-        cursor.execute(sql_msg, (numero_id, conteudo))
-
-        sql_status = "UPDATE contato_numeros SET status = 'em tratativa' WHERE id = %s AND status = 'aguardando resposta';"
-        cursor.execute(sql_status, (numero_id,))
-
-        conn.commit()
-        print(f"[DB MANAGER] Mensagem do usuário salva no DB.")
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        sql = "SELECT conteudo, remetente FROM mensagens WHERE numero_id = %s ORDER BY data_envio ASC, id ASC"
+        cursor.execute(sql, (numero_id,))
+        return list(cursor.fetchall())
     except Exception as e:
-        print(f"[DB MANAGER] ERRO ao salvar msg do usuário: {e}")
-        if conn: conn.rollback()
+        print(f"[DB MANAGER] ERRO ao buscar histórico completo: {e}")
+        return None
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
 
-def atualizar_status_contato(numero_id: int, novo_status: str):
-    """Função auxiliar para atualizar o status final no DB."""
-    print(f"[DB MANAGER] Atualizando status para '{novo_status}'...")
+def salvar_mensagem_usuario(numero_id: int, conteudo: str):
+    """
+    Enfileira a mensagem recebida do usuário e a troca de status
+    ('aguardando resposta' -> 'em tratativa'). Gravadas em lote pela fila_escrita.
+    """
+    fila_escrita.enfileirar(('msg', numero_id, conteudo, 'usuario'))
+    fila_escrita.enfileirar(('status', numero_id, 'em tratativa', True))
+
+
+def salvar_resumo_historico(numero_id: int, resumo: str):
+    """Guarda o resumo acumulado das mensagens antigas do número."""
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        sql = "UPDATE contato_numeros SET status = %s WHERE id = %s"
-        cursor.execute(sql, (novo_status, numero_id))
+        sql = "UPDATE contato_numeros SET resumo_historico = %s WHERE id = %s"
+        cursor.execute(sql, (resumo, numero_id))
         conn.commit()
     except Exception as e:
-        print(f"[DB MANAGER] ERRO ao atualizar status: {e}")
+        print(f"[DB MANAGER] ERRO ao salvar resumo do histórico: {e}")
         if conn: conn.rollback()
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
 
-def salvar_mensagem_agente(numero_id: int, conteudo: str):
-    """Salva a resposta do AGENTE no banco."""
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        if not conn:
-            raise Exception("Falha na conexão com DB.")
+def atualizar_status_contato(numero_id: int, novo_status: str):
+    """Função auxiliar para atualizar o status final no DB (via fila_escrita)."""
+    print(f"[DB MANAGER] Atualizando status para '{novo_status}'...")
+    fila_escrita.enfileirar(('status', numero_id, novo_status, False))
 
-        cursor = conn.cursor()
-        sql = "INSERT INTO mensagens (numero_id, conteudo, remetente) VALUES (%s, %s, 'agente')"
-        cursor.execute(sql, (numero_id, conteudo))
-        conn.commit()
-        print(f"[DB MANAGER] Mensagem do AGENTE salva no DB.")
 
-    except Exception as e:
-        print(f"[DB MANAGER] ERRO ao salvar msg do agente: {e}")
-        if conn: conn.rollback()
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
+def salvar_mensagem_agente(numero_id: int, conteudo: str):
+    """Enfileira a resposta do AGENTE para gravação em lote."""
+    fila_escrita.enfileirar(('msg', numero_id, conteudo, 'agente'))
 
 
 def find_comprador_local_id(kommo_user_id: int):
@@ -215,10 +303,40 @@ def find_comprador_local_id(kommo_user_id: int):
     return None
 
 
+# Fração do limite diário que a instância já usou hoje (0 se ainda não enviou).
+# Ordenar por ela distribui os envios proporcionalmente à capacidade de cada número.
+_FRACAO_USO_HOJE = (
+    "COALESCE((SELECT IF(le.dia = CURDATE(), le.envios_dia, 0) / NULLIF(COALESCE(le.limite_diario, %s), 0) "
+    "FROM limites_envio le WHERE le.evolution_instance_id = numeros_outbound.evolution_instance_id), 0)"
+)
+
+# Escolhe e reserva o número num único UPDATE: as linhas ficam travadas durante a
+# escolha, então chamadas simultâneas enxergam o contagem_uso já incrementado.
+# Candidatos da UF e 'todos' na mesma passada: primeiro os que ainda têm capacidade
+# hoje, depois a UF exata, depois o menos usado proporcionalmente ao limite diário.
+# LAST_INSERT_ID(id) devolve o id escolhido na mesma conexão.
+SQL_RESERVAR_OUTBOUND = f"""
+UPDATE numeros_outbound
+SET contagem_uso = contagem_uso + 1,
+    data_ultimo_uso = CURRENT_TIMESTAMP,
+    id = LAST_INSERT_ID(id)
+WHERE comprador_id = %s
+  AND uf IN (%s, 'todos')
+  AND status = 'ativo'
+ORDER BY
+    {_FRACAO_USO_HOJE} >= 1 ASC,
+    uf = 'todos' ASC,
+    {_FRACAO_USO_HOJE} ASC,
+    contagem_uso ASC,
+    data_ultimo_uso ASC
+LIMIT 1;
+"""
+
+
 def find_outbound_number(comprador_id: int, uf: str):
     """
     Encontra o melhor número de saída (outbound) para um comprador,
-    baseado na UF do cliente. Faz rodízio (round-robin) pelo menos usado.
+    baseado na UF do cliente, e já registra o uso (de forma atômica).
     """
     print(f"[DB MANAGER] Buscando número de saída para Comprador ID: {comprador_id}, UF: {uf}")
     conn = None
@@ -230,46 +348,20 @@ def find_outbound_number(comprador_id: int, uf: str):
             raise Exception("Falha na conexão com DB.")
         cursor = conn.cursor(pymysql.cursors.DictCursor)
 
-        sql_find = """
-        SELECT id, numero, evolution_instance_id 
-        FROM numeros_outbound
-        WHERE comprador_id = %s
-          AND uf = %s
-          AND status = 'ativo'
-        ORDER BY contagem_uso ASC, data_ultimo_uso ASC
-        LIMIT 1;
-        """
-        cursor.execute(sql_find, (comprador_id, uf))
-        numero_encontrado = cursor.fetchone()
-
-        if not numero_encontrado:
-            print(f"[DB MANAGER] Nenhum número específico para UF '{uf}'. Procurando por 'todos'.")
-            sql_find_coringa = """
-            SELECT id, numero, evolution_instance_id 
-            FROM numeros_outbound
-            WHERE comprador_id = %s
-              AND uf = 'todos'
-              AND status = 'ativo'
-            ORDER BY contagem_uso ASC, data_ultimo_uso ASC
-            LIMIT 1;
-            """
-            cursor.execute(sql_find_coringa, (comprador_id,))
-            numero_encontrado = cursor.fetchone()
-
-        if not numero_encontrado:
+        cursor.execute(SQL_RESERVAR_OUTBOUND, (comprador_id, uf, ENVIO_LIMITE_DIARIO, ENVIO_LIMITE_DIARIO))
+        if not cursor.rowcount:
             raise Exception(f"Nenhum número 'ativo' encontrado para o comprador {comprador_id} (UF: {uf} ou 'todos')")
 
-        numero_outbound_id = numero_encontrado['id']
-
-        sql_update_uso = """
-        UPDATE numeros_outbound
-        SET contagem_uso = contagem_uso + 1,
-            data_ultimo_uso = CURRENT_TIMESTAMP
-        WHERE id = %s;
-        """
-        cursor.execute(sql_update_uso, (numero_outbound_id,))
+        cursor.execute("""
+        SELECT numero, evolution_instance_id, uf
+        FROM numeros_outbound
+        WHERE id = LAST_INSERT_ID()
+        """)
+        numero_encontrado = cursor.fetchone()
         conn.commit()
 
+        if numero_encontrado['uf'] != uf:
+            print(f"[DB MANAGER] Número da UF '{uf}' indisponível. Usando um número 'todos'.")
         print(
             f"[DB MANAGER] Número de saída selecionado: {numero_encontrado['numero']} (Instância: {numero_encontrado['evolution_instance_id']})")
 
@@ -289,83 +381,105 @@ def find_outbound_number(comprador_id: int, uf: str):
 
 def get_nome_responsavel_por_lead(lead_id: int):
     """Retorna o nome do comprador responsável pelo lead."""
+    metadados = buscar_metadados_lead(lead_id)
+    return metadados['nome_responsavel'] if metadados else None
+
+
+def reservar_envio_instancia(instance_id: str, envios_por_hora: float, rajada: int, limite_diario: int,
+                             prioritario: bool = False):
+    """
+    Token bucket da instância, com o estado na tabela limites_envio.
+    A linha é travada (FOR UPDATE), então processos diferentes (scheduler, webhook)
+    reservam em fila. Um envio que precisa esperar já reserva seu token (o saldo
+    fica negativo) e quem chega depois espera atrás dele.
+    Envios prioritários (respostas numa conversa) consomem token, mas não esperam
+    nem são barrados pelo limite diário.
+
+    Retorna {'espera': segundos, 'limite_atingido': bool} ou None em caso de erro.
+    """
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
+        if not conn:
+            raise Exception("Falha na conexão com DB.")
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
 
-        sql = """
-        SELECT c.nome 
-        FROM leads l
-        JOIN compradores c ON l.comprador_id = c.id
-        WHERE l.id = %s
-        LIMIT 1
-        """
-        cursor.execute(sql, (lead_id,))
-        resultado = cursor.fetchone()
+        # Relógio do banco, o mesmo para todos os processos
+        cursor.execute("SELECT UNIX_TIMESTAMP(NOW(6)) AS agora, CURDATE() AS hoje")
+        relogio = cursor.fetchone()
+        agora = float(relogio['agora'])
+        hoje = relogio['hoje']
+
+        cursor.execute("""
+        INSERT IGNORE INTO limites_envio (evolution_instance_id, tokens, atualizado_em, dia, envios_dia)
+        VALUES (%s, %s, %s, %s, 0)
+        """, (instance_id, rajada, agora, hoje))
+        cursor.execute("SELECT * FROM limites_envio WHERE evolution_instance_id = %s FOR UPDATE", (instance_id,))
+        linha = cursor.fetchone()
+
+        taxa = linha['envios_por_hora'] or envios_por_hora
+        capacidade = linha['rajada'] or rajada
+        teto_diario = linha['limite_diario'] or limite_diario
+
+        tokens = min(capacidade, linha['tokens'] + (agora - linha['atualizado_em']) * taxa / 3600.0)
+        envios_dia = linha['envios_dia'] if linha['dia'] == hoje else 0
+
+        if not prioritario and teto_diario and envios_dia >= teto_diario:
+            conn.commit()
+            return {'espera': 0.0, 'limite_atingido': True}
+
+        espera = 0.0
+        if prioritario:
+            # A dívida das respostas fica limitada a 1h de envios, para não travar a prospecção o dia todo
+            tokens = max(tokens - 1, -taxa)
+        else:
+            if tokens < 1:
+                espera = (1 - tokens) * 3600.0 / taxa
+            tokens -= 1
+
+        cursor.execute("""
+        UPDATE limites_envio
+        SET tokens = %s, atualizado_em = %s, dia = %s, envios_dia = %s
+        WHERE evolution_instance_id = %s
+        """, (tokens, agora, hoje, envios_dia + 1, instance_id))
+        conn.commit()
 
-        if resultado:
-            return resultado[0]
+        return {'espera': espera, 'limite_atingido': False}
 
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao buscar nome do responsável: {e}")
+        print(f"[DB MANAGER] Erro ao reservar envio da instância {instance_id}: {e}")
+        if conn: conn.rollback()
+        return None
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
-    return None
-
 
-def get_template_mensagem_balanceado(tipo: str):
-    """
-    Busca um template de mensagem ativo para o tipo especificado,
-    usando lógica de load balance (menor uso primeiro).
-    """
+def devolver_envio_instancia(instance_id: str):
+    """Devolve o token de um envio reservado que acabou não saindo."""
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-
-        sql_select = """
-        SELECT id, texto 
-        FROM templates_mensagem 
-        WHERE tipo = %s AND status = 'ativo'
-        ORDER BY contagem_uso ASC, id ASC
-        LIMIT 1
+        cursor = conn.cursor()
+        sql = """
+        UPDATE limites_envio
+        SET tokens = tokens + 1, envios_dia = GREATEST(envios_dia - 1, 0)
+        WHERE evolution_instance_id = %s
         """
-        cursor.execute(sql_select, (tipo,))
-        resultado = cursor.fetchone()
-
-        if not resultado:
-            print(f"[DB MANAGER] AVISO: Nenhum template encontrado para o tipo '{tipo}'")
-            return None
-
-        template_id = resultado['id']
-        texto_raw = resultado['texto']
-
-        sql_update = "UPDATE templates_mensagem SET contagem_uso = contagem_uso + 1 WHERE id = %s"
-        cursor.execute(sql_update, (template_id,))
+        cursor.execute(sql, (instance_id,))
         conn.commit()
-
-        return texto_raw
-
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao buscar template de mensagem: {e}")
+        print(f"[DB MANAGER] Erro ao devolver envio da instância {instance_id}: {e}")
         if conn: conn.rollback()
-        return None
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
 
-def buscar_proximo_lead_fila():
-    """
-    Busca o próximo número disponível para envio.
-    Regra: Lead 'Em tratativa' E Número 'sem envio'.
-    Prioridade: Leads mais antigos primeiro (FIFO).
-    """
+def buscar_templates_ativos():
+    """Todos os templates ativos: lista de {id, tipo, texto, contagem_uso}."""
     conn = None
     cursor = None
     try:
@@ -373,117 +487,277 @@ def buscar_proximo_lead_fila():
         cursor = conn.cursor(pymysql.cursors.DictCursor)
 
         sql = """
-        SELECT 
-            l.kommo_lead_id,
-            l.id as lead_id_local,
-            cn.id as numero_id,
-            cn.numero
-        FROM 
-            contato_numeros cn
-        JOIN 
-            leads l ON cn.lead_id = l.id
-        WHERE 
-            l.status = 'Em tratativa' 
-            AND cn.status = 'sem envio'
-        ORDER BY 
-            l.data_criacao ASC -- Os mais antigos primeiro
-        LIMIT 1;
+        SELECT id, tipo, texto, contagem_uso
+        FROM templates_mensagem
+        WHERE status = 'ativo'
         """
         cursor.execute(sql)
-        resultado = cursor.fetchone()
-        return resultado
+        return cursor.fetchall()
 
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao buscar fila: {e}")
+        print(f"[DB MANAGER] Erro ao buscar templates de mensagem: {e}")
         return None
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
 
-def sincronizar_numeros_lead(kommo_lead_id: int, lista_numeros_api: list):
-    """
-    Pega a lista de números vinda do Kommo e garante que todos
-    estejam no banco. Se for novo, entra como 'sem envio'.
-    """
+def incrementar_uso_templates(incrementos: dict) -> bool:
+    """Soma os usos acumulados ({template_id: quantidade}) num único UPDATE."""
+    if not incrementos:
+        return True
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        sql_get_id = "SELECT id FROM leads WHERE kommo_lead_id = %s"
-        cursor.execute(sql_get_id, (kommo_lead_id,))
-        res = cursor.fetchone()
+        casos = " ".join(["WHEN %s THEN %s"] * len(incrementos))
+        sql = f"""
+        UPDATE templates_mensagem
+        SET contagem_uso = contagem_uso + CASE id {casos} ELSE 0 END
+        WHERE id IN ({', '.join(['%s'] * len(incrementos))})
+        """
+        params = [valor for par in incrementos.items() for valor in par] + list(incrementos)
+        cursor.execute(sql, params)
+        conn.commit()
+        return True
 
-        local_lead_id = None
-        if res:
-            local_lead_id = res[0]
-        else:
-            cursor.execute("INSERT INTO leads (kommo_lead_id, kommo_contact_id) VALUES (%s, 0)", (kommo_lead_id,))
-            local_lead_id = cursor.lastrowid
+    except Exception as e:
+        print(f"[DB MANAGER] Erro ao gravar uso dos templates: {e}")
+        if conn: conn.rollback()
+        return False
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
 
-        sql_insert_num = """
-        INSERT IGNORE INTO contato_numeros (lead_id, numero, status)
-        VALUES (%s, %s, 'sem envio')
-        """
 
-        for num_raw in lista_numeros_api:
-            num_limpo = limpar_numero_telefone(num_raw)
+# Fila de envio: o primeiro número 'sem envio' (menor id) de cada lead, leads mais
+# antigos primeiro. O contador leads.numeros_sem_envio (mantido por trigger) descarta
+# os leads que só aguardam resposta sem tocar em contato_numeros; o índice
+# (status, data_criacao) entrega os leads já ordenados, então o LIMIT para cedo.
+# A ordenação usa só colunas de `leads` para não cair num filesort do JOIN.
+# Leads com lease ativo ficam de fora e a linha do lead é travada (SKIP LOCKED).
+SQL_FILA_LOTE = """
+SELECT 
+    l.kommo_lead_id,
+    l.id as lead_id_local,
+    cn.id as numero_id,
+    cn.numero
+FROM 
+    leads l
+JOIN 
+    contato_numeros cn ON cn.id = (
+        SELECT MIN(pendente.id) FROM contato_numeros pendente
+        WHERE pendente.lead_id = l.id AND pendente.status = 'sem envio'
+    )
+WHERE 
+    l.status = 'Em tratativa' 
+    AND l.numeros_sem_envio > 0
+    AND NOT EXISTS (
+        SELECT 1 FROM contato_numeros ativo
+        WHERE ativo.lead_id = l.id AND ativo.claimed_until > NOW()
+    )
+ORDER BY 
+    l.data_criacao ASC
+LIMIT %s
+FOR UPDATE OF l SKIP LOCKED;
+"""
+
+
+def reivindicar_lote_fila(limite: int, id_worker: str, lease_segundos: int):
+    """
+    Reivindica até `limite` itens da fila (um número por lead), leads mais antigos
+    primeiro (FIFO), gravando um lease (claimed_by/claimed_until)
+    em cada número. Leads com algum número sob lease ativo ficam de fora.
+    A linha do lead é travada com SKIP LOCKED, então dois workers reivindicando
+    ao mesmo tempo pegam leads diferentes em vez de esperar.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
 
-            if len(num_limpo) > 8:
-                cursor.execute(sql_insert_num, (local_lead_id, num_limpo))
+        cursor.execute(SQL_FILA_LOTE, (limite,))
+        candidatos = cursor.fetchall()
+
+        # O UPDATE lê a versão mais recente da linha: se outro worker gravou o lease
+        # depois do nosso SELECT, a condição falha e o lead fica com ele.
+        sql_lease = """
+        UPDATE contato_numeros
+        SET claimed_by = %s, claimed_until = NOW() + INTERVAL %s SECOND
+        WHERE id = %s
+          AND status = 'sem envio'
+          AND (claimed_until IS NULL OR claimed_until <= NOW())
+        """
+        itens = []
+        for item in candidatos:
+            cursor.execute(sql_lease, (id_worker, lease_segundos, item['numero_id']))
+            if cursor.rowcount:
+                itens.append(item)
 
         conn.commit()
-        print(f"[DB MANAGER] Sincronização de números concluída para o Lead {kommo_lead_id}.")
-        return local_lead_id
+        return itens
 
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao sincronizar números: {e}")
+        print(f"[DB MANAGER] Erro ao reivindicar lote da fila: {e}")
         if conn: conn.rollback()
-        return None
+        return []
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
 
-def buscar_proximo_numero_sem_envio(kommo_lead_id: int):
+def reivindicar_proximo_numero(kommo_lead_id: int, id_worker: str, lease_segundos: int):
     """
-    Retorna o primeiro número do lead que ainda está 'sem envio'.
+    Primeiro número 'sem envio' do lead (menor id), gravando o lease para este worker.
+    Retorna {'id', 'numero'} ou None se não houver número livre (ou se outro
+    worker já estiver com ele).
     """
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
 
         sql = """
-        SELECT cn.numero 
+        SELECT cn.id, cn.numero, cn.claimed_by, cn.claimed_until > NOW() AS lease_ativo
         FROM contato_numeros cn
         JOIN leads l ON cn.lead_id = l.id
         WHERE l.kommo_lead_id = %s 
           AND cn.status = 'sem envio'
         ORDER BY cn.id ASC        
-        LIMIT 1;
+        LIMIT 1
+        FOR UPDATE OF cn;
         """
         cursor.execute(sql, (kommo_lead_id,))
         res = cursor.fetchone()
 
-        if res:
-            return res[0]
+        if not res:
+            conn.commit()
+            return None
+
+        if res['lease_ativo'] and res['claimed_by'] != id_worker:
+            print(f"[DB MANAGER] Número {res['numero']} já reivindicado por {res['claimed_by']}.")
+            conn.commit()
+            return None
+
+        cursor.execute("""
+        UPDATE contato_numeros
+        SET claimed_by = %s, claimed_until = NOW() + INTERVAL %s SECOND
+        WHERE id = %s
+        """, (id_worker, lease_segundos, res['id']))
+        conn.commit()
+        return {'id': res['id'], 'numero': res['numero']}
+
+    except Exception as e:
+        print(f"[DB MANAGER] Erro ao reivindicar próximo número: {e}")
+        if conn: conn.rollback()
         return None
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+
+def renovar_leases(id_worker: str, numero_ids: list, lease_segundos: int):
+    """Estende os leases ainda deste worker. Retorna quantos foram renovados."""
+    if not numero_ids:
+        return 0
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        sql = f"""
+        UPDATE contato_numeros
+        SET claimed_until = NOW() + INTERVAL %s SECOND
+        WHERE claimed_by = %s AND id IN ({', '.join(['%s'] * len(numero_ids))})
+        """
+        cursor.execute(sql, (lease_segundos, id_worker, *numero_ids))
+        conn.commit()
+        return cursor.rowcount
+    except Exception as e:
+        print(f"[DB MANAGER] Erro ao renovar leases: {e}")
+        if conn: conn.rollback()
+        return 0
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
 
+def liberar_lease_numero(numero_id: int, id_worker: str):
+    """Devolve o número à fila (só se o lease ainda for deste worker)."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        sql = "UPDATE contato_numeros SET claimed_by = NULL, claimed_until = NULL WHERE id = %s AND claimed_by = %s"
+        cursor.execute(sql, (numero_id, id_worker))
+        conn.commit()
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao buscar próximo número: {e}")
+        print(f"[DB MANAGER] Erro ao liberar lease: {e}")
+        if conn: conn.rollback()
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+
+def notificar_fila():
+    """Avisa os schedulers (de qualquer máquina) que chegou trabalho novo na fila."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE fila_eventos SET sequencia = sequencia + 1 WHERE id = 1")
+        conn.commit()
+    except Exception as e:
+        print(f"[DB MANAGER] Erro ao notificar a fila: {e}")
+        if conn: conn.rollback()
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+
+def ler_sequencia_fila():
+    """Sequência atual de eventos da fila (None em caso de erro)."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT sequencia FROM fila_eventos WHERE id = 1")
+        res = cursor.fetchone()
+        return res[0] if res else None
+    except Exception as e:
+        print(f"[DB MANAGER] Erro ao ler a sequência da fila: {e}")
         return None
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
 
-def get_kommo_id_from_local(local_lead_id: int):
+# Upsert do lead devolvendo o id em LAST_INSERT_ID() (inserido ou já existente)
+SQL_UPSERT_LEAD = """
+INSERT INTO leads (kommo_lead_id, kommo_contact_id, comprador_id, nome_contato)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    id = LAST_INSERT_ID(id),
+    kommo_contact_id = VALUES(kommo_contact_id),
+    comprador_id = VALUES(comprador_id),
+    nome_contato = VALUES(nome_contato)
+"""
+
+
+def sincronizar_numeros_lead(kommo_lead_id: int, kommo_contact_id: int, comprador_local_id: int,
+                             nome_contato: str, lista_numeros_api: list):
     """
-    Recebe o ID local (PK) e retorna o ID original do Kommo.
+    Pega a lista de números vinda do Kommo e garante que o lead e todos os números
+    estejam no banco, numa transação. Se for novo, o número entra como 'sem envio'.
+    Idempotente: num retry do webhook só os números que faltam são inseridos
+    (num único INSERT multi-linha). Retorna o id local do lead.
     """
     conn = None
     cursor = None
@@ -491,20 +765,70 @@ def get_kommo_id_from_local(local_lead_id: int):
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        sql = "SELECT kommo_lead_id FROM leads WHERE id = %s"
-        cursor.execute(sql, (local_lead_id,))
-        resultado = cursor.fetchone()
+        cursor.execute(SQL_UPSERT_LEAD, (kommo_lead_id, kommo_contact_id or 0, comprador_local_id, nome_contato))
+        local_lead_id = cursor.lastrowid
 
-        if resultado:
-            return resultado[0]
+        novos = {}
+        for num_raw in lista_numeros_api:
+            num_limpo = limpar_numero_telefone(num_raw)
+            if len(num_limpo) > 8:
+                novos.setdefault(normalizar_numero_telefone(num_limpo), num_limpo)
+
+        if novos:
+            cursor.execute(
+                f"SELECT numero_normalizado FROM contato_numeros WHERE lead_id = %s AND numero_normalizado IN ({', '.join(['%s'] * len(novos))})",
+                [local_lead_id, *novos]
+            )
+            for (normalizado,) in cursor.fetchall():
+                novos.pop(normalizado, None)
+
+        if novos:
+            # ON DUPLICATE KEY no lugar de INSERT IGNORE: só engole a corrida com outro
+            # worker inserindo o mesmo número, não outros erros
+            valores = ", ".join(["(%s, %s, %s, 'sem envio')"] * len(novos))
+            params = []
+            for normalizado, numero in novos.items():
+                params.extend((local_lead_id, numero, normalizado))
+            cursor.execute(f"""
+            INSERT INTO contato_numeros (lead_id, numero, numero_normalizado, status)
+            VALUES {valores}
+            ON DUPLICATE KEY UPDATE id = id
+            """, params)
+
+        conn.commit()
+        cache_leads.invalidar(local_lead_id)
+        print(f"[DB MANAGER] Sincronização de números concluída para o Lead {kommo_lead_id} ({len(novos)} novos).")
+        return local_lead_id
 
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao buscar Kommo ID: {e}")
+        print(f"[DB MANAGER] Erro ao sincronizar números: {e}")
+        if conn: conn.rollback()
+        return None
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
 
-    return None
+
+def get_kommo_id_from_local(local_lead_id: int):
+    """
+    Recebe o ID local (PK) e retorna o ID original do Kommo.
+    """
+    metadados = buscar_metadados_lead(local_lead_id)
+    return metadados['kommo_lead_id'] if metadados else None
+
+
+# Leads sem nenhum número pendente, pelo contador leads.numeros_pendentes (mantido por
+# trigger) em vez de GROUP BY/HAVING sobre todos os números. O EXISTS exige ao menos
+# um número, como o JOIN da versão antiga.
+SQL_LEADS_PARA_FINALIZAR = """
+SELECT 
+    l.id as lead_id,
+    l.kommo_lead_id
+FROM leads l
+WHERE l.status = 'Em tratativa'
+  AND l.numeros_pendentes = 0
+  AND EXISTS (SELECT 1 FROM contato_numeros cn WHERE cn.lead_id = l.id);
+"""
 
 
 def buscar_leads_para_finalizar_automaticamente():
@@ -518,22 +842,7 @@ def buscar_leads_para_finalizar_automaticamente():
         conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
 
-        sql = """
-        SELECT 
-            l.id as lead_id,
-            l.kommo_lead_id
-        FROM leads l
-        JOIN contato_numeros cn ON l.id = cn.lead_id
-        WHERE l.status = 'Em tratativa'
-        GROUP BY l.id, l.kommo_lead_id
-        HAVING SUM(
-            CASE 
-                WHEN cn.status IN ('sem envio', 'aguardando resposta', 'em tratativa') THEN 1 
-                ELSE 0 
-            END
-        ) = 0;
-        """
-        cursor.execute(sql)
+        cursor.execute(SQL_LEADS_PARA_FINALIZAR)
         leads_para_fechar = cursor.fetchall()
         return leads_para_fechar
 
@@ -545,20 +854,24 @@ def buscar_leads_para_finalizar_automaticamente():
         if conn: conn.close()
 
 
-def marcar_lead_como_concluido(local_lead_id: int):
-    """Atualiza apenas o status do lead local para Concluído."""
+def marcar_leads_como_concluidos(local_lead_ids: list):
+    """Conclui vários leads locais com um único UPDATE. Retorna quantos foram atualizados."""
+    if not local_lead_ids:
+        return 0
     conn = None
     cursor = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        sql = "UPDATE leads SET status = 'Concluído' WHERE id = %s"
-        cursor.execute(sql, (local_lead_id,))
+        sql = f"UPDATE leads SET status = 'Concluído' WHERE id IN ({', '.join(['%s'] * len(local_lead_ids))})"
+        cursor.execute(sql, list(local_lead_ids))
         conn.commit()
-        print(f"[DB MANAGER] Lead ID {local_lead_id} marcado como Concluído localmente.")
+        print(f"[DB MANAGER] {cursor.rowcount} leads marcados como Concluído localmente.")
+        return cursor.rowcount
     except Exception as e:
-        print(f"[DB MANAGER] Erro ao concluir lead local: {e}")
+        print(f"[DB MANAGER] Erro ao concluir leads locais: {e}")
         if conn: conn.rollback()
+        return 0
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
@@ -566,26 +879,18 @@ def marcar_lead_como_concluido(local_lead_id: int):
 
 def get_nome_lead_por_id(local_lead_id: int):
     """Retorna o nome do contato (cliente) do lead."""
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    metadados = buscar_metadados_lead(local_lead_id)
+    return metadados['nome_contato'] if metadados else None
 
-        sql = "SELECT nome_contato FROM leads WHERE id = %s"
-        cursor.execute(sql, (local_lead_id,))
-        resultado = cursor.fetchone()
 
-        if resultado:
-            return resultado[0]
-
-    except Exception as e:
-        print(f"[DB MANAGER] Erro ao buscar nome do lead: {e}")
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
-
-    return None
+# `aberto` é a coluna gerada (status <> 'Concluído'): o != vira igualdade e usa o
+# índice (aberto, data_criacao) em vez de varrer a tabela.
+SQL_LEADS_EXPIRADOS = """
+SELECT id, kommo_lead_id 
+FROM leads 
+WHERE aberto = 1 
+  AND data_criacao < (NOW() - INTERVAL 1 DAY);
+"""
 
 
 def buscar_leads_expirados_24h():
@@ -599,13 +904,7 @@ def buscar_leads_expirados_24h():
         conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
 
-        sql = """
-        SELECT id, kommo_lead_id 
-        FROM leads 
-        WHERE status != 'Concluído' 
-          AND data_criacao < (NOW() - INTERVAL 1 DAY);
-        """
-        cursor.execute(sql)
+        cursor.execute(SQL_LEADS_EXPIRADOS)
         resultados = cursor.fetchall()
 
         if resultados:
@@ -627,6 +926,8 @@ def resetar_banco_para_testes():
     USADO APENAS PARA TESTES/RESET.
     """
     print("\n[DB MANAGER] ⚠️ INICIANDO RESET COMPLETO DAS TABELAS... ⚠️")
+    # Escritas ainda na fila não podem cair depois da limpeza
+    fila_escrita.aguardar()
     conn = None
     cursor = None
     try:
@@ -652,6 +953,7 @@ def resetar_banco_para_testes():
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1;")
 
         conn.commit()
+        cache_leads.limpar()
         print("[DB MANAGER] ✅ RESET CONCLUÍDO! O BANCO ESTÁ LIMPO.\n")
         return True
 
@@ -0,0 +1,101 @@
+import asyncio
+
+import aiomysql
+
+from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_POOL_SIZE
+from config import HISTORICO_MAX_MENSAGENS
+from services.db_manager import SQL_HISTORICO_JANELA, aplicar_janela_historico
+from services.fila_escrita import fila_escrita
+from utils.phone_utils import normalizar_numero_telefone
+
+# Versão assíncrona (aiomysql) das consultas do caminho quente do Agente 2.
+# Usada apenas pelo modo ASGI (webhook_server_asgi.py).
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await aiomysql.create_pool(
+                    host=DB_HOST, user=DB_USER, password=DB_PASSWORD,
+                    db=DB_NAME, connect_timeout=10, charset='utf8mb4',
+                    minsize=1, maxsize=DB_POOL_SIZE, pool_recycle=1800
+                )
+    return _pool
+
+
+async def fechar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
+async def buscar_contexto_conversa(numero_remetente_limpo: str):
+    """Versão assíncrona de db_manager.buscar_contexto_conversa."""
+    print(f"[DB ASYNC] Buscando contexto para o número: {numero_remetente_limpo}")
+
+    numero_normalizado = normalizar_numero_telefone(numero_remetente_limpo)
+
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                sql_find_lead = """
+                SELECT
+                    l.id as lead_id,
+                    cn.id as numero_id,
+                    cn.numero as numero_encontrado,
+                    cn.status as status_atual,
+                    cn.resumo_historico
+                FROM
+                    contato_numeros cn
+                JOIN
+                    leads l ON cn.lead_id = l.id
+                WHERE
+                    cn.numero_normalizado = %s
+                LIMIT 1;
+                """
+                await cursor.execute(sql_find_lead, (numero_normalizado,))
+                ids = await cursor.fetchone()
+
+                if not ids:
+                    raise Exception(f"Nenhum lead encontrado para +{numero_normalizado}")
+
+                # Mesma leitura das próprias escritas da versão síncrona
+                if fila_escrita.tem_pendencias(ids['numero_id']):
+                    await asyncio.to_thread(fila_escrita.aguardar, ids['numero_id'])
+                    await conn.commit()
+                    await cursor.execute(sql_find_lead, (numero_normalizado,))
+                    ids = await cursor.fetchone()
+
+                await cursor.execute(SQL_HISTORICO_JANELA, (ids['numero_id'], HISTORICO_MAX_MENSAGENS + 1))
+                historico, truncado = aplicar_janela_historico(list(await cursor.fetchall()))
+
+            await conn.commit()
+
+        return {
+            "lead_id": ids['lead_id'],
+            "numero_id": ids['numero_id'],
+            "status_atual": ids['status_atual'],
+            "historico_chat": historico,
+            "historico_truncado": truncado,
+            "resumo_historico": ids['resumo_historico']
+        }
+
+    except Exception as e:
+        print(f"[DB ASYNC] ERRO ao buscar contexto: {e}")
+        return None
+
+
+# A escrita vai para a mesma fila_escrita da versão síncrona:
+# enfileirar não bloqueia o event loop e o lote é gravado pela thread da fila.
+
+async def salvar_mensagem_usuario(numero_id: int, conteudo: str):
+    fila_escrita.enfileirar(('msg', numero_id, conteudo, 'usuario'))
+    fila_escrita.enfileirar(('status', numero_id, 'em tratativa', True))
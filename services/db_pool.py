@@ -0,0 +1,187 @@
+import threading
+import time
+
+import pymysql
+
+from config import (
+    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME,
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_PING_INTERVAL
+)
+
+
+class ConexaoPooled:
+    """
+    Envolve uma conexão pymysql emprestada do pool.
+    close() devolve a conexão ao pool em vez de fechar o socket.
+    """
+
+    def __init__(self, pool, conn, criada_em: float):
+        self._pool = pool
+        self._conn = conn
+        self._criada_em = criada_em
+        self._devolvida = False
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def close(self):
+        if self._devolvida:
+            return
+        self._devolvida = True
+        self._pool._devolver(self._conn, self._criada_em)
+
+
+class PoolConexoes:
+    """
+    Pool de conexões MySQL thread-safe e limitado.
+    - Checkout com timeout (espera uma conexão livre até `timeout` segundos).
+    - Health check (ping) em conexões ociosas há mais de `ping_interval` segundos.
+    - Reciclagem de conexões mais velhas que `max_lifetime` segundos.
+    """
+
+    def __init__(self, tamanho: int, timeout: float, max_lifetime: float, ping_interval: float):
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Condition()
+        self._livres = []  # (conn, criada_em, devolvida_em)
+        self._total = 0
+
+        self._em_uso = 0
+        self._aguardando = 0
+        self._criadas = 0
+        self._recicladas = 0
+        self._timeouts = 0
+
+    def _nova_conexao(self):
+        return pymysql.connect(
+            host=DB_HOST, user=DB_USER, password=DB_PASSWORD,
+            database=DB_NAME, connect_timeout=10, charset='utf8mb4'
+        )
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def obter(self) -> ConexaoPooled:
+        limite = time.monotonic() + self.timeout
+
+        while True:
+            candidata = None
+            with self._lock:
+                while True:
+                    if self._livres:
+                        candidata = self._livres.pop()
+                        break
+
+                    if self._total < self.tamanho:
+                        # Reserva a vaga antes de conectar para não estourar o limite
+                        self._total += 1
+                        break
+
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise TimeoutError(f"Nenhuma conexão livre no pool após {self.timeout}s")
+
+                    self._aguardando += 1
+                    try:
+                        self._lock.wait(restante)
+                    finally:
+                        self._aguardando -= 1
+
+            if candidata is None:
+                break
+
+            # Validação fora do lock: um socket travado no ping prende só esta thread
+            conn, criada_em, devolvida_em = candidata
+            agora = time.monotonic()
+            valida = agora - criada_em <= self.max_lifetime
+            if valida and agora - devolvida_em > self.ping_interval:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    valida = False
+
+            if valida:
+                with self._lock:
+                    self._em_uso += 1
+                return ConexaoPooled(self, conn, criada_em)
+
+            self._descartar(conn)
+            with self._lock:
+                self._total -= 1
+                self._recicladas += 1
+                self._lock.notify()
+
+        # Conecta fora do lock para não travar as outras threads durante o handshake
+        try:
+            conn = self._nova_conexao()
+        except Exception:
+            with self._lock:
+                self._total -= 1
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            self._criadas += 1
+            self._em_uso += 1
+        return ConexaoPooled(self, conn, time.monotonic())
+
+    def _devolver(self, conn, criada_em: float):
+        # Encerra qualquer transação aberta para a próxima thread não herdar snapshot antigo
+        saudavel = True
+        try:
+            conn.rollback()
+        except Exception:
+            saudavel = False
+
+        reaproveitar = saudavel and time.monotonic() - criada_em <= self.max_lifetime
+        if not reaproveitar:
+            self._descartar(conn)
+
+        with self._lock:
+            self._em_uso -= 1
+            if reaproveitar:
+                self._livres.append((conn, criada_em, time.monotonic()))
+            else:
+                self._total -= 1
+                self._recicladas += 1
+            self._lock.notify()
+
+    def fechar_todas(self):
+        with self._lock:
+            for conn, _, _ in self._livres:
+                self._descartar(conn)
+            self._total -= len(self._livres)
+            self._livres = []
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "tamanho_maximo": self.tamanho,
+                "abertas": self._total,
+                "livres": len(self._livres),
+                "em_uso": self._em_uso,
+                "aguardando": self._aguardando,
+                "criadas": self._criadas,
+                "recicladas": self._recicladas,
+                "timeouts": self._timeouts
+            }
+
+
+pool = PoolConexoes(
+    tamanho=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    ping_interval=DB_POOL_PING_INTERVAL
+)
+
+
+def conexao_dedicada():
+    """Conexão fora do pool, para quem precisa manter estado de sessão (ex.: GET_LOCK)."""
+    return pool._nova_conexao()
@@ -0,0 +1,263 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from config import ESCRITA_JANELA_MS, ESCRITA_LOTE_MAX, ESCRITA_TENTATIVAS, ESCRITA_FALHAS_PATH
+from services.db_pool import conexao_dedicada
+
+
+SQL_STATUS = "UPDATE contato_numeros SET status = %s WHERE id = %s"
+SQL_STATUS_SE_AGUARDANDO = "UPDATE contato_numeros SET status = %s WHERE id = %s AND status = 'aguardando resposta'"
+
+# Espera antes da 2ª tentativa de um lote que falhou (dobra a cada tentativa)
+ESPERA_BASE_TENTATIVA = 0.5
+
+
+class FilaEscrita:
+    """
+    Write-behind das mensagens e dos status dos números.
+    - Quem grava só enfileira e segue (o webhook não espera o commit).
+    - Uma thread junta o que chegou em `janela` segundos (até `lote_max` operações)
+      e grava tudo numa transação: um INSERT multi-linha em mensagens e os UPDATEs
+      de status na ordem em que foram pedidos.
+    - Leitura das próprias escritas: aguardar(numero_id) força a gravação e espera
+      até não haver nada pendente daquele número.
+    - A thread usa uma conexão própria (fora do pool), então quem espera segurando
+      uma conexão do pool não trava a gravação.
+    - Um lote que falha é tentado de novo (`tentativas`, com espera crescente); se
+      continuar falhando, é gravado operação por operação e as que ainda falham vão
+      para `caminho_falhas` (JSON por linha), que volta para a fila no próximo início.
+    """
+
+    def __init__(self, janela: float, lote_max: int, tentativas: int = 3, caminho_falhas: str = None):
+        self.janela = janela
+        self.lote_max = lote_max
+        self.tentativas = max(1, tentativas)
+        self.caminho_falhas = caminho_falhas
+        self._cond = threading.Condition()
+        self._ops = []              # ('msg', numero_id, conteudo, remetente) | ('status', numero_id, status, so_se_aguardando)
+        self._pendentes = {}        # numero_id -> operações ainda não gravadas (na fila ou no lote atual)
+        self._urgente = False
+        self._encerrada = False
+        self._thread = None
+        self._conn = None
+
+        self._enfileiradas = 0
+        self._gravadas = 0
+        self._lotes = 0
+        self._falhas = 0
+        self._arquivadas = 0
+        self._reprocessadas = 0
+        self._descartadas = 0
+
+    def _garantir_thread(self):
+        """Chamar com _cond adquirido."""
+        if self._thread is None:
+            self._carregar_falhas()
+            self._thread = threading.Thread(target=self._loop, name="fila-escrita", daemon=True)
+            self._thread.start()
+
+    def enfileirar(self, op: tuple):
+        with self._cond:
+            if not self._encerrada:
+                self._garantir_thread()
+                self._ops.append(op)
+                self._pendentes[op[1]] = self._pendentes.get(op[1], 0) + 1
+                self._enfileiradas += 1
+                self._cond.notify_all()
+                return
+
+        # Depois do encerramento (atexit) grava direto
+        self._gravar([op])
+
+    def tem_pendencias(self, numero_id: int) -> bool:
+        with self._cond:
+            return self._pendentes.get(numero_id, 0) > 0
+
+    def aguardar(self, numero_id: int = None, timeout: float = 5.0) -> bool:
+        """
+        Espera a gravação do que está pendente do número (ou de tudo, sem numero_id).
+        Retorna False se estourar o timeout.
+        """
+        def gravado():
+            if numero_id is None:
+                return not self._pendentes
+            return self._pendentes.get(numero_id, 0) == 0
+
+        with self._cond:
+            if gravado():
+                return True
+            self._urgente = True
+            self._cond.notify_all()
+            return self._cond.wait_for(gravado, timeout)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._ops and not self._encerrada:
+                    self._cond.wait()
+                if not self._ops:
+                    return
+
+                # Dá `janela` para outras escritas entrarem no mesmo lote
+                limite = time.monotonic() + self.janela
+                while not self._urgente and not self._encerrada and len(self._ops) < self.lote_max:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+
+                lote = self._ops[:self.lote_max]
+                del self._ops[:self.lote_max]
+                if not self._ops:
+                    self._urgente = False
+
+            self._gravar(lote)
+
+            with self._cond:
+                for op in lote:
+                    restantes = self._pendentes.get(op[1], 0) - 1
+                    if restantes > 0:
+                        self._pendentes[op[1]] = restantes
+                    else:
+                        self._pendentes.pop(op[1], None)
+                self._cond.notify_all()
+
+    def _obter_conexao(self):
+        if self._conn is None:
+            self._conn = conexao_dedicada()
+        else:
+            self._conn.ping(reconnect=True)
+        return self._conn
+
+    def _executar(self, lote: list):
+        conn = self._obter_conexao()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+
+            mensagens = [op for op in lote if op[0] == 'msg']
+            if mensagens:
+                valores = ", ".join(["(%s, %s, %s)"] * len(mensagens))
+                params = []
+                for _, numero_id, conteudo, remetente in mensagens:
+                    params.extend((numero_id, conteudo, remetente))
+                cursor.execute(f"INSERT INTO mensagens (numero_id, conteudo, remetente) VALUES {valores}", params)
+
+            for op in lote:
+                if op[0] == 'status':
+                    _, numero_id, status, so_se_aguardando = op
+                    cursor.execute(SQL_STATUS_SE_AGUARDANDO if so_se_aguardando else SQL_STATUS, (status, numero_id))
+
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                self._conn = None
+            raise
+        finally:
+            if cursor: cursor.close()
+
+    def _gravar(self, lote: list, tentativas: int = None):
+        tentativas = tentativas or self.tentativas
+        for tentativa in range(tentativas):
+            if tentativa:
+                time.sleep(ESPERA_BASE_TENTATIVA * 2 ** (tentativa - 1))
+            try:
+                self._executar(lote)
+                with self._cond:
+                    self._gravadas += len(lote)
+                    self._lotes += 1
+                return
+            except Exception as e:
+                with self._cond:
+                    self._falhas += 1
+                print(f"[FILA ESCRITA] ERRO ao gravar lote de {len(lote)} operações "
+                      f"(tentativa {tentativa + 1}/{tentativas}): {e}")
+
+        if len(lote) == 1:
+            self._arquivar(lote[0])
+            return
+
+        # Uma operação ruim não derruba as outras: regrava uma a uma (o lote já teve as retentativas)
+        for op in lote:
+            self._gravar([op], tentativas=1)
+
+    def _arquivar(self, op: tuple):
+        """Guarda a operação que não gravou; ela volta para a fila no próximo início."""
+        try:
+            if not self.caminho_falhas:
+                raise Exception("arquivo de falhas não configurado")
+            with open(self.caminho_falhas, "a", encoding="utf-8") as f:
+                f.write(json.dumps(list(op), ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            with self._cond:
+                self._arquivadas += 1
+            print(f"[FILA ESCRITA] Operação {op[0]} do número {op[1]} guardada em {self.caminho_falhas}.")
+        except Exception as e:
+            print(f"[FILA ESCRITA] Operação descartada ({op[0]} do número {op[1]}): {e}")
+            with self._cond:
+                self._descartadas += 1
+
+    def _carregar_falhas(self):
+        """Devolve à fila as operações arquivadas por falhas anteriores. Chamar com _cond adquirido."""
+        if not self.caminho_falhas or not os.path.exists(self.caminho_falhas):
+            return
+        try:
+            with open(self.caminho_falhas, "r", encoding="utf-8") as f:
+                linhas = f.read().splitlines()
+            os.remove(self.caminho_falhas)
+        except Exception as e:
+            print(f"[FILA ESCRITA] ERRO ao ler {self.caminho_falhas}: {e}")
+            return
+
+        for linha in linhas:
+            try:
+                op = tuple(json.loads(linha))
+            except ValueError:
+                continue
+            self._ops.append(op)
+            self._pendentes[op[1]] = self._pendentes.get(op[1], 0) + 1
+            self._reprocessadas += 1
+        if self._reprocessadas:
+            print(f"[FILA ESCRITA] {self._reprocessadas} operações que tinham falhado voltaram para a fila.")
+
+    def encerrar(self, timeout: float = 10.0):
+        """Grava o que ainda está na fila e para a thread (chamado no shutdown)."""
+        with self._cond:
+            self._encerrada = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread:
+            thread.join(timeout)
+        if self._conn:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def metricas(self) -> dict:
+        with self._cond:
+            return {
+                "na_fila": len(self._ops),
+                "numeros_pendentes": len(self._pendentes),
+                "enfileiradas": self._enfileiradas,
+                "gravadas": self._gravadas,
+                "lotes": self._lotes,
+                "media_por_lote": round(self._gravadas / self._lotes, 1) if self._lotes else None,
+                "falhas": self._falhas,
+                "arquivadas": self._arquivadas,
+                "reprocessadas": self._reprocessadas,
+                "descartadas": self._descartadas
+            }
+
+
+fila_escrita = FilaEscrita(ESCRITA_JANELA_MS / 1000.0, ESCRITA_LOTE_MAX, ESCRITA_TENTATIVAS, ESCRITA_FALHAS_PATH)
+
+# Nada enfileirado se perde num shutdown normal
+atexit.register(fila_escrita.encerrar)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from typing import Callable
+
+from config import LLM_BACKEND, LLM_MODELO, LLM_TIMEOUT, LLM_MAX_CONCORRENCIA, HTTP_POOL_SIZE
+
+# Registro central dos clientes/chains de LLM.
+# - Os ChatOpenAI são criados uma vez (por timeout) e compartilham o mesmo pool HTTP.
+# - Cada chain tem seu próprio limite de chamadas simultâneas.
+# - Com LLM_BACKEND=fake, nenhuma chamada sai para a OpenAI: cada chain usa sua
+#   função `fake`, o que permite rodar e medir o agente inteiro offline.
+
+_lock = threading.Lock()
+_clientes_llm = {}
+_http_clients = {}
+_chains = {}
+
+
+def _get_http_clients():
+    if not _http_clients:
+        import httpx
+        limites = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+        _http_clients["sync"] = httpx.Client(limits=limites)
+        _http_clients["async"] = httpx.AsyncClient(limits=limites)
+    return _http_clients
+
+
+def get_llm(timeout: float = LLM_TIMEOUT):
+    """Retorna o ChatOpenAI compartilhado para o timeout pedido."""
+    with _lock:
+        llm = _clientes_llm.get(timeout)
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+            http_clients = _get_http_clients()
+            llm = ChatOpenAI(
+                model=LLM_MODELO,
+                temperature=0.0,
+                timeout=timeout,
+                max_retries=2,
+                http_client=http_clients["sync"],
+                http_async_client=http_clients["async"]
+            )
+            _clientes_llm[timeout] = llm
+        return llm
+
+
+class ChainRegistrada:
+    """
+    Envolve uma chain LangChain construída sob demanda, limitando a concorrência.
+    Expõe invoke/ainvoke como a chain original.
+    """
+
+    def __init__(self, nome: str, construtor: Callable, fake: Callable, timeout: float, max_concorrencia: int):
+        self.nome = nome
+        self._construtor = construtor
+        self._fake = fake
+        self.timeout = timeout
+        self.max_concorrencia = max_concorrencia
+        self._chain = None
+        self._lock_chain = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(max_concorrencia)
+        self._semaforo_async = None
+
+    def _get_chain(self):
+        if self._chain is None:
+            with self._lock_chain:
+                if self._chain is None:
+                    self._chain = self._construtor(get_llm(self.timeout))
+        return self._chain
+
+    def invoke(self, entrada: dict):
+        if LLM_BACKEND == "fake":
+            return self._fake(entrada)
+
+        chain = self._get_chain()
+        with self._semaforo:
+            return chain.invoke(entrada)
+
+    async def ainvoke(self, entrada: dict):
+        if LLM_BACKEND == "fake":
+            return self._fake(entrada)
+
+        if self._semaforo_async is None:
+            self._semaforo_async = asyncio.Semaphore(self.max_concorrencia)
+
+        chain = self._get_chain()
+        async with self._semaforo_async:
+            return await chain.ainvoke(entrada)
+
+
+def registrar_chain(nome: str, construtor: Callable, fake: Callable,
+                    timeout: float = LLM_TIMEOUT, max_concorrencia: int = LLM_MAX_CONCORRENCIA) -> ChainRegistrada:
+    """
+    Registra uma chain pelo nome. `construtor(llm)` monta a chain a partir do
+    ChatOpenAI compartilhado; `fake(entrada)` é a resposta usada no modo offline.
+    """
+    with _lock:
+        if nome not in _chains:
+            _chains[nome] = ChainRegistrada(nome, construtor, fake, timeout, max_concorrencia)
+        return _chains[nome]
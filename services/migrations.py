@@ -0,0 +1,332 @@
+"""
+Migrações de schema do banco.
+Cada migração roda uma única vez e fica registrada em `schema_migracoes`.
+
+Uso: python -m services.migrations
+     python -m services.migrations --explain   (confere os planos das consultas do scheduler)
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+
+from services.db_manager import (
+    get_db_connection,
+    SQL_FILA_LOTE, SQL_LEADS_PARA_FINALIZAR, SQL_LEADS_EXPIRADOS
+)
+from utils.phone_utils import normalizar_numero_telefone
+
+
+TAMANHO_LOTE_BACKFILL = 5000
+
+
+# DDL no MySQL faz commit implícito: se um passo posterior falhar, a migração não fica
+# registrada e roda de novo. Por isso cada passo de DDL confere antes se já foi aplicado.
+
+def _existe(cursor, sql: str, params: tuple) -> bool:
+    cursor.execute(sql, params)
+    return cursor.fetchone()[0] > 0
+
+
+def _coluna(tabela: str, coluna: str, ddl: str):
+    """Passo que roda `ddl` só se a coluna ainda não existir."""
+    def passo(cursor):
+        if not _existe(cursor, """
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+            """, (tabela, coluna)):
+            cursor.execute(ddl)
+    return passo
+
+
+def _indice(tabela: str, indice: str, ddl: str):
+    """Passo que roda `ddl` só se o índice ainda não existir."""
+    def passo(cursor):
+        if not _existe(cursor, """
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+            """, (tabela, indice)):
+            cursor.execute(ddl)
+    return passo
+
+
+def _trigger(nome: str, ddl: str):
+    """Passo que roda `ddl` só se o trigger ainda não existir."""
+    def passo(cursor):
+        if not _existe(cursor, """
+            SELECT COUNT(*) FROM information_schema.TRIGGERS
+            WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s
+            """, (nome,)):
+            cursor.execute(ddl)
+    return passo
+
+
+def _backfill_numero_normalizado(cursor):
+    """
+    Preenche contato_numeros.numero_normalizado em lotes, usando a mesma regra do Python.
+    Commit a cada lote (undo log e locks pequenos); retomável, pois só pega os que faltam.
+    """
+    ultimo_id = 0
+    total = 0
+    while True:
+        cursor.execute(
+            "SELECT id, numero FROM contato_numeros "
+            "WHERE id > %s AND numero_normalizado IS NULL ORDER BY id ASC LIMIT %s",
+            (ultimo_id, TAMANHO_LOTE_BACKFILL)
+        )
+        linhas = cursor.fetchall()
+        if not linhas:
+            break
+
+        cursor.executemany(
+            "UPDATE contato_numeros SET numero_normalizado = %s WHERE id = %s",
+            [(normalizar_numero_telefone(numero), id_numero) for id_numero, numero in linhas]
+        )
+        cursor.connection.commit()
+        ultimo_id = linhas[-1][0]
+        total += len(linhas)
+
+    print(f"[MIGRATIONS] numero_normalizado preenchido em {total} registros.")
+
+
+def _deduplicar_numeros_normalizados(cursor):
+    """
+    Junta os números do mesmo lead que viraram a mesma chave (ex.: a forma com 12 e
+    com 13 dígitos do mesmo celular), senão o índice único não é criado.
+    Fica o número já contatado (status diferente de 'sem envio') ou o mais antigo;
+    as mensagens dos outros passam para ele.
+    """
+    cursor.execute("""
+    SELECT GROUP_CONCAT(id ORDER BY status = 'sem envio', id)
+    FROM contato_numeros
+    WHERE numero_normalizado IS NOT NULL
+    GROUP BY lead_id, numero_normalizado
+    HAVING COUNT(*) > 1
+    """)
+    grupos = [[int(i) for i in linha[0].split(',')] for linha in cursor.fetchall()]
+
+    for manter, *duplicados in grupos:
+        marcadores = ', '.join(['%s'] * len(duplicados))
+        cursor.execute(f"UPDATE mensagens SET numero_id = %s WHERE numero_id IN ({marcadores})",
+                       [manter, *duplicados])
+        cursor.execute(f"DELETE FROM contato_numeros WHERE id IN ({marcadores})", duplicados)
+        cursor.connection.commit()
+
+    print(f"[MIGRATIONS] {len(grupos)} números duplicados unificados.")
+
+
+# Status de contato_numeros que ainda seguram o lead aberto
+STATUS_PENDENTES = "'sem envio', 'aguardando resposta', 'em tratativa'"
+
+
+def _backfill_contadores_leads(cursor):
+    """Recalcula leads.numeros_pendentes / numeros_sem_envio a partir de contato_numeros."""
+    cursor.execute(f"""
+    UPDATE leads l
+    JOIN (
+        SELECT lead_id,
+               SUM(IF(status IN ({STATUS_PENDENTES}), 1, 0)) AS pendentes,
+               SUM(IF(status = 'sem envio', 1, 0)) AS sem_envio
+        FROM contato_numeros
+        GROUP BY lead_id
+    ) c ON c.lead_id = l.id
+    SET l.numeros_pendentes = c.pendentes,
+        l.numeros_sem_envio = c.sem_envio
+    """)
+    print(f"[MIGRATIONS] Contadores recalculados em {cursor.rowcount} leads.")
+
+
+# (nome, lista de passos). Um passo é uma string SQL ou uma função que recebe o cursor.
+# Todo passo precisa poder rodar de novo sem erro (ver _coluna / _indice).
+MIGRACOES = [
+    ("001_contato_numeros_numero_normalizado", [
+        _coluna("contato_numeros", "numero_normalizado",
+                "ALTER TABLE contato_numeros ADD COLUMN numero_normalizado VARCHAR(20) NULL"),
+        _backfill_numero_normalizado,
+        _deduplicar_numeros_normalizados,
+        # Único por (número, lead): a busca usa o prefixo numero_normalizado
+        # e o mesmo telefone ainda pode aparecer em leads diferentes.
+        _indice("contato_numeros", "ux_contato_numeros_normalizado",
+                "CREATE UNIQUE INDEX ux_contato_numeros_normalizado ON contato_numeros (numero_normalizado, lead_id)"),
+    ]),
+    ("002_mensagens_janela_historico", [
+        _indice("mensagens", "ix_mensagens_numero_data",
+                "CREATE INDEX ix_mensagens_numero_data ON mensagens (numero_id, data_envio, id)"),
+        _coluna("contato_numeros", "resumo_historico",
+                "ALTER TABLE contato_numeros ADD COLUMN resumo_historico TEXT NULL"),
+    ]),
+    ("003_limites_envio", [
+        # Estado do token bucket de cada instância da Evolution, compartilhado entre processos.
+        # As colunas de limite são opcionais: NULL usa os padrões ENVIO_* do config.
+        """
+        CREATE TABLE IF NOT EXISTS limites_envio (
+            evolution_instance_id VARCHAR(100) PRIMARY KEY,
+            envios_por_hora DOUBLE NULL,
+            rajada INT NULL,
+            limite_diario INT NULL,
+            tokens DOUBLE NOT NULL,
+            atualizado_em DOUBLE NOT NULL,
+            dia DATE NOT NULL,
+            envios_dia INT NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+    ("004_contato_numeros_lease", [
+        # Lease do número reivindicado por um worker (scheduler ou webhook) até o envio
+        _coluna("contato_numeros", "claimed_by",
+                "ALTER TABLE contato_numeros ADD COLUMN claimed_by VARCHAR(100) NULL"),
+        _coluna("contato_numeros", "claimed_until",
+                "ALTER TABLE contato_numeros ADD COLUMN claimed_until DATETIME NULL"),
+        _indice("contato_numeros", "ix_contato_numeros_lead_lease",
+                "CREATE INDEX ix_contato_numeros_lead_lease ON contato_numeros (lead_id, claimed_until)"),
+    ]),
+    ("005_fila_eventos", [
+        # Sequência incrementada a cada número novo na fila; os schedulers acordam quando ela muda
+        "CREATE TABLE IF NOT EXISTS fila_eventos (id TINYINT PRIMARY KEY, sequencia BIGINT NOT NULL)",
+        "INSERT IGNORE INTO fila_eventos (id, sequencia) VALUES (1, 0)",
+    ]),
+    # Consultas das varreduras e da fila sem full scan (ver SQL_* em db_manager.py).
+    # Os contadores são mantidos por trigger; rodar com scheduler e webhooks parados.
+    ("006_indices_varreduras", [
+        _coluna("leads", "numeros_pendentes",
+                "ALTER TABLE leads ADD COLUMN numeros_pendentes INT NOT NULL DEFAULT 0"),
+        _coluna("leads", "numeros_sem_envio",
+                "ALTER TABLE leads ADD COLUMN numeros_sem_envio INT NOT NULL DEFAULT 0"),
+        _coluna("leads", "aberto",
+                "ALTER TABLE leads ADD COLUMN aberto TINYINT AS (status <> 'Concluído') STORED"),
+        _trigger("tr_contato_numeros_contadores_ins", f"""
+        CREATE TRIGGER tr_contato_numeros_contadores_ins AFTER INSERT ON contato_numeros
+        FOR EACH ROW
+            UPDATE leads
+            SET numeros_pendentes = numeros_pendentes + IF(NEW.status IN ({STATUS_PENDENTES}), 1, 0),
+                numeros_sem_envio = numeros_sem_envio + IF(NEW.status = 'sem envio', 1, 0)
+            WHERE id = NEW.lead_id
+        """),
+        _trigger("tr_contato_numeros_contadores_upd", f"""
+        CREATE TRIGGER tr_contato_numeros_contadores_upd AFTER UPDATE ON contato_numeros
+        FOR EACH ROW
+        BEGIN
+            IF NOT (OLD.status <=> NEW.status) OR OLD.lead_id <> NEW.lead_id THEN
+                UPDATE leads
+                SET numeros_pendentes = numeros_pendentes - IF(OLD.status IN ({STATUS_PENDENTES}), 1, 0),
+                    numeros_sem_envio = numeros_sem_envio - IF(OLD.status = 'sem envio', 1, 0)
+                WHERE id = OLD.lead_id;
+                UPDATE leads
+                SET numeros_pendentes = numeros_pendentes + IF(NEW.status IN ({STATUS_PENDENTES}), 1, 0),
+                    numeros_sem_envio = numeros_sem_envio + IF(NEW.status = 'sem envio', 1, 0)
+                WHERE id = NEW.lead_id;
+            END IF;
+        END
+        """),
+        _trigger("tr_contato_numeros_contadores_del", f"""
+        CREATE TRIGGER tr_contato_numeros_contadores_del AFTER DELETE ON contato_numeros
+        FOR EACH ROW
+            UPDATE leads
+            SET numeros_pendentes = numeros_pendentes - IF(OLD.status IN ({STATUS_PENDENTES}), 1, 0),
+                numeros_sem_envio = numeros_sem_envio - IF(OLD.status = 'sem envio', 1, 0)
+            WHERE id = OLD.lead_id
+        """),
+        _backfill_contadores_leads,
+        # Fila (FIFO) e finalização
+        _indice("leads", "ix_leads_status_data", "CREATE INDEX ix_leads_status_data ON leads (status, data_criacao)"),
+        _indice("leads", "ix_leads_status_pendentes", "CREATE INDEX ix_leads_status_pendentes ON leads (status, numeros_pendentes)"),
+        # Expirados: aberto = 1 AND data_criacao < ...
+        _indice("leads", "ix_leads_aberto_data", "CREATE INDEX ix_leads_aberto_data ON leads (aberto, data_criacao)"),
+        # MIN(id) do primeiro número 'sem envio' de cada lead
+        _indice("contato_numeros", "ix_contato_numeros_lead_status", "CREATE INDEX ix_contato_numeros_lead_status ON contato_numeros (lead_id, status, id)"),
+    ]),
+]
+
+# Consultas do scheduler conferidas por `python -m services.migrations --explain`
+CONSULTAS_SCHEDULER = [
+    ("fila_lote", SQL_FILA_LOTE, (20,)),
+    ("leads_para_finalizar", SQL_LEADS_PARA_FINALIZAR, ()),
+    ("leads_expirados", SQL_LEADS_EXPIRADOS, ()),
+]
+
+
+def aplicar_migracoes():
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            raise Exception("Falha na conexão com DB.")
+        cursor = conn.cursor()
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migracoes (
+            nome VARCHAR(100) PRIMARY KEY,
+            aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("SELECT nome FROM schema_migracoes")
+        aplicadas = {linha[0] for linha in cursor.fetchall()}
+
+        for nome, passos in MIGRACOES:
+            if nome in aplicadas:
+                continue
+
+            print(f"[MIGRATIONS] Aplicando {nome}...")
+            for passo in passos:
+                if callable(passo):
+                    passo(cursor)
+                else:
+                    cursor.execute(passo)
+
+            cursor.execute("INSERT INTO schema_migracoes (nome) VALUES (%s)", (nome,))
+            conn.commit()
+            print(f"[MIGRATIONS] {nome} aplicada.")
+
+        print("[MIGRATIONS] Banco atualizado.")
+        return True
+
+    except Exception as e:
+        print(f"[MIGRATIONS] ERRO ao aplicar migrações: {e}")
+        if conn: conn.rollback()
+        return False
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+
+def verificar_planos():
+    """
+    Roda EXPLAIN nas consultas do scheduler e aponta as que caem em full scan
+    (type = ALL). Retorna True se nenhuma cair.
+    """
+    conn = None
+    cursor = None
+    ok = True
+    try:
+        conn = get_db_connection()
+        if not conn:
+            raise Exception("Falha na conexão com DB.")
+        cursor = conn.cursor()
+
+        for nome, sql, params in CONSULTAS_SCHEDULER:
+            cursor.execute("EXPLAIN " + sql.strip().rstrip(';'), params)
+            colunas = [c[0] for c in cursor.description]
+            for linha in cursor.fetchall():
+                plano = dict(zip(colunas, linha))
+                if plano.get('type') == 'ALL':
+                    ok = False
+                    print(f"[MIGRATIONS] FULL SCAN em '{nome}': tabela {plano.get('table')} "
+                          f"(~{plano.get('rows')} linhas)")
+            print(f"[MIGRATIONS] Plano de '{nome}' conferido.")
+
+        print("[MIGRATIONS] Planos OK." if ok else "[MIGRATIONS] Há consultas sem índice.")
+        return ok
+
+    except Exception as e:
+        print(f"[MIGRATIONS] ERRO ao verificar planos: {e}")
+        return False
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+
+if __name__ == "__main__":
+    if "--explain" in sys.argv:
+        sys.exit(0 if verificar_planos() else 1)
+    aplicar_migracoes()
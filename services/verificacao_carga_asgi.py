@@ -0,0 +1,195 @@
+"""
+Carga no modo ASGI (webhook_server_asgi.py) com banco e LLM simulados.
+
+Dispara webhooks messages.upsert simultâneos, de JIDs diferentes, direto no app Starlette
+(sem rede nem uvicorn). O contexto e a gravação do banco viram corrotinas com latência
+fixa e o grafo do Agente 2 vira um que espera a "LLM" no event loop e a "ferramenta"
+numa thread, como o grafo real. Mede a latência do webhook (até o 200) e a de ponta a
+ponta (do webhook ao fim do agente) e confere se os agentes rodaram em paralelo.
+
+Uso: python -m services.verificacao_carga_asgi [requisicoes] [concorrencia]
+
+Sai com código 0 se a verificação passar e 1 se falhar.
+"""
+import os
+
+# Antes de importar o config: debounce curto e sem journal em disco
+os.environ["DEBOUNCE_JOURNAL"] = "nenhum"
+os.environ["DEBOUNCE_JANELA_MIN"] = "0.1"
+os.environ["DEBOUNCE_JANELA_MAX"] = "0.1"
+
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import time
+
+import webhook_server_asgi
+from agents import agente_responder_async
+from services import db_manager_async
+
+
+CARGA_REQUISICOES = 500
+CARGA_CONCORRENCIA = 100
+CARGA_TIMEOUT = 60
+
+# Latências simuladas (segundos)
+LATENCIA_DB = 0.005
+LATENCIA_LLM = 0.5
+LATENCIA_FERRAMENTA = 0.05
+
+
+class GrafoSimulado:
+    """Substitui o grafo do Agente 2: LLM no event loop, ferramenta numa thread."""
+
+    def __init__(self):
+        self.concluidos = {}
+
+    async def ainvoke(self, input_data: dict):
+        await asyncio.sleep(LATENCIA_LLM)
+        await asyncio.to_thread(time.sleep, LATENCIA_FERRAMENTA)
+        self.concluidos[input_data['numero_remetente']] = time.monotonic()
+        return input_data
+
+
+async def _contexto_simulado(numero_remetente_limpo: str):
+    await asyncio.sleep(LATENCIA_DB)
+    return {
+        "lead_id": 1,
+        "numero_id": int(numero_remetente_limpo[-8:]),
+        "status_atual": "aguardando resposta",
+        "historico_chat": [],
+        "historico_truncado": False,
+        "resumo_historico": None
+    }
+
+
+async def _salvar_simulado(numero_id: int, conteudo: str):
+    await asyncio.sleep(LATENCIA_DB)
+
+
+def _webhook(numero: str) -> bytes:
+    return json.dumps({
+        "event": "messages.upsert",
+        "instance": "verificacao-carga",
+        "data": {
+            "key": {"remoteJid": f"{numero}@s.whatsapp.net", "fromMe": False},
+            "pushName": "Carga",
+            "message": {"conversation": "pode me explicar melhor como funciona"}
+        }
+    }).encode()
+
+
+async def _post(caminho: str, corpo: bytes) -> int:
+    """Chama o app ASGI direto com um POST e devolve o status da resposta."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": caminho, "raw_path": caminho.encode(),
+        "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(corpo)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("verificacao", 80),
+    }
+    enviado = False
+    status = []
+
+    async def receive():
+        nonlocal enviado
+        if not enviado:
+            enviado = True
+            return {"type": "http.request", "body": corpo, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(mensagem):
+        if mensagem["type"] == "http.response.start":
+            status.append(mensagem["status"])
+
+    await webhook_server_asgi.app(scope, receive, send)
+    return status[0]
+
+
+def _percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def simular_backends(definir=setattr) -> GrafoSimulado:
+    """
+    Troca o banco e o grafo do Agente 2 pelos simulados. `definir` é o setattr usado
+    (os testes passam monkeypatch.setattr para desfazer no fim).
+    """
+    grafo = GrafoSimulado()
+    definir(agente_responder_async, "app", grafo)
+    definir(agente_responder_async, "atualizar_resumo_historico", lambda input_data: None)
+    definir(db_manager_async, "buscar_contexto_conversa", _contexto_simulado)
+    definir(db_manager_async, "salvar_mensagem_usuario", _salvar_simulado)
+    return grafo
+
+
+async def medir_carga(grafo: GrafoSimulado, requisicoes: int = CARGA_REQUISICOES,
+                      concorrencia: int = CARGA_CONCORRENCIA) -> dict:
+    """Dispara a carga no app (com os backends já simulados) e devolve as medidas."""
+    await webhook_server_asgi.on_startup()
+
+    numeros = [f"55329{i:08d}" for i in range(requisicoes)]
+    inicio_req = {}
+    latencias_webhook = []
+    status = []
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def disparar(numero):
+        async with semaforo:
+            inicio_req[numero] = time.monotonic()
+            status.append(await _post("/webhook/evolution", _webhook(numero)))
+            latencias_webhook.append(time.monotonic() - inicio_req[numero])
+
+    inicio = time.monotonic()
+    await asyncio.gather(*(disparar(n) for n in numeros))
+    duracao_webhooks = time.monotonic() - inicio
+
+    prazo = time.monotonic() + CARGA_TIMEOUT
+    while len(grafo.concluidos) < requisicoes and time.monotonic() < prazo:
+        await asyncio.sleep(0.05)
+    duracao_total = time.monotonic() - inicio
+
+    ponta_a_ponta = [grafo.concluidos[n] - inicio_req[n] for n in grafo.concluidos]
+    return {
+        "requisicoes": requisicoes,
+        "respostas_200": status.count(200),
+        "agentes_concluidos": len(grafo.concluidos),
+        "webhooks_por_segundo": requisicoes / duracao_webhooks,
+        "webhook_p50": _percentil(latencias_webhook, 0.5),
+        "webhook_p90": _percentil(latencias_webhook, 0.9),
+        "ponta_a_ponta_p50": _percentil(ponta_a_ponta, 0.5) if ponta_a_ponta else None,
+        "ponta_a_ponta_p90": _percentil(ponta_a_ponta, 0.9) if ponta_a_ponta else None,
+        "duracao_total": duracao_total,
+        # Tempo que os agentes levariam um atrás do outro
+        "duracao_serial": requisicoes * (LATENCIA_LLM + LATENCIA_FERRAMENTA),
+    }
+
+
+def verificar_carga(requisicoes: int = CARGA_REQUISICOES, concorrencia: int = CARGA_CONCORRENCIA) -> bool:
+    # Os prints por mensagem do webhook e do agente não entram no relatório
+    with contextlib.redirect_stdout(io.StringIO()):
+        medidas = asyncio.run(medir_carga(simular_backends(), requisicoes, concorrencia))
+
+    print(f"[CARGA] {medidas['requisicoes']} webhooks, {medidas['respostas_200']} com 200, "
+          f"{medidas['agentes_concluidos']} agentes concluídos")
+    print(f"[CARGA] Webhook: {medidas['webhooks_por_segundo']:.0f} req/s, "
+          f"p50 {medidas['webhook_p50'] * 1000:.1f} ms, p90 {medidas['webhook_p90'] * 1000:.1f} ms")
+    if medidas['ponta_a_ponta_p50'] is not None:
+        print(f"[CARGA] Ponta a ponta: p50 {medidas['ponta_a_ponta_p50']:.2f} s, "
+              f"p90 {medidas['ponta_a_ponta_p90']:.2f} s")
+    print(f"[CARGA] Duração: {medidas['duracao_total']:.2f} s (serial seria {medidas['duracao_serial']:.0f} s)")
+
+    ok = (medidas['respostas_200'] == requisicoes
+          and medidas['agentes_concluidos'] == requisicoes
+          and medidas['duracao_total'] < medidas['duracao_serial'] / 2)
+    print("[CARGA] OK." if ok else "[CARGA] FALHOU.")
+    return ok
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    sys.exit(0 if verificar_carga(*argumentos) else 1)
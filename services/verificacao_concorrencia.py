@@ -0,0 +1,290 @@
+"""
+Verificações de concorrência contra um MySQL de TESTE (gravam e apagam dados próprios).
+
+Uso: python -m services.verificacao_concorrencia --leases   (cada número é enviado exatamente uma vez
+                                                            com vários workers disputando a fila)
+     python -m services.verificacao_concorrencia --outbound (chamadas simultâneas a find_outbound_number
+                                                            se distribuem por igual entre as instâncias)
+
+Sai com código 0 se a verificação passar e 1 se falhar.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from services.db_manager import (
+    get_db_connection,
+    find_outbound_number,
+    sincronizar_numeros_lead, reivindicar_lote_fila, reivindicar_proximo_numero,
+    liberar_lease_numero, logar_envio_inicial_db
+)
+
+
+# Faixa de kommo_lead_id reservada para os leads da verificação
+LEAD_TESTE_BASE = 2_100_000_000
+
+LEASES_LEADS = 40
+LEASES_NUMEROS_POR_LEAD = 3
+LEASES_WORKERS_FILA = 4          # reivindicam em lote, como o scheduler
+LEASES_WORKERS_WEBHOOK = 4       # reivindicam pelo lead, como o iniciador vindo do webhook
+LEASES_LOTE = 5
+LEASES_LEASE_SEGUNDOS = 30
+LEASES_TIMEOUT = 120
+
+# UF e instâncias reservadas para a verificação do outbound
+OUTBOUND_UF_TESTE = "ZZ"
+OUTBOUND_INSTANCIA_TESTE = "verificacao-outbound-"
+OUTBOUND_INSTANCIAS = 5
+OUTBOUND_CHAMADAS = 50
+
+
+def _executar(sql: str, params: tuple = ()):
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        resultado = cursor.fetchall()
+        conn.commit()
+        return resultado
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+
+def _limpar_leads_teste():
+    faixa = (LEAD_TESTE_BASE, LEAD_TESTE_BASE + LEASES_LEADS)
+    _executar("""
+    DELETE m FROM mensagens m
+    JOIN contato_numeros cn ON cn.id = m.numero_id
+    JOIN leads l ON l.id = cn.lead_id
+    WHERE l.kommo_lead_id BETWEEN %s AND %s
+    """, faixa)
+    _executar("""
+    DELETE cn FROM contato_numeros cn
+    JOIN leads l ON l.id = cn.lead_id
+    WHERE l.kommo_lead_id BETWEEN %s AND %s
+    """, faixa)
+    _executar("DELETE FROM leads WHERE kommo_lead_id BETWEEN %s AND %s", faixa)
+
+
+def _semear_leads_teste() -> dict:
+    """Cria os leads da verificação ('Em tratativa', números 'sem envio'). Retorna numero_id -> lead local."""
+    comprador = _executar("SELECT id FROM compradores ORDER BY id LIMIT 1")
+    if not comprador:
+        raise Exception("Nenhum comprador cadastrado para vincular os leads de teste.")
+
+    for i in range(LEASES_LEADS):
+        numeros = [f"55119{i:04d}{j:04d}" for j in range(LEASES_NUMEROS_POR_LEAD)]
+        if not sincronizar_numeros_lead(LEAD_TESTE_BASE + i, 0, comprador[0][0], "Verificação", numeros):
+            raise Exception(f"Falha ao semear o lead de teste {LEAD_TESTE_BASE + i}.")
+
+    _executar("UPDATE leads SET status = 'Em tratativa' WHERE kommo_lead_id BETWEEN %s AND %s",
+              (LEAD_TESTE_BASE, LEAD_TESTE_BASE + LEASES_LEADS))
+    linhas = _executar("""
+    SELECT cn.id, l.id FROM contato_numeros cn
+    JOIN leads l ON l.id = cn.lead_id
+    WHERE l.kommo_lead_id BETWEEN %s AND %s
+    """, (LEAD_TESTE_BASE, LEAD_TESTE_BASE + LEASES_LEADS))
+    return {numero_id: lead_id for numero_id, lead_id in linhas}
+
+
+def _worker_fila(id_worker: str, numeros: dict, enviados: dict, lock: threading.Lock, prazo: float):
+    """Faz o caminho do scheduler: reivindica em lote e o iniciador reivindica de novo pelo lead."""
+    while time.monotonic() < prazo:
+        with lock:
+            if len(enviados) >= len(numeros):
+                return
+        itens = reivindicar_lote_fila(LEASES_LOTE, id_worker, LEASES_LEASE_SEGUNDOS)
+        if not itens:
+            time.sleep(0.05)
+            continue
+        for item in itens:
+            if item['numero_id'] not in numeros:
+                liberar_lease_numero(item['numero_id'], id_worker)
+                continue
+            numero = reivindicar_proximo_numero(item['kommo_lead_id'], id_worker, LEASES_LEASE_SEGUNDOS)
+            if not numero:
+                liberar_lease_numero(item['numero_id'], id_worker)
+                continue
+            _enviar(id_worker, numero['id'], numeros, enviados, lock)
+
+
+def _worker_webhook(id_worker: str, numeros: dict, enviados: dict, lock: threading.Lock, prazo: float):
+    """Faz o caminho do webhook: reivindica o próximo número de um lead qualquer."""
+    kommo_ids = [LEAD_TESTE_BASE + i for i in range(LEASES_LEADS)]
+    while time.monotonic() < prazo:
+        with lock:
+            if len(enviados) >= len(numeros):
+                return
+        random.shuffle(kommo_ids)
+        for kommo_lead_id in kommo_ids:
+            numero = reivindicar_proximo_numero(kommo_lead_id, id_worker, LEASES_LEASE_SEGUNDOS)
+            if numero:
+                _enviar(id_worker, numero['id'], numeros, enviados, lock)
+        time.sleep(0.05)
+
+
+def _enviar(id_worker: str, numero_id: int, numeros: dict, enviados: dict, lock: threading.Lock):
+    """'Envia' (só registra quem enviou) e grava o log, que tira o número da fila."""
+    with lock:
+        enviados[numero_id].append(id_worker)
+    if not logar_envio_inicial_db(numeros[numero_id], numero_id, f"verificação {id_worker}"):
+        liberar_lease_numero(numero_id, id_worker)
+
+
+def verificar_leases() -> bool:
+    """
+    Semeia leads de teste e põe workers de fila e de webhook disputando os números
+    ao mesmo tempo. Passa se cada número foi enviado exatamente uma vez e tem
+    exatamente uma mensagem gravada.
+    """
+    try:
+        _limpar_leads_teste()
+        ocupada = _executar("""
+        SELECT COUNT(*) FROM leads
+        WHERE status = 'Em tratativa' AND numeros_sem_envio > 0
+          AND kommo_lead_id NOT BETWEEN %s AND %s
+        """, (LEAD_TESTE_BASE, LEAD_TESTE_BASE + LEASES_LEADS))[0][0]
+        if ocupada:
+            print(f"[VERIFICACAO] A fila tem {ocupada} leads reais pendentes. Rode contra um banco de teste.")
+            return False
+
+        numeros = _semear_leads_teste()
+        print(f"[VERIFICACAO] {len(numeros)} números semeados em {LEASES_LEADS} leads.")
+
+        enviados = defaultdict(list)
+        lock = threading.Lock()
+        prazo = time.monotonic() + LEASES_TIMEOUT
+        workers = [
+            threading.Thread(target=_worker_fila, args=(f"verificacao-fila-{i}", numeros, enviados, lock, prazo))
+            for i in range(LEASES_WORKERS_FILA)
+        ] + [
+            threading.Thread(target=_worker_webhook, args=(f"verificacao-webhook-{i}", numeros, enviados, lock, prazo))
+            for i in range(LEASES_WORKERS_WEBHOOK)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        mensagens = dict(_executar("""
+        SELECT m.numero_id, COUNT(*) FROM mensagens m
+        JOIN contato_numeros cn ON cn.id = m.numero_id
+        JOIN leads l ON l.id = cn.lead_id
+        WHERE l.kommo_lead_id BETWEEN %s AND %s
+        GROUP BY m.numero_id
+        """, (LEAD_TESTE_BASE, LEAD_TESTE_BASE + LEASES_LEADS)))
+
+        ok = True
+        for numero_id in numeros:
+            quem = enviados.get(numero_id, [])
+            if len(quem) != 1 or mensagens.get(numero_id, 0) != 1:
+                ok = False
+                print(f"[VERIFICACAO] Número {numero_id}: {len(quem)} envios {quem}, "
+                      f"{mensagens.get(numero_id, 0)} mensagens gravadas.")
+
+        print("[VERIFICACAO] Leases OK: cada número foi enviado exatamente uma vez." if ok
+              else "[VERIFICACAO] Leases FALHARAM.")
+        return ok
+
+    except Exception as e:
+        print(f"[VERIFICACAO] ERRO na verificação de leases: {e}")
+        return False
+    finally:
+        try:
+            _limpar_leads_teste()
+        except Exception as e:
+            print(f"[VERIFICACAO] ERRO ao limpar os leads de teste: {e}")
+
+
+def _limpar_outbound_teste():
+    _executar("DELETE FROM numeros_outbound WHERE evolution_instance_id LIKE %s", (OUTBOUND_INSTANCIA_TESTE + "%",))
+
+
+def verificar_outbound() -> bool:
+    """
+    Cria instâncias de teste (mesmo comprador, UF própria, nenhum uso) e dispara
+    OUTBOUND_CHAMADAS chamadas simultâneas a find_outbound_number. Passa se cada
+    instância recebeu o mesmo número de reservas (diferença máxima de 1) e se
+    contagem_uso bate com o que foi devolvido (nenhum incremento perdido).
+    """
+    try:
+        _limpar_outbound_teste()
+        comprador = _executar("SELECT id FROM compradores ORDER BY id LIMIT 1")
+        if not comprador:
+            raise Exception("Nenhum comprador cadastrado para vincular as instâncias de teste.")
+        comprador_id = comprador[0][0]
+
+        for i in range(OUTBOUND_INSTANCIAS):
+            _executar("""
+            INSERT INTO numeros_outbound (comprador_id, numero, evolution_instance_id, uf, status, contagem_uso)
+            VALUES (%s, %s, %s, %s, 'ativo', 0)
+            """, (comprador_id, f"5599900000{i:03d}", f"{OUTBOUND_INSTANCIA_TESTE}{i}", OUTBOUND_UF_TESTE))
+
+        reservas = defaultdict(int)
+        falhas = []
+        lock = threading.Lock()
+        largada = threading.Barrier(OUTBOUND_CHAMADAS)
+
+        def chamar():
+            largada.wait()
+            numero = find_outbound_number(comprador_id, OUTBOUND_UF_TESTE)
+            with lock:
+                if numero:
+                    reservas[numero['instance_id']] += 1
+                else:
+                    falhas.append(None)
+
+        chamadas = [threading.Thread(target=chamar) for _ in range(OUTBOUND_CHAMADAS)]
+        for chamada in chamadas:
+            chamada.start()
+        for chamada in chamadas:
+            chamada.join()
+
+        contagens = dict(_executar(
+            "SELECT evolution_instance_id, contagem_uso FROM numeros_outbound WHERE evolution_instance_id LIKE %s",
+            (OUTBOUND_INSTANCIA_TESTE + "%",)
+        ))
+        por_instancia = [reservas.get(f"{OUTBOUND_INSTANCIA_TESTE}{i}", 0) for i in range(OUTBOUND_INSTANCIAS)]
+        print(f"[VERIFICACAO] Reservas por instância: {por_instancia} ({len(falhas)} falhas).")
+
+        ok = True
+        if falhas or sum(por_instancia) != OUTBOUND_CHAMADAS:
+            ok = False
+            print(f"[VERIFICACAO] {OUTBOUND_CHAMADAS - sum(por_instancia)} chamadas não ficaram com uma instância de teste.")
+        if max(por_instancia) - min(por_instancia) > 1:
+            ok = False
+            print("[VERIFICACAO] Distribuição desigual entre as instâncias.")
+        for instancia, usos in contagens.items():
+            if usos != reservas.get(instancia, 0):
+                ok = False
+                print(f"[VERIFICACAO] {instancia}: contagem_uso {usos}, mas {reservas.get(instancia, 0)} reservas devolvidas.")
+
+        print("[VERIFICACAO] Outbound OK: reservas distribuídas por igual." if ok
+              else "[VERIFICACAO] Outbound FALHOU.")
+        return ok
+
+    except Exception as e:
+        print(f"[VERIFICACAO] ERRO na verificação do outbound: {e}")
+        return False
+    finally:
+        try:
+            _limpar_outbound_teste()
+        except Exception as e:
+            print(f"[VERIFICACAO] ERRO ao limpar as instâncias de teste: {e}")
+
+
+if __name__ == "__main__":
+    if "--leases" in sys.argv:
+        sys.exit(0 if verificar_leases() else 1)
+    if "--outbound" in sys.argv:
+        sys.exit(0 if verificar_outbound() else 1)
+    print(__doc__)
+    sys.exit(1)
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Os módulos importam `config` e `utils.*` a partir da raiz do projeto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Sem journal em disco ao importar o debounce_manager (cada teste escolhe o seu)
+os.environ.setdefault("DEBOUNCE_JOURNAL", "nenhum")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "lento: teste de carga (pular com -m 'not lento')")
@@ -0,0 +1,221 @@
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("pymysql")
+
+from services import api_clients
+
+
+@pytest.fixture(autouse=True)
+def cache_limpo():
+    api_clients.cache_kommo_leads.limpar()
+    api_clients.cache_kommo_contatos.limpar()
+
+
+def _guardar_lead(id_lead, updated_at):
+    api_clients._guardar_kommo(api_clients.cache_kommo_leads, id_lead, {"id": id_lead, "updated_at": updated_at})
+
+
+def test_invalidacao_respeita_updated_at_do_webhook():
+    _guardar_lead(1, 200)
+
+    api_clients.invalidar_lead_kommo("1", "150")     # webhook mais velho que o cache
+    assert api_clients.cache_kommo_leads.get(1) is not None
+
+    api_clients.invalidar_lead_kommo("1", "250")
+    assert api_clients.cache_kommo_leads.get(1) is None
+
+
+@pytest.mark.parametrize("updated_at", [None, "", "abc", "12.5"])
+def test_updated_at_ausente_ou_invalido_invalida_sem_erro(updated_at):
+    _guardar_lead(1, 200)
+
+    api_clients.invalidar_lead_kommo("1", updated_at)
+
+    assert api_clients.cache_kommo_leads.get(1) is None
+
+
+def test_id_invalido_e_ignorado():
+    api_clients.invalidar_lead_kommo("")
+    api_clients.invalidar_lead_kommo(None)
+
+
+class SessaoFalsa:
+    def __init__(self):
+        self.fechada = False
+
+    def close(self):
+        self.fechada = True
+
+
+def test_uma_sessao_por_host_e_fechamento(monkeypatch):
+    monkeypatch.setattr(api_clients, "_criar_sessao", SessaoFalsa)
+    monkeypatch.setattr(api_clients, "_sessoes", {})
+
+    kommo = api_clients.get_robust_session("https://conta.kommo.com/api/v4/leads/1")
+    assert api_clients.get_robust_session("https://conta.kommo.com/api/v4/contacts") is kommo
+    evolution = api_clients.get_robust_session("http://evolution:8080/message/sendText/x")
+    assert evolution is not kommo
+
+    api_clients.fechar_sessoes()
+
+    assert kommo.fechada and evolution.fechada
+    assert api_clients.get_robust_session("https://conta.kommo.com/api/v4/leads/1") is not kommo
+
+
+class RespostaFalsa:
+    def __init__(self, status_code=200, corpo=None):
+        self.status_code = status_code
+        self.corpo = corpo if corpo is not None else {}
+        self.text = str(self.corpo)
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.corpo
+
+
+class SessaoHttpFalsa:
+    """Devolve as respostas da fila (uma por chamada) e anota cada chamada."""
+
+    def __init__(self, *respostas):
+        self.respostas = list(respostas)
+        self.chamadas = []
+
+    def _responder(self, metodo, url, json=None, **kwargs):
+        self.chamadas.append((metodo, url, json))
+        resposta = self.respostas.pop(0) if len(self.respostas) > 1 else self.respostas[0]
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta(json) if callable(resposta) else resposta
+
+    def post(self, url, **kwargs):
+        return self._responder("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self._responder("PATCH", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._responder("GET", url, **kwargs)
+
+
+class LimitadorFalso:
+    def __init__(self):
+        self.consumidos = 0
+        self.devolvidos = 0
+
+    def consumir(self, instance_id, prioritario=False, espera_max=None):
+        self.consumidos += 1
+        return True
+
+    def devolver(self, instance_id):
+        self.devolvidos += 1
+
+
+@pytest.fixture
+def evolution(monkeypatch):
+    limitador = LimitadorFalso()
+    monkeypatch.setattr(api_clients, "EVOLUTION_API_URL", "http://evolution")
+    monkeypatch.setattr(api_clients, "EVOLUTION_API_KEY", "chave")
+    monkeypatch.setattr(api_clients, "limitador_envios", limitador)
+    return limitador
+
+
+def _usar_sessao(monkeypatch, sessao):
+    monkeypatch.setattr(api_clients, "get_robust_session", lambda url: sessao)
+
+
+def test_envio_com_falha_devolve_o_token(monkeypatch, evolution):
+    _usar_sessao(monkeypatch, SessaoHttpFalsa(RespostaFalsa(500)))
+    assert api_clients.enviar_mensagem_evolution("5511999999999", "oi", "inst") is None
+
+    _usar_sessao(monkeypatch, SessaoHttpFalsa(ConnectionError("sem rede")))
+    assert api_clients.enviar_mensagem_evolution("5511999999999", "oi", "inst") is None
+
+    assert (evolution.consumidos, evolution.devolvidos) == (2, 2)
+
+
+def test_envio_com_sucesso_fica_com_o_token(monkeypatch, evolution):
+    _usar_sessao(monkeypatch, SessaoHttpFalsa(RespostaFalsa(201, {"key": "x"})))
+
+    assert api_clients.enviar_mensagem_evolution("5511999999999", "oi", "inst") == {"key": "x"}
+    assert (evolution.consumidos, evolution.devolvidos) == (1, 0)
+
+
+def test_pdf_que_falha_e_vira_texto_gasta_um_token(monkeypatch, evolution):
+    _usar_sessao(monkeypatch, SessaoHttpFalsa(RespostaFalsa(413), RespostaFalsa(201, {"key": "x"})))
+
+    enviado = api_clients.enviar_midia_base64_evolution("5511999999999", "inst", "JVBERi0", "a.pdf", "oi")
+    if not enviado:
+        enviado = api_clients.enviar_mensagem_evolution("5511999999999", "oi", "inst", prioritario=True)
+
+    assert enviado == {"key": "x"}
+    assert evolution.consumidos - evolution.devolvidos == 1
+
+
+@pytest.fixture
+def kommo(monkeypatch):
+    monkeypatch.setattr(api_clients, "KOMMO_API_TOKEN", "token")
+    monkeypatch.setattr(api_clients, "KOMMO_API_SUBDOMAIN", "conta")
+    monkeypatch.setattr(api_clients, "LIMITE_LOTE_KOMMO", 10)
+
+
+def _leads_confirmados(exceto=()):
+    """Resposta do PATCH em lote confirmando os leads enviados (menos `exceto`)."""
+    return lambda corpo: RespostaFalsa(200, {"_embedded": {"leads": [
+        {"id": lead["id"]} for lead in corpo if lead["id"] not in exceto
+    ]}})
+
+
+@pytest.mark.parametrize("quantidade, chamadas", [(1, 1), (10, 1), (11, 2), (25, 3)])
+def test_patch_em_lote_faz_uma_chamada_por_lote(monkeypatch, kommo, quantidade, chamadas):
+    sessao = SessaoHttpFalsa(_leads_confirmados())
+    _usar_sessao(monkeypatch, sessao)
+
+    atualizados = api_clients.atualizar_status_leads_kommo(list(range(1, quantidade + 1)), 99)
+
+    assert atualizados == set(range(1, quantidade + 1))
+    assert len(sessao.chamadas) == chamadas
+    assert all(metodo == "PATCH" and len(corpo) <= 10 for metodo, _, corpo in sessao.chamadas)
+
+
+def test_lead_nao_confirmado_no_lote_fica_de_fora(monkeypatch, kommo):
+    _usar_sessao(monkeypatch, SessaoHttpFalsa(_leads_confirmados(exceto={3, 7})))
+
+    atualizados = api_clients.atualizar_status_leads_kommo(list(range(1, 11)), 99)
+
+    assert atualizados == set(range(1, 11)) - {3, 7}
+
+
+def test_lote_recusado_e_refeito_lead_a_lead(monkeypatch, kommo):
+    def responder(corpo):
+        if isinstance(corpo, list):
+            return RespostaFalsa(400, {"erro": "lote inválido"})
+        return RespostaFalsa(200, {"id": 1})
+
+    sessao = SessaoHttpFalsa(responder, responder, responder, RespostaFalsa(404), responder)
+    _usar_sessao(monkeypatch, sessao)
+
+    atualizados = api_clients.atualizar_status_leads_kommo([1, 2, 3, 4], 99)
+
+    # Lote recusado, depois 4 PATCHs individuais, e o terceiro lead falha
+    assert len(sessao.chamadas) == 5
+    assert atualizados == {1, 2, 4}
+
+
+def test_notas_em_lote(monkeypatch, kommo):
+    def responder(corpo):
+        return RespostaFalsa(200, {"_embedded": {"notes": [
+            {"entity_id": nota["entity_id"]} for nota in corpo if nota["entity_id"] != 5
+        ]}})
+
+    sessao = SessaoHttpFalsa(responder)
+    _usar_sessao(monkeypatch, sessao)
+
+    com_nota = api_clients.criar_notas_leads_kommo([(i, f"nota {i}") for i in range(1, 22)])
+
+    assert len(sessao.chamadas) == 3
+    assert com_nota == set(range(1, 22)) - {5}
@@ -0,0 +1,48 @@
+from utils import cache
+from utils.cache import CacheTTL
+
+
+class Relogio:
+    """Substitui o módulo `time` do código testado (só monotonic é usado)."""
+
+    def __init__(self):
+        self.agora = 1000.0
+
+    def monotonic(self):
+        return self.agora
+
+
+def test_item_expira_depois_do_ttl(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(cache, "time", relogio)
+    c = CacheTTL(ttl=10, tamanho_maximo=10)
+    c.set("a", 1)
+
+    relogio.agora += 9.9
+    assert c.get("a") == 1
+    relogio.agora += 0.1
+    assert c.get("a", "ausente") == "ausente"
+
+    metricas = c.metricas()
+    assert (metricas["hits"], metricas["misses"], metricas["expirados"], metricas["itens"]) == (1, 1, 1, 0)
+
+
+def test_lru_remove_o_menos_usado():
+    c = CacheTTL(ttl=60, tamanho_maximo=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")          # "a" passa a ser o mais recente
+    c.set("c", 3)
+
+    assert c.get("b") is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+    assert c.metricas()["removidos_lru"] == 1
+
+
+def test_none_nao_e_guardado_e_invalidar_remove():
+    c = CacheTTL(ttl=60, tamanho_maximo=2)
+    c.set("a", None)
+    c.set("b", 2)
+    c.invalidar("b")
+
+    assert c.metricas()["itens"] == 0
@@ -0,0 +1,100 @@
+import pytest
+
+pytest.importorskip("pymysql")
+
+from services import db_manager
+
+
+class CursorFalso:
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastrowid = None
+        self.rowcount = 0
+        self._resultado = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.conn.comandos.append((sql, list(params) if params is not None else None))
+        if sql.startswith("INSERT INTO leads"):
+            self.lastrowid = self.conn.lead_id
+        elif sql.startswith("SELECT numero_normalizado"):
+            self._resultado = [(n,) for n in params[1:] if n in self.conn.existentes]
+        self.rowcount = 1
+
+    def fetchall(self):
+        return self._resultado
+
+    def close(self):
+        pass
+
+
+class ConexaoFalsa:
+    def __init__(self, lead_id=42, existentes=()):
+        self.lead_id = lead_id
+        self.existentes = set(existentes)
+        self.comandos = []
+        self.commits = 0
+
+    def cursor(self, *args):
+        return CursorFalso(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def conexao(monkeypatch):
+    def usar(**kwargs):
+        conn = ConexaoFalsa(**kwargs)
+        monkeypatch.setattr(db_manager, "get_db_connection", lambda: conn)
+        return conn
+    return usar
+
+
+def _comandos(conn, inicio):
+    return [c for c in conn.comandos if c[0].startswith(inicio)]
+
+
+def test_sincronizar_insere_os_numeros_novos_num_unico_insert(conexao):
+    conn = conexao(lead_id=42, existentes={"5532999998888"})
+
+    lead_id = db_manager.sincronizar_numeros_lead(
+        7001, 9001, 3, "Maria",
+        ["+55 (32) 99999-8888",     # já existe no lead
+         "+55 (32) 9999-7777",      # sem o 9º dígito: mesma chave que o próximo
+         "5532999997777",
+         "+55 11 98888-0000",
+         "123"]                     # curto demais, ignorado
+    )
+
+    assert lead_id == 42
+    upsert = _comandos(conn, "INSERT INTO leads")
+    assert upsert[0][1] == [7001, 9001, 3, "Maria"]
+    assert "id = LAST_INSERT_ID(id)" in upsert[0][0]
+
+    existencia = _comandos(conn, "SELECT numero_normalizado")
+    assert existencia[0][1] == [42, "5532999998888", "5532999997777", "5511988880000"]
+
+    insercoes = _comandos(conn, "INSERT INTO contato_numeros")
+    assert len(insercoes) == 1
+    sql, params = insercoes[0]
+    assert sql.count("(%s, %s, %s, 'sem envio')") == 2
+    assert params == [42, "+553299997777", "5532999997777", 42, "+5511988880000", "5511988880000"]
+    assert "ON DUPLICATE KEY UPDATE id = id" in sql
+    assert conn.commits == 1
+
+
+def test_sincronizar_sem_numeros_novos_nao_insere(conexao):
+    conn = conexao(existentes={"5532999998888"})
+
+    db_manager.sincronizar_numeros_lead(7001, None, 3, "Maria", ["+5532999998888"])
+
+    assert not _comandos(conn, "INSERT INTO contato_numeros")
+    assert _comandos(conn, "INSERT INTO leads")[0][1][1] == 0      # sem contato vira 0
+    assert conn.commits == 1
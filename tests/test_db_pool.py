@@ -0,0 +1,116 @@
+import pytest
+
+pytest.importorskip("pymysql")
+
+from services import db_pool
+from services.db_pool import PoolConexoes
+
+
+class ConexaoFalsa:
+    def __init__(self, ping_falha=False):
+        self.ping_falha = ping_falha
+        self.pings = 0
+        self.rollbacks = 0
+        self.fechada = False
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.ping_falha:
+            raise ConnectionError("servidor foi embora")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.fechada = True
+
+
+class Relogio:
+    """Substitui o módulo `time` do código testado (só monotonic é usado)."""
+
+    def __init__(self):
+        self.agora = 1000.0
+
+    def monotonic(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    r = Relogio()
+    monkeypatch.setattr(db_pool, "time", r)
+    return r
+
+
+def _pool(monkeypatch, tamanho=2, timeout=0.0, max_lifetime=100, ping_interval=10):
+    p = PoolConexoes(tamanho, timeout, max_lifetime, ping_interval)
+    criadas = []
+
+    def nova():
+        conn = ConexaoFalsa()
+        criadas.append(conn)
+        return conn
+
+    monkeypatch.setattr(p, "_nova_conexao", nova)
+    return p, criadas
+
+
+def test_devolver_reaproveita_e_encerra_a_transacao(monkeypatch, relogio):
+    p, criadas = _pool(monkeypatch)
+
+    conn = p.obter()
+    conn.close()
+    conn.close()        # segundo close não devolve de novo
+    de_novo = p.obter()
+
+    assert len(criadas) == 1
+    assert de_novo._conn is criadas[0]
+    assert criadas[0].rollbacks == 1
+    assert p.metricas()["em_uso"] == 1
+
+
+def test_limite_de_conexoes_da_timeout(monkeypatch, relogio):
+    p, _ = _pool(monkeypatch, tamanho=1)
+    p.obter()
+
+    with pytest.raises(TimeoutError):
+        p.obter()
+    assert p.metricas()["timeouts"] == 1
+
+
+def test_ping_so_em_conexao_ociosa(monkeypatch, relogio):
+    p, criadas = _pool(monkeypatch)
+    p.obter().close()
+
+    relogio.agora += 5
+    p.obter().close()
+    assert criadas[0].pings == 0
+
+    relogio.agora += 11
+    p.obter().close()
+    assert criadas[0].pings == 1
+
+
+def test_ping_que_falha_troca_a_conexao(monkeypatch, relogio):
+    p, criadas = _pool(monkeypatch)
+    p.obter().close()
+    criadas[0].ping_falha = True
+
+    relogio.agora += 11
+    conn = p.obter()
+
+    assert criadas[0].fechada
+    assert conn._conn is criadas[1]
+    assert p.metricas()["recicladas"] == 1
+
+
+def test_conexao_velha_e_reciclada_sem_ping(monkeypatch, relogio):
+    p, criadas = _pool(monkeypatch)
+    p.obter().close()
+
+    relogio.agora += 101
+    conn = p.obter()
+
+    assert criadas[0].fechada and criadas[0].pings == 0
+    assert conn._conn is criadas[1]
+    assert p.metricas()["abertas"] == 1
@@ -0,0 +1,51 @@
+from utils.debounce_journal import JournalArquivo, JournalNulo
+
+
+def test_carregar_reconstroi_so_os_buffers_pendentes(tmp_path):
+    journal = JournalArquivo(str(tmp_path / "journal.log"))
+    journal.registrar_mensagem("a", "oi", {"n": 1}, 100.0, 110.0)
+    journal.registrar_mensagem("b", "sim", {"n": 2}, 101.0, 111.0)
+    journal.registrar_mensagem("a", "tudo bem?", {"n": 3}, 100.0, 115.0)
+    journal.registrar_fim("b")
+
+    pendentes = JournalArquivo(str(tmp_path / "journal.log")).carregar()
+
+    assert pendentes == {"a": {"textos": ["oi", "tudo bem?"], "data": {"n": 3}, "inicio": 100.0, "prazo": 115.0}}
+
+
+def test_carregar_ignora_linha_truncada(tmp_path):
+    caminho = tmp_path / "journal.log"
+    journal = JournalArquivo(str(caminho))
+    journal.registrar_mensagem("a", "oi", {}, 100.0, 110.0)
+    with open(caminho, "a", encoding="utf-8") as f:
+        f.write('{"op": "msg", "jid": "b", "tex')
+
+    assert list(journal.carregar()) == ["a"]
+
+
+def test_compactar_reescreve_so_os_vivos_e_segue_gravando(tmp_path):
+    caminho = tmp_path / "journal.log"
+    journal = JournalArquivo(str(caminho), compactar_a_cada=3)
+    journal.registrar_mensagem("a", "oi", {}, 100.0, 110.0)
+    journal.registrar_mensagem("b", "sim", {}, 101.0, 111.0)
+    journal.registrar_fim("b")
+    assert journal.precisa_compactar()
+
+    journal.compactar({"a": {"textos": ["oi"], "data": {}, "inicio": 100.0, "prazo": 110.0}})
+    assert not journal.precisa_compactar()
+    assert len(caminho.read_text(encoding="utf-8").splitlines()) == 1
+
+    # Depois da troca do arquivo as escritas continuam no journal novo
+    journal.registrar_mensagem("a", "tudo bem?", {"n": 2}, 100.0, 120.0)
+    journal.registrar_mensagem("c", "alô", {}, 102.0, 112.0)
+    journal.registrar_fim("c")
+
+    assert journal.carregar() == {"a": {"textos": ["oi", "tudo bem?"], "data": {"n": 2}, "inicio": 100.0, "prazo": 120.0}}
+
+
+def test_journal_nulo_nao_guarda_nada():
+    journal = JournalNulo()
+    journal.registrar_mensagem("a", "oi", {}, 100.0, 110.0)
+
+    assert journal.carregar() == {}
+    assert not journal.precisa_compactar()
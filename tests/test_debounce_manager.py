@@ -0,0 +1,239 @@
+import threading
+import time
+
+import pytest
+
+from utils import debounce_manager
+from utils.debounce_journal import JournalArquivo, JournalNulo
+
+
+@pytest.fixture
+def agendador(monkeypatch):
+    """Estado do debounce zerado e processar_buffer trocado por um que anota a ordem."""
+    processados = []
+
+    def processar(remote_jid, callback_funcao):
+        with debounce_manager._lock:
+            conteudo = debounce_manager.buffers.pop(remote_jid, None)
+        processados.append((remote_jid, conteudo['textos'] if conteudo else None))
+
+    with debounce_manager._lock:
+        debounce_manager.buffers.clear()
+        debounce_manager._heap.clear()
+        debounce_manager._cadencia.clear()
+    monkeypatch.setattr(debounce_manager, "journal", JournalNulo())
+    monkeypatch.setattr(debounce_manager, "processar_buffer", processar)
+    # Janela de 0.5s sem histórico; respostas completas saem em 0.2s
+    monkeypatch.setattr(debounce_manager, "TEMPO_DE_ESPERA", 0.5)
+    monkeypatch.setattr(debounce_manager, "TEMPO_MINIMO_ESPERA", 0.2)
+    return processados
+
+
+def _mensagem(jid, texto):
+    debounce_manager.adicionar_mensagem_buffer(jid, {"mensagem_recebida": texto}, lambda dados: None)
+
+
+def _aguardar(processados, quantidade, timeout=3.0):
+    limite = time.monotonic() + timeout
+    while len(processados) < quantidade and time.monotonic() < limite:
+        time.sleep(0.01)
+    return processados
+
+
+def test_buffers_saem_na_ordem_dos_prazos(agendador):
+    _mensagem("a", "oi")
+    _mensagem("b", "tudo bem?")
+    _mensagem("c", "sim")       # resposta completa: janela mínima, sai primeiro
+    time.sleep(0.3)
+    _mensagem("a", "é sobre o precatório")  # reagenda "a" (1.5 x 0.3s) para depois de "b"
+
+    processados = _aguardar(agendador, 3)
+    time.sleep(0.6)
+
+    assert [jid for jid, _ in processados] == ["c", "b", "a"]
+    assert processados[2][1] == ["oi", "é sobre o precatório"]
+
+
+def test_entrada_antiga_do_heap_e_ignorada(agendador):
+    _mensagem("a", "um")
+    _mensagem("a", "dois")
+    _mensagem("a", "três")
+
+    _aguardar(agendador, 1)
+    time.sleep(0.6)
+
+    assert agendador == [("a", ["um", "dois", "três"])]
+
+
+def test_erro_no_buffer_nao_derruba_o_agendador(agendador, monkeypatch):
+    processar = debounce_manager.processar_buffer
+
+    def processar_com_erro(remote_jid, callback_funcao):
+        if remote_jid == "quebra":
+            with debounce_manager._lock:
+                debounce_manager.buffers.pop(remote_jid, None)
+            raise RuntimeError("falha no callback")
+        processar(remote_jid, callback_funcao)
+
+    monkeypatch.setattr(debounce_manager, "processar_buffer", processar_com_erro)
+
+    _mensagem("quebra", "sim")
+    time.sleep(0.05)
+    _mensagem("depois", "sim")
+
+    assert _aguardar(agendador, 1) == [("depois", ["sim"])]
+
+
+def test_restaurar_processa_os_vencidos_na_ordem_dos_prazos(agendador, monkeypatch, tmp_path):
+    agora = time.time()
+    journal = JournalArquivo(str(tmp_path / "journal.log"))
+    # Ordem do journal diferente da ordem dos prazos
+    journal.registrar_mensagem("vence-depois", "oi", {}, agora - 20, agora + 0.3)
+    journal.registrar_mensagem("venceu-por-ultimo", "sim", {}, agora - 20, agora - 1)
+    journal.registrar_mensagem("venceu-primeiro", "alô", {}, agora - 20, agora - 5)
+    monkeypatch.setattr(debounce_manager, "journal", journal)
+
+    debounce_manager.restaurar_buffers(lambda dados: None)
+    processados = _aguardar(agendador, 3)
+
+    assert processados == [
+        ("venceu-primeiro", ["alô"]),
+        ("venceu-por-ultimo", ["sim"]),
+        ("vence-depois", ["oi"]),
+    ]
+
+
+def test_janela_acompanha_a_cadencia_do_usuario(monkeypatch):
+    monkeypatch.setattr(debounce_manager, "TEMPO_DE_ESPERA", 10.0)
+    monkeypatch.setattr(debounce_manager, "TEMPO_MINIMO_ESPERA", 2.0)
+    with debounce_manager._lock:
+        debounce_manager._cadencia.clear()
+
+        # Sem histórico: janela máxima
+        assert debounce_manager._calcular_janela("a", 0.0) == 10.0
+        # Intervalo de 4s -> 1.5 x 4 = 6s
+        assert debounce_manager._calcular_janela("a", 4.0) == pytest.approx(6.0)
+        # Quem digita rápido cai no mínimo
+        assert debounce_manager._calcular_janela("b", 0.0) == 10.0
+        assert debounce_manager._calcular_janela("b", 0.5) == 2.0
+        # Uma pausa longa não entra na média
+        assert debounce_manager._calcular_janela("a", 500.0) == pytest.approx(6.0)
+
+
+def test_resposta_completa_encurta_a_janela():
+    assert debounce_manager._mensagem_completa("Sim!")
+    assert debounce_manager._mensagem_completa("  não   sou eu. ")
+    assert not debounce_manager._mensagem_completa("sim, mas quem é você?")
+    assert not debounce_manager._mensagem_completa("s")
+    assert not debounce_manager._mensagem_completa("sou")
+
+
+def test_confirmacao_seguida_de_outra_mensagem_fica_no_mesmo_buffer(agendador):
+    _mensagem("a", "sim")
+    time.sleep(0.05)
+    _mensagem("a", "mas só amanhã")
+
+    _aguardar(agendador, 1)
+    time.sleep(0.6)
+
+    assert agendador == [("a", ["sim", "mas só amanhã"])]
+
+
+class PoolCheio:
+    """Recusa as primeiras `recusas` tarefas, depois aceita e anota."""
+
+    def __init__(self, recusas):
+        self.recusas = recusas
+        self.aceitas = []
+
+    def enviar(self, funcao, *args):
+        if self.recusas:
+            self.recusas -= 1
+            return False
+        self.aceitas.append(args[0]['mensagem_recebida'])
+        return True
+
+
+def test_buffer_sobrevive_a_fila_cheia(monkeypatch, tmp_path):
+    with debounce_manager._lock:
+        debounce_manager.buffers.clear()
+        debounce_manager._heap.clear()
+        debounce_manager._cadencia.clear()
+        debounce_manager._garantir_agendador()
+    journal = JournalArquivo(str(tmp_path / "journal.log"))
+    pool = PoolCheio(recusas=2)
+    monkeypatch.setattr(debounce_manager, "journal", journal)
+    monkeypatch.setattr(debounce_manager, "_pool_callbacks", pool)
+    monkeypatch.setattr(debounce_manager, "TEMPO_DE_ESPERA", 0.1)
+    monkeypatch.setattr(debounce_manager, "TEMPO_MINIMO_ESPERA", 0.1)
+    monkeypatch.setattr(debounce_manager, "ESPERA_FILA_CHEIA", 0.2)
+
+    _mensagem("a", "oi")
+    time.sleep(0.2)
+
+    # Recusado: continua em memória e pendente no journal
+    assert pool.aceitas == []
+    assert "a" in debounce_manager.buffers
+    assert "a" in journal.carregar()
+
+    limite = time.monotonic() + 3
+    while not pool.aceitas and time.monotonic() < limite:
+        time.sleep(0.01)
+
+    assert pool.aceitas == ["oi"]
+    assert "a" not in debounce_manager.buffers
+    assert journal.carregar() == {}
+
+
+class PoolAnotador:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entregues = {}
+
+    def enviar(self, funcao, *args):
+        dados = args[0]
+        with self.lock:
+            self.entregues.setdefault(dados['jid'], []).append(dados['mensagem_recebida'])
+        return True
+
+
+@pytest.mark.lento
+def test_carga_com_dez_mil_jids(monkeypatch):
+    jids, threads, mensagens_por_jid = 10000, 20, 3
+    with debounce_manager._lock:
+        debounce_manager.buffers.clear()
+        debounce_manager._heap.clear()
+        debounce_manager._cadencia.clear()
+        debounce_manager._garantir_agendador()
+    pool = PoolAnotador()
+    monkeypatch.setattr(debounce_manager, "journal", JournalNulo())
+    monkeypatch.setattr(debounce_manager, "_pool_callbacks", pool)
+    monkeypatch.setattr(debounce_manager, "TEMPO_DE_ESPERA", 0.5)
+    monkeypatch.setattr(debounce_manager, "TEMPO_MINIMO_ESPERA", 0.5)
+    monkeypatch.setattr(debounce_manager, "print", lambda *args, **kwargs: None, raising=False)
+
+    def produtor(inicio):
+        for rodada in range(mensagens_por_jid):
+            for n in range(inicio, jids, threads):
+                jid = f"{n}@s.whatsapp.net"
+                debounce_manager.adicionar_mensagem_buffer(
+                    jid, {"jid": jid, "mensagem_recebida": f"{n}-{rodada}"}, lambda dados: None
+                )
+
+    produtores = [threading.Thread(target=produtor, args=(i,)) for i in range(threads)]
+    comeco = time.monotonic()
+    for produtor_thread in produtores:
+        produtor_thread.start()
+    for produtor_thread in produtores:
+        produtor_thread.join()
+    enfileirar = time.monotonic() - comeco
+
+    limite = time.monotonic() + 30
+    while len(pool.entregues) < jids and time.monotonic() < limite:
+        time.sleep(0.05)
+
+    assert len(pool.entregues) == jids
+    esperado = lambda n: ["\n".join(f"{n}-{rodada}" for rodada in range(mensagens_por_jid))]
+    assert all(pool.entregues[f"{n}@s.whatsapp.net"] == esperado(n) for n in range(jids))
+    assert not debounce_manager.buffers
+    print(f"{jids * mensagens_por_jid} mensagens de {jids} JIDs enfileiradas em {enfileirar:.2f}s")
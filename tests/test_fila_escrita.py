@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+
+pytest.importorskip("pymysql")
+
+from services import fila_escrita as modulo
+from services.fila_escrita import FilaEscrita
+
+
+class BancoFalso:
+    """Substitui FilaEscrita._executar: anota os lotes e falha quando mandado."""
+
+    def __init__(self, falhar=None):
+        self.lotes = []
+        self.falhar = falhar or (lambda lote, tentativa: False)
+        self.tentativas = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, lote):
+        with self.lock:
+            self.tentativas += 1
+            if self.falhar(lote, self.tentativas):
+                raise RuntimeError("banco fora")
+            self.lotes.append(list(lote))
+
+
+@pytest.fixture
+def fila(monkeypatch, tmp_path):
+    monkeypatch.setattr(modulo, "ESPERA_BASE_TENTATIVA", 0)
+    criadas = []
+
+    def criar(banco, janela=0.05, caminho=str(tmp_path / "falhas.jsonl")):
+        f = FilaEscrita(janela, 200, tentativas=3, caminho_falhas=caminho)
+        monkeypatch.setattr(f, "_executar", banco)
+        criadas.append(f)
+        return f
+
+    yield criar
+    for f in criadas:
+        f.encerrar()
+
+
+def test_falha_passageira_e_resolvida_na_retentativa(fila):
+    banco = BancoFalso(falhar=lambda lote, tentativa: tentativa == 1)
+    f = fila(banco)
+    f.enfileirar(('msg', 1, "oi", 'usuario'))
+
+    assert f.aguardar(1)
+    assert banco.lotes == [[('msg', 1, "oi", 'usuario')]]
+    metricas = f.metricas()
+    assert (metricas["falhas"], metricas["arquivadas"], metricas["descartadas"]) == (1, 0, 0)
+
+
+def test_operacao_que_sempre_falha_vai_para_o_arquivo_e_volta_no_inicio(fila, tmp_path):
+    ruim = ('msg', 2, "quebra", 'usuario')
+    banco = BancoFalso(falhar=lambda lote, tentativa: ruim in lote)
+    f = fila(banco, janela=0.2)
+    f.enfileirar(('msg', 1, "oi", 'usuario'))
+    f.enfileirar(ruim)
+    f.enfileirar(('status', 3, 'em tratativa', True))
+
+    assert f.aguardar()
+    assert banco.lotes == [[('msg', 1, "oi", 'usuario')], [('status', 3, 'em tratativa', True)]]
+    metricas = f.metricas()
+    assert metricas["arquivadas"] == 1 and metricas["descartadas"] == 0
+    f.encerrar()
+
+    # Com o banco de volta, o próximo início regrava a operação arquivada
+    banco_ok = BancoFalso()
+    nova = fila(banco_ok)
+    nova.enfileirar(('msg', 4, "depois", 'agente'))
+
+    assert nova.aguardar()
+    gravadas = [op for lote in banco_ok.lotes for op in lote]
+    assert gravadas == [ruim, ('msg', 4, "depois", 'agente')]
+    assert nova.metricas()["reprocessadas"] == 1
+    assert not (tmp_path / "falhas.jsonl").exists()
+
+
+def test_sem_arquivo_conta_como_descartada(fila):
+    banco = BancoFalso(falhar=lambda lote, tentativa: True)
+    f = fila(banco, caminho=None)
+    f.enfileirar(('msg', 1, "oi", 'usuario'))
+
+    assert f.aguardar(1)
+    assert f.metricas()["descartadas"] == 1
+
+
+def test_escritas_da_janela_saem_num_lote_na_ordem(fila):
+    banco = BancoFalso()
+    f = fila(banco, janela=0.2)
+    ops = [('msg', i % 7, f"m{i}", 'usuario') if i % 3 else ('status', i % 7, 'em tratativa', True)
+           for i in range(100)]
+    for op in ops:
+        f.enfileirar(op)
+
+    assert f.aguardar()
+    assert banco.lotes == [ops]
+    assert f.metricas()["lotes"] == 1
+
+
+def test_aguardar_espera_a_gravacao_do_numero(fila):
+    liberar = threading.Event()
+    banco = BancoFalso()
+
+    def executar_devagar(lote):
+        liberar.wait(5)
+        banco(lote)
+
+    f = fila(executar_devagar)
+    f.enfileirar(('msg', 1, "oi", 'usuario'))
+
+    assert f.tem_pendencias(1)
+    assert not f.tem_pendencias(2)
+    assert f.aguardar(2, timeout=0.1)                # nada pendente do número 2
+    assert not f.aguardar(1, timeout=0.1)            # ainda gravando
+
+    liberar.set()
+    assert f.aguardar(1, timeout=2)
+    assert not f.tem_pendencias(1)
+    assert banco.lotes == [[('msg', 1, "oi", 'usuario')]]
+
+
+def test_depois_do_encerramento_grava_direto(fila):
+    banco = BancoFalso()
+    f = fila(banco)
+    f.encerrar()
+
+    f.enfileirar(('status', 5, 'objeção', False))
+
+    assert banco.lotes == [[('status', 5, 'objeção', False)]]
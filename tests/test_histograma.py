@@ -0,0 +1,24 @@
+from utils.histograma import Histograma
+
+
+def test_percentis_pelos_baldes():
+    histograma = Histograma([1, 2, 5])
+    for valor in [0.5, 0.8, 1.5, 1.9, 3, 4, 4.5, 6, 7, 9]:
+        histograma.registrar(valor)
+
+    assert histograma.percentil(20) == 1
+    assert histograma.percentil(50) == 5
+    assert histograma.percentil(90) == ">5"
+
+
+def test_metricas():
+    histograma = Histograma([1, 2])
+    assert histograma.metricas()["p50_s"] is None
+
+    histograma.registrar(1)      # limite do balde conta no próprio balde
+    histograma.registrar(3)
+
+    metricas = histograma.metricas()
+    assert metricas["total"] == 2
+    assert metricas["media_s"] == 2.0
+    assert metricas["baldes"] == {"<=1s": 1, "<=2s": 0, ">2s": 1}
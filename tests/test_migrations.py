@@ -0,0 +1,164 @@
+import pytest
+
+pytest.importorskip("pymysql")
+pytest.importorskip("dotenv")
+
+from services import migrations
+
+
+class CursorFalso:
+    """Responde às consultas em information_schema e às leituras das migrações."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connection = conn
+        self.rowcount = 0
+        self.description = None
+        self._resultado = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.conn.comandos.append((sql, tuple(params) if params is not None else None))
+        if "information_schema" in sql:
+            # Coluna/índice: (tabela, nome); trigger: (nome,)
+            self._resultado = [(1 if params[-1] in self.conn.existentes else 0,)]
+        elif sql.startswith("SELECT nome FROM schema_migracoes"):
+            self._resultado = [(nome,) for nome in self.conn.aplicadas]
+        elif sql.startswith("SELECT id, numero FROM contato_numeros"):
+            ultimo_id, limite = params
+            self._resultado = [l for l in self.conn.numeros if l[0] > ultimo_id][:limite]
+        elif sql.startswith("SELECT GROUP_CONCAT"):
+            self._resultado = [(g,) for g in self.conn.grupos]
+        elif sql.startswith("EXPLAIN"):
+            self.description = [(c,) for c in ("id", "table", "type", "rows")]
+            self._resultado = self.conn.planos.pop(0)
+        else:
+            self._resultado = []
+
+    def executemany(self, sql, params):
+        self.conn.comandos.append((" ".join(sql.split()), [tuple(p) for p in params]))
+
+    def fetchone(self):
+        return self._resultado[0]
+
+    def fetchall(self):
+        return self._resultado
+
+    def close(self):
+        pass
+
+
+class ConexaoFalsa:
+    def __init__(self, existentes=(), aplicadas=(), numeros=(), grupos=(), planos=()):
+        self.existentes = set(existentes)
+        self.planos = list(planos)
+        self.aplicadas = list(aplicadas)
+        self.numeros = list(numeros)
+        self.grupos = list(grupos)
+        self.comandos = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, *args):
+        return CursorFalso(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+def _ddl(conn):
+    return [sql for sql, _ in conn.comandos if sql.startswith(("ALTER", "CREATE INDEX", "CREATE UNIQUE", "CREATE TRIGGER"))]
+
+
+@pytest.mark.parametrize("passo, nome", [
+    (migrations._coluna("leads", "aberto", "ALTER TABLE leads ADD COLUMN aberto TINYINT"), "aberto"),
+    (migrations._indice("leads", "ix_x", "CREATE INDEX ix_x ON leads (status)"), "ix_x"),
+    (migrations._trigger("tr_x", "CREATE TRIGGER tr_x AFTER INSERT ON leads FOR EACH ROW SET @a = 1"), "tr_x"),
+])
+def test_passo_de_ddl_so_roda_se_ainda_nao_existir(passo, nome):
+    nova = ConexaoFalsa()
+    passo(nova.cursor())
+    assert len(_ddl(nova)) == 1
+
+    existente = ConexaoFalsa(existentes={nome})
+    passo(existente.cursor())
+    assert _ddl(existente) == []
+
+
+def test_aplicar_pula_as_migracoes_registradas(monkeypatch):
+    nomes = [nome for nome, _ in migrations.MIGRACOES]
+    conn = ConexaoFalsa(aplicadas=nomes[:-1])
+    monkeypatch.setattr(migrations, "get_db_connection", lambda: conn)
+
+    assert migrations.aplicar_migracoes()
+
+    registros = [p for sql, p in conn.comandos if sql.startswith("INSERT INTO schema_migracoes")]
+    assert registros == [(nomes[-1],)]
+    assert conn.commits == 1
+
+
+def test_aplicar_de_novo_apos_falha_nao_repete_ddl(monkeypatch):
+    # DDL faz commit implícito: na segunda passada tudo já existe e só o registro é gravado
+    conn = ConexaoFalsa(existentes={"numero_normalizado", "ux_contato_numeros_normalizado"})
+    monkeypatch.setattr(migrations, "MIGRACOES", migrations.MIGRACOES[:1])
+    monkeypatch.setattr(migrations, "get_db_connection", lambda: conn)
+
+    assert migrations.aplicar_migracoes()
+    assert _ddl(conn) == []
+
+
+def test_backfill_preenche_em_lotes_pela_chave(monkeypatch):
+    monkeypatch.setattr(migrations, "TAMANHO_LOTE_BACKFILL", 2)
+    conn = ConexaoFalsa(numeros=[(1, "+553299998888"), (4, "+55 11 98888-0000"), (9, "123")])
+
+    migrations._backfill_numero_normalizado(conn.cursor())
+
+    leituras = [p for sql, p in conn.comandos if sql.startswith("SELECT id, numero")]
+    assert leituras == [(0, 2), (4, 2), (9, 2)]
+    updates = [p for sql, p in conn.comandos if sql.startswith("UPDATE contato_numeros")]
+    assert updates == [[("5532999998888", 1), ("5511988880000", 4)], [("123", 9)]]
+    assert conn.commits == 2
+
+
+def test_deduplicar_mantem_o_primeiro_e_move_as_mensagens():
+    conn = ConexaoFalsa(grupos=["7,3,5"])
+
+    migrations._deduplicar_numeros_normalizados(conn.cursor())
+
+    comandos = [c for c in conn.comandos if not c[0].startswith("SELECT")]
+    assert comandos == [
+        ("UPDATE mensagens SET numero_id = %s WHERE numero_id IN (%s, %s)", (7, 3, 5)),
+        ("DELETE FROM contato_numeros WHERE id IN (%s, %s)", (3, 5)),
+    ]
+    assert conn.commits == 1
+
+
+def _planos(*tipos):
+    """Uma linha de EXPLAIN por consulta do scheduler, com o type pedido."""
+    return [[(1, "leads", tipo, 1000)] for tipo in tipos]
+
+
+def test_verificar_planos_ok_quando_todas_usam_indice(monkeypatch, capsys):
+    conn = ConexaoFalsa(planos=_planos("ref", "range", "ref"))
+    monkeypatch.setattr(migrations, "get_db_connection", lambda: conn)
+
+    assert migrations.verificar_planos()
+
+    explains = [sql for sql, _ in conn.comandos if sql.startswith("EXPLAIN")]
+    assert len(explains) == len(migrations.CONSULTAS_SCHEDULER)
+    assert all(not sql.endswith(";") for sql in explains)
+    assert "FULL SCAN" not in capsys.readouterr().out
+
+
+def test_verificar_planos_aponta_full_scan(monkeypatch, capsys):
+    conn = ConexaoFalsa(planos=_planos("ref", "ALL", "ref"))
+    monkeypatch.setattr(migrations, "get_db_connection", lambda: conn)
+
+    assert not migrations.verificar_planos()
+    assert "FULL SCAN em 'leads_para_finalizar'" in capsys.readouterr().out
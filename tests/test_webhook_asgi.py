@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+for modulo_necessario in ("dotenv", "pymysql", "requests", "aiomysql", "starlette", "uvicorn", "langgraph"):
+    pytest.importorskip(modulo_necessario)
+
+from services import verificacao_carga_asgi as carga
+from utils import debounce_manager
+
+
+@pytest.fixture
+def grafo(monkeypatch):
+    monkeypatch.setattr(debounce_manager, "TEMPO_DE_ESPERA", 0.1)
+    monkeypatch.setattr(debounce_manager, "TEMPO_MINIMO_ESPERA", 0.1)
+    return carga.simular_backends(monkeypatch.setattr)
+
+
+def test_webhooks_simultaneos_rodam_os_agentes_em_paralelo(grafo):
+    medidas = asyncio.run(carga.medir_carga(grafo, requisicoes=60, concorrencia=30))
+
+    assert medidas["respostas_200"] == 60
+    assert medidas["agentes_concluidos"] == 60
+    # O 200 sai antes do agente: o webhook não espera a LLM
+    assert medidas["webhook_p90"] < carga.LATENCIA_LLM
+    assert medidas["duracao_total"] < medidas["duracao_serial"] / 4
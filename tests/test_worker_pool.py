@@ -0,0 +1,70 @@
+import threading
+import time
+
+from utils.worker_pool import PoolTrabalho, POLITICA_DESCARTAR_ANTIGO
+
+
+def _pool_travado(politica, tamanho_fila=2):
+    """Pool de 1 worker preso numa tarefa até `liberar` ser setado."""
+    liberar = threading.Event()
+    ocupado = threading.Event()
+
+    def travar():
+        ocupado.set()
+        liberar.wait(5)
+
+    pool = PoolTrabalho("teste", 1, tamanho_fila, politica)
+    pool.enviar(travar)
+    assert ocupado.wait(2)
+    return pool, liberar
+
+
+def test_fila_cheia_recusa_a_tarefa_nova():
+    pool, liberar = _pool_travado("rejeitar")
+    feitas = []
+
+    assert pool.enviar(feitas.append, 1)
+    assert pool.enviar(feitas.append, 2)
+    assert not pool.enviar(feitas.append, 3)
+
+    liberar.set()
+    pool.encerrar(5)
+    assert feitas == [1, 2]
+    assert pool.metricas()["rejeitadas"] == 1
+
+
+def test_descartar_antigo_troca_a_mais_velha_pela_nova():
+    pool, liberar = _pool_travado(POLITICA_DESCARTAR_ANTIGO)
+    feitas = []
+
+    for i in range(1, 4):
+        assert pool.enviar(feitas.append, i)
+
+    liberar.set()
+    pool.encerrar(5)
+    assert feitas == [2, 3]
+    assert pool.metricas()["descartadas"] == 1
+
+
+def test_erro_na_tarefa_nao_mata_o_worker():
+    pool = PoolTrabalho("teste", 1, 10)
+    feitas = []
+
+    pool.enviar(lambda: 1 / 0)
+    pool.enviar(feitas.append, "ok")
+    pool.encerrar(5)
+
+    assert feitas == ["ok"]
+    metricas = pool.metricas()
+    assert (metricas["concluidas"], metricas["erros"]) == (2, 1)
+
+
+def test_encerrar_respeita_o_prazo_total():
+    pool = PoolTrabalho("teste", 3, 10)
+    for _ in range(3):
+        pool.enviar(time.sleep, 2)
+
+    inicio = time.monotonic()
+    pool.encerrar(0.3)
+
+    assert time.monotonic() - inicio < 1
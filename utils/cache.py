@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_AUSENTE = object()
+
+
+class CacheTTL:
+    """
+    Cache em memória thread-safe com expiração (TTL) e limite de tamanho (LRU).
+    Valores None não são guardados, para não memorizar falhas de consulta.
+    """
+
+    def __init__(self, ttl: float, tamanho_maximo: int):
+        self.ttl = ttl
+        self.tamanho_maximo = tamanho_maximo
+        self._dados = OrderedDict()  # chave -> (valor, expira_em)
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._expirados = 0
+        self._removidos_lru = 0
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._dados.get(chave, _AUSENTE)
+            if item is _AUSENTE:
+                self._misses += 1
+                return padrao
+
+            valor, expira_em = item
+            if time.monotonic() >= expira_em:
+                del self._dados[chave]
+                self._expirados += 1
+                self._misses += 1
+                return padrao
+
+            self._dados.move_to_end(chave)
+            self._hits += 1
+            return valor
+
+    def set(self, chave, valor):
+        if valor is None:
+            return
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic() + self.ttl)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.tamanho_maximo:
+                self._dados.popitem(last=False)
+                self._removidos_lru += 1
+
+    def invalidar(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "itens": len(self._dados),
+                "tamanho_maximo": self.tamanho_maximo,
+                "ttl_s": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+                "expirados": self._expirados,
+                "removidos_lru": self._removidos_lru
+            }
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+
+class JournalNulo:
+    """Backend padrão antigo: buffers apenas em memória (perdidos num reinício)."""
+
+    def registrar_mensagem(self, remote_jid: str, texto: str, input_data: dict, inicio: float, prazo: float):
+        pass
+
+    def registrar_fim(self, remote_jid: str):
+        pass
+
+    def carregar(self) -> dict:
+        return {}
+
+    def precisa_compactar(self) -> bool:
+        return False
+
+    def compactar(self, buffers_vivos: dict):
+        pass
+
+
+class JournalArquivo:
+    """
+    Journal append-only (JSON por linha) dos buffers de debounce.
+    Cada mensagem gera um registro 'msg' e cada buffer processado um 'fim'.
+    No startup, carregar() reconstrói os buffers que ficaram pendentes.
+    A cada `compactar_a_cada` registros o arquivo é reescrito só com os buffers vivos.
+
+    Horários (inicio/prazo) são epoch (time.time()) para sobreviverem ao reinício.
+    """
+
+    def __init__(self, caminho: str, compactar_a_cada: int = 5000):
+        self.caminho = caminho
+        self.compactar_a_cada = compactar_a_cada
+        self._lock = threading.Lock()
+        self._registros_desde_compactacao = 0
+
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self._arquivo = open(caminho, "a", encoding="utf-8")
+
+    def _escrever(self, registro: dict):
+        linha = json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            # write + flush leva o registro ao SO (sobrevive a queda do processo) sem pagar fsync
+            self._arquivo.write(linha)
+            self._arquivo.flush()
+            self._registros_desde_compactacao += 1
+
+    def precisa_compactar(self) -> bool:
+        return self._registros_desde_compactacao >= self.compactar_a_cada
+
+    def registrar_mensagem(self, remote_jid: str, texto: str, input_data: dict, inicio: float, prazo: float):
+        self._escrever({
+            "op": "msg", "jid": remote_jid, "texto": texto,
+            "data": input_data, "inicio": inicio, "prazo": prazo
+        })
+
+    def registrar_fim(self, remote_jid: str):
+        self._escrever({"op": "fim", "jid": remote_jid})
+
+    def carregar(self) -> dict:
+        """Retorna {jid: {'textos', 'data', 'inicio', 'prazo'}} dos buffers não processados."""
+        pendentes = {}
+        if not os.path.exists(self.caminho):
+            return pendentes
+
+        with open(self.caminho, "r", encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    # Última linha truncada por uma queda no meio da escrita
+                    continue
+
+                jid = registro.get("jid")
+                if registro.get("op") == "fim":
+                    pendentes.pop(jid, None)
+                elif registro.get("op") == "msg":
+                    buffer = pendentes.setdefault(jid, {"textos": [], "inicio": registro["inicio"]})
+                    buffer["textos"].append(registro["texto"])
+                    buffer["data"] = registro["data"]
+                    buffer["prazo"] = registro["prazo"]
+                elif registro.get("op") == "buffer":
+                    pendentes[jid] = {
+                        "textos": registro["textos"], "data": registro["data"],
+                        "inicio": registro["inicio"], "prazo": registro["prazo"]
+                    }
+
+        return pendentes
+
+    def compactar(self, buffers_vivos: dict):
+        """Reescreve o journal apenas com os buffers ainda pendentes (troca atômica do arquivo)."""
+        caminho_tmp = self.caminho + ".tmp"
+        with self._lock:
+            with open(caminho_tmp, "w", encoding="utf-8") as f:
+                for jid, buffer in buffers_vivos.items():
+                    f.write(json.dumps({
+                        "op": "buffer", "jid": jid, "textos": buffer["textos"], "data": buffer["data"],
+                        "inicio": buffer["inicio"], "prazo": buffer["prazo"]
+                    }, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._arquivo.close()
+            os.replace(caminho_tmp, self.caminho)
+            self._arquivo = open(self.caminho, "a", encoding="utf-8")
+            self._registros_desde_compactacao = 0
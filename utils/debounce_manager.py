@@ -1,57 +1,263 @@
+import heapq
+import itertools
+import re
 import threading
+import time
+from collections import OrderedDict
 from typing import Callable
 
+from config import (DEBOUNCE_WORKERS, DEBOUNCE_FILA_MAX,
+                    DEBOUNCE_JANELA_MIN, DEBOUNCE_JANELA_MAX, DEBOUNCE_ESPERA_MAX_TOTAL,
+                    DEBOUNCE_JOURNAL, DEBOUNCE_JOURNAL_PATH, DEBOUNCE_JOURNAL_COMPACTAR)
+from utils.debounce_journal import JournalArquivo, JournalNulo
+from utils.histograma import Histograma
+from utils.worker_pool import PoolTrabalho
+
 
 buffers = {}
 
 
-TEMPO_DE_ESPERA = 10.0
+# Janela usada enquanto ainda não conhecemos o ritmo do usuário (e teto da janela adaptativa)
+TEMPO_DE_ESPERA = DEBOUNCE_JANELA_MAX
+TEMPO_MINIMO_ESPERA = DEBOUNCE_JANELA_MIN
+
+# A janela adaptativa é o intervalo médio entre mensagens do usuário vezes este fator
+FATOR_CADENCIA = 1.5
+
+# Intervalos maiores que isso não contam como "digitando em sequência"
+INTERVALO_MAXIMO_CADENCIA = 60.0
+
+# Respostas curtas que já são uma mensagem completa: o buffer sai com a janela mínima.
+# Vale para o texto acumulado do buffer, então "sim" seguido de "mas só amanhã" espera normalmente.
+RESPOSTAS_COMPLETAS = {
+    "sim", "nao", "não", "sou eu", "sou sim", "sim sou eu", "sim sou",
+    "nao sou", "não sou", "nao sou eu", "não sou eu", "isso", "correto", "exato",
+    "numero errado", "número errado", "engano", "quem fala", "quem e", "quem é",
+}
+
+# Limite total de espera desde a primeira mensagem do buffer,
+# para um usuário que não para de digitar não adiar o processamento para sempre
+TEMPO_MAXIMO_DEBOUNCE = DEBOUNCE_ESPERA_MAX_TOTAL
+
+# Com a fila dos callbacks cheia, o buffer tenta de novo depois deste intervalo
+ESPERA_FILA_CHEIA = 1.0
+
+
+# Uma única thread agenda todos os buffers num min-heap de prazos.
+# Reagendar não remove a entrada antiga do heap: ela é ignorada quando sair
+# (cancelamento preguiçoso), comparando a versão guardada com a do buffer.
+_heap = []
+_sequencia = itertools.count()
+_lock = threading.Condition()
+_thread_agendador = None
+
+# Os callbacks (Agente 2) rodam num pool fixo, fora da thread do agendador
+_pool_callbacks = None
+
+# Intervalo médio (EWMA) entre mensagens de cada JID, limitado aos mais recentes
+_cadencia = OrderedDict()
+TAMANHO_MAXIMO_CADENCIA = 10000
+
+# Tempo entre a última mensagem do usuário e o despacho para o agente
+histograma_latencia = Histograma([0.5, 1, 2, 3, 5, 8, 10, 15, 20, 30])
+
+# Journal em disco: mensagens ainda na janela de espera sobrevivem a um reinício
+if DEBOUNCE_JOURNAL == "arquivo":
+    journal = JournalArquivo(DEBOUNCE_JOURNAL_PATH, DEBOUNCE_JOURNAL_COMPACTAR)
+else:
+    journal = JournalNulo()
+
+
+def _garantir_agendador():
+    global _thread_agendador, _pool_callbacks
+    if _thread_agendador is None:
+        _pool_callbacks = PoolTrabalho("debounce", DEBOUNCE_WORKERS, DEBOUNCE_FILA_MAX)
+        _thread_agendador = threading.Thread(target=_loop_agendador, name="debounce-agendador", daemon=True)
+        _thread_agendador.start()
+
+
+def _loop_agendador():
+    while True:
+        with _lock:
+            while True:
+                if not _heap:
+                    _lock.wait()
+                    continue
+
+                prazo, _, remote_jid, versao = _heap[0]
+                espera = prazo - time.monotonic()
+                if espera > 0:
+                    _lock.wait(espera)
+                    continue
+
+                heapq.heappop(_heap)
+                buffer = buffers.get(remote_jid)
+                if buffer and buffer['versao'] == versao:
+                    break
+
+        # Uma exceção aqui não pode matar a única thread do agendador
+        try:
+            processar_buffer(remote_jid, buffer['callback'])
+        except Exception as e:
+            print(f"[DEBOUNCE] ERRO ao processar o buffer de {remote_jid}: {e}")
+
+
+def _calcular_janela(remote_jid: str, agora: float) -> float:
+    """Atualiza o ritmo do JID e devolve a janela de espera entre MIN e MAX. Chamar com _lock."""
+    cadencia = _cadencia.pop(remote_jid, None)
+    intervalo_medio = None
+
+    if cadencia:
+        intervalo_medio = cadencia['intervalo_medio']
+        intervalo = agora - cadencia['ultima']
+        if intervalo <= INTERVALO_MAXIMO_CADENCIA:
+            intervalo_medio = intervalo if intervalo_medio is None else 0.7 * intervalo_medio + 0.3 * intervalo
+
+    _cadencia[remote_jid] = {'ultima': agora, 'intervalo_medio': intervalo_medio}
+    while len(_cadencia) > TAMANHO_MAXIMO_CADENCIA:
+        _cadencia.popitem(last=False)
+
+    if intervalo_medio is None:
+        return TEMPO_DE_ESPERA
+    return min(TEMPO_DE_ESPERA, max(TEMPO_MINIMO_ESPERA, intervalo_medio * FATOR_CADENCIA))
+
+
+def _mensagem_completa(texto: str) -> bool:
+    normalizado = re.sub(r'[^\w\s]', '', texto.lower()).strip()
+    return " ".join(normalizado.split()) in RESPOSTAS_COMPLETAS
+
+
+def get_metricas_debounce() -> dict:
+    with _lock:
+        ativos = len(buffers)
+    return {
+        "buffers_ativos": ativos,
+        "latencia_resposta": histograma_latencia.metricas()
+    }
 
 
 def processar_buffer(remote_jid: str, callback_funcao: Callable):
     """
-    Chamado quando o timer estoura. Junta os textos e chama o Agente.
+    Chamado quando o prazo estoura. Junta os textos e entrega ao Agente.
+    O buffer só sai da memória e do journal depois que o pool aceita a tarefa;
+    com a fila cheia, ele é reagendado para ESPERA_FILA_CHEIA segundos depois.
     """
-    if remote_jid in buffers:
-        conteudo = buffers[remote_jid]
+    with _lock:
+        conteudo = buffers.get(remote_jid)
+        if not conteudo:
+            return
 
         texto_completo = "\n".join(conteudo['textos'])
-
-        dados_finais = conteudo['data']
+        dados_finais = dict(conteudo['data'])
         dados_finais['mensagem_recebida'] = texto_completo
 
-        print(f"\n[DEBOUNCE] Tempo esgotado para {remote_jid}.")
-        print(f"[DEBOUNCE] Processando texto acumulado: '{texto_completo}'")
+        if not _pool_callbacks.enviar(callback_funcao, dados_finais):
+            print(f"[DEBOUNCE] Fila de processamento cheia. Buffer de {remote_jid} reagendado.")
+            conteudo['versao'] += 1
+            heapq.heappush(_heap, (time.monotonic() + ESPERA_FILA_CHEIA, next(_sequencia),
+                                   remote_jid, conteudo['versao']))
+            _lock.notify()
+            return
+
+        buffers.pop(remote_jid)
+        journal.registrar_fim(remote_jid)
 
-        del buffers[remote_jid]
+    histograma_latencia.registrar(time.monotonic() - conteudo['ultima_mensagem'])
 
-        callback_funcao(dados_finais)
+    print(f"\n[DEBOUNCE] Tempo esgotado para {remote_jid}.")
+    print(f"[DEBOUNCE] Processando texto acumulado: '{texto_completo}'")
 
 
 def adicionar_mensagem_buffer(remote_jid: str, input_data: dict, callback_funcao: Callable):
     """
-    Recebe uma mensagem, cancela o timer anterior e agenda um novo.
+    Recebe uma mensagem e (re)agenda o processamento do buffer do remetente.
     """
     mensagem_nova = input_data['mensagem_recebida']
+    agora = time.monotonic()
+    agora_epoch = time.time()
+
+    with _lock:
+        _garantir_agendador()
+
+        buffer = buffers.get(remote_jid)
+        if buffer:
+            print(f"[DEBOUNCE] Nova mensagem de {remote_jid} recebida antes do tempo. Resetando timer...")
+            buffer['textos'].append(mensagem_nova)
+            buffer['data'] = input_data
+            buffer['callback'] = callback_funcao
+            buffer['versao'] += 1
+        else:
+            buffer = {
+                'textos': [mensagem_nova],
+                'data': input_data,
+                'callback': callback_funcao,
+                'inicio': agora,
+                'inicio_epoch': agora_epoch,
+                'versao': 0
+            }
+            buffers[remote_jid] = buffer
+
+        janela = _calcular_janela(remote_jid, agora)
+        if _mensagem_completa(" ".join(buffer['textos'])):
+            janela = TEMPO_MINIMO_ESPERA
+        print(f"[DEBOUNCE] Janela de {janela:.1f}s para {remote_jid}...")
 
-    if remote_jid in buffers:
-        print(f"[DEBOUNCE] Nova mensagem de {remote_jid} recebida antes do tempo. Resetando timer...")
-        buffers[remote_jid]['timer'].cancel()
-        buffers[remote_jid]['textos'].append(mensagem_nova)
-        buffers[remote_jid]['data'] = input_data
-    else:
-        print(f"[DEBOUNCE] Iniciando timer de {TEMPO_DE_ESPERA}s para {remote_jid}...")
-        buffers[remote_jid] = {
-            'textos': [mensagem_nova],
-            'data': input_data,
-            'timer': None
+        buffer['ultima_mensagem'] = agora
+        prazo = min(agora + janela, buffer['inicio'] + TEMPO_MAXIMO_DEBOUNCE)
+        buffer['prazo_epoch'] = agora_epoch + (prazo - agora)
+        heapq.heappush(_heap, (prazo, next(_sequencia), remote_jid, buffer['versao']))
+
+        journal.registrar_mensagem(remote_jid, mensagem_nova, input_data, buffer['inicio_epoch'], buffer['prazo_epoch'])
+        if journal.precisa_compactar():
+            _compactar_journal()
+
+        _lock.notify()
+
+
+def _compactar_journal():
+    """Reescreve o journal só com os buffers pendentes. Chamar com _lock adquirido."""
+    journal.compactar({
+        jid: {
+            'textos': b['textos'], 'data': b['data'],
+            'inicio': b['inicio_epoch'], 'prazo': b['prazo_epoch']
         }
+        for jid, b in buffers.items()
+    })
+
+
+def restaurar_buffers(callback_funcao: Callable):
+    """
+    Chamado no startup do servidor: recarrega do journal os buffers que estavam
+    esperando quando o processo caiu e os reagenda. Os que já venceram são
+    processados imediatamente, na ordem dos prazos.
+    """
+    pendentes = journal.carregar()
+
+    with _lock:
+        _garantir_agendador()
+        agora = time.monotonic()
+        agora_epoch = time.time()
+
+        for jid, pendente in pendentes.items():
+            if jid in buffers:
+                continue
+            buffers[jid] = {
+                'textos': pendente['textos'],
+                'data': pendente['data'],
+                'callback': callback_funcao,
+                'inicio': agora - (agora_epoch - pendente['inicio']),
+                'ultima_mensagem': agora,
+                'inicio_epoch': pendente['inicio'],
+                'prazo_epoch': pendente['prazo'],
+                'versao': 0
+            }
+            # Sem limitar em zero: os vencidos ficam com prazo no passado e saem
+            # do heap na ordem em que venceram, não na ordem do journal
+            prazo = agora + (pendente['prazo'] - agora_epoch)
+            heapq.heappush(_heap, (prazo, next(_sequencia), jid, 0))
 
-    t = threading.Timer(
-        TEMPO_DE_ESPERA,
-        processar_buffer,
-        args=[remote_jid, callback_funcao]
-    )
-    t.start()
+        _compactar_journal()
+        _lock.notify()
 
-    buffers[remote_jid]['timer'] = t
\ No newline at end of file
+    if pendentes:
+        print(f"[DEBOUNCE] {len(pendentes)} conversas pendentes restauradas do journal.")
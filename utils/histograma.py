@@ -0,0 +1,49 @@
+import bisect
+import threading
+
+
+class Histograma:
+    """Histograma de latências (segundos) com baldes fixos e percentis aproximados."""
+
+    def __init__(self, limites: list):
+        self.limites = sorted(limites)
+        self._contagens = [0] * (len(self.limites) + 1)
+        self._total = 0
+        self._soma = 0.0
+        self._lock = threading.Lock()
+
+    def registrar(self, valor: float):
+        with self._lock:
+            self._contagens[bisect.bisect_left(self.limites, valor)] += 1
+            self._total += 1
+            self._soma += valor
+
+    def percentil(self, p: float):
+        """
+        Limite superior do balde onde cai o percentil p (0-100).
+        Se cair no último balde (acima do maior limite), retorna o texto '>limite'.
+        """
+        with self._lock:
+            if not self._total:
+                return None
+            alvo = self._total * p / 100.0
+            acumulado = 0
+            for i, contagem in enumerate(self._contagens):
+                acumulado += contagem
+                if acumulado >= alvo:
+                    return self.limites[i] if i < len(self.limites) else f">{self.limites[-1]}"
+        return None
+
+    def metricas(self) -> dict:
+        p50 = self.percentil(50)
+        p90 = self.percentil(90)
+        with self._lock:
+            baldes = {f"<={limite}s": self._contagens[i] for i, limite in enumerate(self.limites)}
+            baldes[f">{self.limites[-1]}s"] = self._contagens[-1]
+            return {
+                "total": self._total,
+                "media_s": round(self._soma / self._total, 3) if self._total else None,
+                "p50_s": p50,
+                "p90_s": p90,
+                "baldes": baldes
+            }
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from config import LLM_BACKEND, LLM_CACHE_PATH, LLM_CACHE_MAX
+
+
+def normalizar_nome(nome: str) -> str:
+    """Minúsculas, sem acentos e com espaços colapsados: 'José  da Silva' -> 'jose da silva'."""
+    sem_acento = unicodedata.normalize('NFKD', nome or '').encode('ascii', 'ignore').decode('ascii')
+    return " ".join(sem_acento.lower().split())
+
+
+class CachePersistente:
+    """
+    Cache chave -> valor em SQLite, sobrevive a reinícios do processo.
+    Limitado a `tamanho_maximo` itens; ao estourar, remove os menos usados recentemente.
+    """
+
+    def __init__(self, caminho: str, tamanho_maximo: int):
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._misses = {}
+
+        if caminho != ":memory:":
+            os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_llm (
+            chave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL,
+            usado_em REAL NOT NULL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_llm_usado_em ON cache_llm (usado_em)")
+        self._conn.commit()
+
+    def get(self, namespace: str, chave: str):
+        chave_completa = f"{namespace}:{chave}"
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT valor FROM cache_llm WHERE chave = ?", (chave_completa,)
+            ).fetchone()
+            if not linha:
+                self._misses[namespace] = self._misses.get(namespace, 0) + 1
+                return None
+
+            self._conn.execute(
+                "UPDATE cache_llm SET usado_em = ? WHERE chave = ?", (time.time(), chave_completa)
+            )
+            self._conn.commit()
+            self._hits[namespace] = self._hits.get(namespace, 0) + 1
+            return linha[0]
+
+    def registrar_hit(self, namespace: str):
+        """Conta um acerto resolvido fora do SQLite (ex.: tabela embutida de nomes)."""
+        with self._lock:
+            self._hits[namespace] = self._hits.get(namespace, 0) + 1
+
+    def set(self, namespace: str, chave: str, valor: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_llm (chave, valor, usado_em) VALUES (?, ?, ?)",
+                (f"{namespace}:{chave}", valor, time.time())
+            )
+            total = self._conn.execute("SELECT COUNT(*) FROM cache_llm").fetchone()[0]
+            if total > self.tamanho_maximo:
+                self._conn.execute(
+                    "DELETE FROM cache_llm WHERE chave IN "
+                    "(SELECT chave FROM cache_llm ORDER BY usado_em ASC LIMIT ?)",
+                    (total - self.tamanho_maximo,)
+                )
+            self._conn.commit()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            itens = self._conn.execute("SELECT COUNT(*) FROM cache_llm").fetchone()[0]
+            namespaces = set(self._hits) | set(self._misses)
+            return {
+                "itens": itens,
+                "tamanho_maximo": self.tamanho_maximo,
+                "por_tipo": {
+                    ns: {"hits": self._hits.get(ns, 0), "misses": self._misses.get(ns, 0)}
+                    for ns in sorted(namespaces)
+                }
+            }
+
+
+# No modo fake as respostas não vêm da LLM real, então não podem ir para o cache em disco
+cache_llm = CachePersistente(":memory:" if LLM_BACKEND == "fake" else LLM_CACHE_PATH, LLM_CACHE_MAX)
@@ -1,29 +1,61 @@
 import datetime
 import pytz
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 import base64
 import os
-from services.db_manager import get_template_mensagem_balanceado
+import threading
+from config import PDF_MIDIA_URL
+from services.llm_registry import registrar_chain
+from utils.templates import get_template_mensagem_balanceado
+from utils.llm_cache import cache_llm, normalizar_nome
+from utils.nomes_genero import genero_por_primeiro_nome
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CAMINHO_PDF = os.path.join(BASE_DIR, "RecebendoPrecatorioLogo.pdf")
 
+# Base64 do PDF calculado uma vez e reaproveitado; recalculado só se o arquivo mudar (mtime)
+_pdf_cache = {"mtime": None, "base64": None}
+_pdf_lock = threading.Lock()
+
+
 def get_pdf_em_base64():
-    """Lê o arquivo PDF local e retorna a string Base64 limpa."""
-    if not os.path.exists(CAMINHO_PDF):
+    """Retorna a string Base64 do PDF local, lendo o arquivo apenas quando ele muda."""
+    try:
+        mtime = os.stat(CAMINHO_PDF).st_mtime_ns
+    except FileNotFoundError:
         print(f"[MESSAGE MANAGER] Erro Crítico: Arquivo não encontrado em {CAMINHO_PDF}")
         return None
 
-    try:
-        with open(CAMINHO_PDF, "rb") as pdf_file:
-            encoded_bytes = base64.b64encode(pdf_file.read())
-            encoded_string = encoded_bytes.decode('utf-8').replace('\n', '').replace('\r', '')
+    if _pdf_cache["mtime"] == mtime:
+        return _pdf_cache["base64"]
+
+    with _pdf_lock:
+        if _pdf_cache["mtime"] == mtime:
+            return _pdf_cache["base64"]
+
+        try:
+            with open(CAMINHO_PDF, "rb") as pdf_file:
+                # b64encode não gera quebras de linha, então a string já sai limpa
+                encoded_string = base64.b64encode(pdf_file.read()).decode('ascii')
+            _pdf_cache["base64"] = encoded_string
+            _pdf_cache["mtime"] = mtime
+            print("[MESSAGE MANAGER] PDF carregado e convertido para Base64.")
             return encoded_string
-    except Exception as e:
-        print(f"[MESSAGE MANAGER] Erro ao converter PDF: {e}")
-        return None
+        except Exception as e:
+            print(f"[MESSAGE MANAGER] Erro ao converter PDF: {e}")
+            return None
+
+
+def get_pdf_para_envio():
+    """
+    Retorna o conteúdo do campo 'media' do envio do PDF.
+    Se PDF_MIDIA_URL estiver configurada, a Evolution baixa o arquivo pela URL
+    e o payload leva só a referência; senão, envia o Base64 em cache.
+    """
+    if PDF_MIDIA_URL:
+        return PDF_MIDIA_URL
+    return get_pdf_em_base64()
 
 
 def get_saudacao():
@@ -38,16 +70,42 @@ def get_saudacao():
         return "Boa noite"
 
 
+genero_chain = registrar_chain(
+    "genero",
+    lambda llm: ChatPromptTemplate.from_template(
+        "Responda apenas com 'M' para masculino ou 'F' para feminino. Nome: {nome}"
+    ) | llm | StrOutputParser(),
+    fake=lambda entrada: "M",
+    timeout=10
+)
+
+
 def detectar_genero(nome: str) -> str:
-    """Usa LLM barata para identificar se o nome é M ou F."""
-    try:
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-        chain = ChatPromptTemplate.from_template(
-            "Responda apenas com 'M' para masculino ou 'F' para feminino. Nome: {nome}"
-        ) | llm | StrOutputParser()
+    """
+    Identifica se o nome é M ou F. Consulta primeiro a tabela de nomes comuns,
+    depois o cache persistente e só então a LLM.
+    """
+    partes = normalizar_nome(nome).split()
+    if not partes:
+        return 'M'
+    primeiro_nome = partes[0]
 
-        genero = chain.invoke({"nome": nome}).strip().upper()
-        return genero if genero in ['M', 'F'] else 'M'
+    genero = genero_por_primeiro_nome(primeiro_nome)
+    if genero:
+        cache_llm.registrar_hit("genero")
+        return genero
+
+    genero = cache_llm.get("genero", primeiro_nome)
+    if genero:
+        return genero
+
+    try:
+        # A LLM recebe só o primeiro nome: é ele a chave do cache
+        genero = genero_chain.invoke({"nome": primeiro_nome}).strip().upper()
+        if genero in ['M', 'F']:
+            cache_llm.set("genero", primeiro_nome, genero)
+            return genero
+        return 'M'
     except:
         return 'M'
 
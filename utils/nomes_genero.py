@@ -0,0 +1,49 @@
+# Primeiros nomes mais comuns no Brasil (normalizados: minúsculas, sem acento) -> gênero.
+# Nomes ambíguos (ex.: 'darci', 'juraci') ficam de fora e seguem para a LLM.
+
+NOMES_MASCULINOS = {
+    "jose", "joao", "antonio", "francisco", "carlos", "paulo", "pedro", "lucas", "luiz", "marcos",
+    "luis", "gabriel", "rafael", "daniel", "marcelo", "bruno", "eduardo", "felipe", "raimundo", "rodrigo",
+    "manoel", "manuel", "mateus", "matheus", "andre", "fernando", "fabio", "leonardo", "gustavo", "guilherme",
+    "leandro", "tiago", "thiago", "anderson", "ricardo", "marcio", "jorge", "sebastiao", "alexandre", "roberto",
+    "edson", "diego", "vitor", "victor", "sergio", "claudio", "vinicius", "joaquim", "renato", "julio",
+    "geraldo", "adriano", "severino", "luciano", "miguel", "wellington", "cicero", "davi", "david", "samuel",
+    "alex", "arthur", "artur", "benedito", "heitor", "henrique", "igor", "jefferson", "jonas", "jean",
+    "juliano", "leonel", "mauricio", "mauro", "nelson", "otavio", "osvaldo", "oswaldo", "reginaldo", "ronaldo",
+    "rogerio", "rubens", "valdir", "wagner", "washington", "wesley", "william", "willian", "caio", "cesar",
+    "benjamin", "bernardo", "enzo", "gilberto", "gilson", "helio", "hugo", "ivan", "jair", "jonathan",
+    "josue", "lauro", "mario", "milton", "moises", "nilton", "orlando", "raul", "reinaldo", "rui",
+    "silvio", "valter", "walter", "wilson", "ademir", "agostinho", "alberto", "aldo", "alfredo", "almir",
+    "amaro", "anselmo", "armando", "augusto", "aurelio", "benicio", "celso", "cristiano", "denis", "dorival",
+    "edmilson", "edivaldo", "elias", "emerson", "everton", "fabricio", "flavio", "gerson", "hamilton",
+    "isaias", "israel", "jeferson", "joel", "juvenal", "lourival", "marcelino", "nivaldo", "olavo", "pablo",
+    "paulino", "romario", "sandro", "saulo", "sidnei", "tomas", "ulisses", "vagner", "valdemar",
+}
+
+NOMES_FEMININOS = {
+    "maria", "ana", "francisca", "antonia", "adriana", "juliana", "marcia", "fernanda", "patricia", "aline",
+    "sandra", "camila", "amanda", "bruna", "jessica", "leticia", "julia", "luciana", "vanessa", "mariana",
+    "gabriela", "vera", "vitoria", "larissa", "claudia", "beatriz", "luana", "rita", "sonia", "renata",
+    "eliane", "josefa", "simone", "natalia", "cristiane", "carla", "debora", "rosangela", "jaqueline", "rosa",
+    "daniela", "aparecida", "marlene", "terezinha", "raimunda", "andreia", "fabiana", "lucia", "raquel", "angela",
+    "rafaela", "joana", "luzia", "elaine", "daiane", "regina", "tereza", "teresa", "alice", "sofia",
+    "sophia", "helena", "laura", "isabela", "isabel", "manuela", "valentina", "livia", "lorena", "giovana",
+    "carolina", "clara", "eduarda", "heloisa", "cecilia", "luiza", "luisa", "yasmin", "agatha", "alessandra",
+    "alexandra", "silvia", "priscila", "tatiana", "viviane", "kelly", "michele", "monica", "paula", "roberta",
+    "sabrina", "samara", "sara", "sarah", "tania", "thais", "valeria", "vania", "veronica", "bianca",
+    "celia", "cintia", "dalva", "denise", "edna", "elisa", "elizabete", "fatima", "gloria", "graca",
+    "ines", "ivone", "joice", "jussara", "karina", "katia", "lais", "lidia", "lilian", "marta",
+    "marina", "milena", "miriam", "nadia", "neide", "nilza", "olga", "pamela", "rebeca", "rosana",
+    "rose", "selma", "shirley", "solange", "suely", "sueli", "tatiane", "vilma", "zilda", "zuleide",
+    "benedita", "conceicao", "cleide", "creusa", "dulce", "edilene", "eliana", "ester", "estela", "geni",
+    "irene", "iracema", "jandira", "lourdes", "madalena", "margarida", "neusa", "noemia", "odete", "sebastiana",
+}
+
+
+def genero_por_primeiro_nome(primeiro_nome_normalizado: str):
+    """Retorna 'M', 'F' ou None (nome fora da tabela)."""
+    if primeiro_nome_normalizado in NOMES_MASCULINOS:
+        return 'M'
+    if primeiro_nome_normalizado in NOMES_FEMININOS:
+        return 'F'
+    return None
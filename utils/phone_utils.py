@@ -9,4 +9,17 @@ def limpar_numero_telefone(telefone_raw: str) -> str:
     if not apenas_digitos:
         return ""
 
-    return f"+{apenas_digitos}"
\ No newline at end of file
+    return f"+{apenas_digitos}"
+
+def normalizar_numero_telefone(telefone_raw: str) -> str:
+    """
+    Chave de busca do número: apenas dígitos, sem '+'.
+    Celulares brasileiros antigos (55 + DDD + 8 dígitos) ganham o 9º dígito,
+    para que '+553299998888' e '+5532999998888' gerem a mesma chave.
+    """
+    apenas_digitos = re.sub(r'\D', '', str(telefone_raw or ''))
+
+    if apenas_digitos.startswith('55') and len(apenas_digitos) == 12:
+        apenas_digitos = f"{apenas_digitos[0:4]}9{apenas_digitos[4:]}"
+
+    return apenas_digitos
@@ -0,0 +1,116 @@
+import random
+import threading
+
+from config import ENVIO_TAXA_POR_HORA, ENVIO_RAJADA, ENVIO_LIMITE_DIARIO, ENVIO_JITTER
+from services.db_manager import reservar_envio_instancia, devolver_envio_instancia
+
+
+class LimitadorEnvios:
+    """
+    Limite de envios por instância de saída da Evolution (token bucket).
+    O estado fica no banco (tabela limites_envio), então scheduler e webhook
+    dividem o mesmo orçamento de cada instância. Instâncias diferentes não
+    esperam uma pela outra.
+    A espera pelo token é interrompida por interromper() (encerramento do processo);
+    nesse caso, e quando a espera passa de `espera_max`, o token é devolvido.
+    Quem consumiu o token e não conseguiu enviar chama devolver().
+    """
+
+    def __init__(self, envios_por_hora: float, rajada: int, limite_diario: int, jitter: float):
+        self.envios_por_hora = envios_por_hora
+        self.rajada = rajada
+        self.limite_diario = limite_diario
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._parada = threading.Event()
+        self._liberados = 0
+        self._esperas = 0
+        self._espera_total = 0.0
+        self._recusados_limite_diario = 0
+        self._adiados = 0
+        self._interrompidos = 0
+        self._devolvidos = 0
+        self._erros = 0
+
+    def _reservar(self, instance_id: str, prioritario: bool):
+        """Retorna os segundos a esperar antes do envio, ou None se o envio não deve sair."""
+        reserva = reservar_envio_instancia(
+            instance_id, self.envios_por_hora, self.rajada, self.limite_diario, prioritario
+        )
+
+        with self._lock:
+            if reserva is None:
+                self._erros += 1
+                # Sem o banco não há como saber o saldo: respostas seguem, prospecção espera o próximo ciclo
+                return 0.0 if prioritario else None
+
+            if reserva['limite_atingido']:
+                self._recusados_limite_diario += 1
+                print(f"[RATE LIMIT] Instância {instance_id} atingiu o limite diário de envios.")
+                return None
+
+            espera = reserva['espera']
+            if espera > 0:
+                espera += random.uniform(0, self.jitter)
+                self._esperas += 1
+                self._espera_total += espera
+            self._liberados += 1
+            return espera
+
+    def consumir(self, instance_id: str, prioritario: bool = False, espera_max: float = None) -> bool:
+        """
+        Bloqueia até a instância poder enviar. Retorna False se o envio não deve sair:
+        limite diário, espera maior que `espera_max` ou processo encerrando.
+        """
+        if self._parada.is_set() and not prioritario:
+            return False
+
+        espera = self._reservar(instance_id, prioritario)
+        if espera is None:
+            return False
+
+        if espera_max is not None and espera > espera_max:
+            print(f"[RATE LIMIT] Instância {instance_id}: espera de {int(espera)}s passa do máximo "
+                  f"({int(espera_max)}s). Envio fica para o scheduler.")
+            devolver_envio_instancia(instance_id)
+            with self._lock:
+                self._adiados += 1
+            return False
+
+        if espera > 0:
+            print(f"[RATE LIMIT] Instância {instance_id}: aguardando {int(espera)}s para enviar.")
+            if self._parada.wait(espera):
+                print(f"[RATE LIMIT] Instância {instance_id}: espera interrompida pelo encerramento.")
+                devolver_envio_instancia(instance_id)
+                with self._lock:
+                    self._interrompidos += 1
+                return False
+        return True
+
+    def devolver(self, instance_id: str):
+        """Devolve o token de um envio que falhou (erro ou resposta não-2xx da Evolution)."""
+        devolver_envio_instancia(instance_id)
+        with self._lock:
+            self._devolvidos += 1
+
+    def interromper(self):
+        """Acorda quem está esperando token (o envio não sai) e recusa novas esperas."""
+        self._parada.set()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "envios_por_hora": self.envios_por_hora,
+                "limite_diario": self.limite_diario,
+                "liberados": self._liberados,
+                "esperas": self._esperas,
+                "espera_media_s": round(self._espera_total / self._esperas, 1) if self._esperas else None,
+                "recusados_limite_diario": self._recusados_limite_diario,
+                "adiados": self._adiados,
+                "interrompidos": self._interrompidos,
+                "devolvidos": self._devolvidos,
+                "erros": self._erros
+            }
+
+
+limitador_envios = LimitadorEnvios(ENVIO_TAXA_POR_HORA, ENVIO_RAJADA, ENVIO_LIMITE_DIARIO, ENVIO_JITTER)
@@ -0,0 +1,112 @@
+import atexit
+import threading
+import time
+
+from config import TEMPLATES_RECARGA, TEMPLATES_FLUSH
+from services.db_manager import buscar_templates_ativos, incrementar_uso_templates
+
+
+class RodizioTemplates:
+    """
+    Templates ativos em memória, com rodízio pelo menos usado feito no próprio processo.
+    - A escolha e o incremento acontecem sob o mesmo lock (threads concorrentes não
+      pegam o mesmo template "menos usado" ao mesmo tempo).
+    - Os usos vão sendo acumulados e gravados no banco em lote a cada `intervalo_flush`.
+    - A lista é recarregada a cada `intervalo_recarga`, trazendo templates novos e
+      os usos gravados por outros processos.
+    """
+
+    def __init__(self, intervalo_recarga: float, intervalo_flush: float):
+        self.intervalo_recarga = intervalo_recarga
+        self.intervalo_flush = intervalo_flush
+        self._lock = threading.Lock()
+        self._lock_recarga = threading.Lock()
+        self._por_tipo = {}   # tipo -> [{'id', 'texto', 'uso'}]
+        self._pendentes = {}  # template_id -> usos ainda não gravados
+        self._carregado_em = None
+        self._thread_flush = None
+
+    def _recarregar(self):
+        templates = buscar_templates_ativos()
+        if templates is None:
+            return
+
+        with self._lock:
+            por_tipo = {}
+            for t in templates:
+                por_tipo.setdefault(t['tipo'], []).append({
+                    'id': t['id'],
+                    'texto': t['texto'],
+                    # O banco ainda não tem os usos acumulados aqui desde o último flush
+                    'uso': (t['contagem_uso'] or 0) + self._pendentes.get(t['id'], 0)
+                })
+            self._por_tipo = por_tipo
+            self._carregado_em = time.monotonic()
+
+    def _garantir_carregado(self):
+        if self._carregado_em is not None and time.monotonic() - self._carregado_em < self.intervalo_recarga:
+            return
+        # Só uma thread recarrega; as outras seguem com a lista atual (se houver)
+        if self._lock_recarga.acquire(blocking=self._carregado_em is None):
+            try:
+                if self._carregado_em is None or time.monotonic() - self._carregado_em >= self.intervalo_recarga:
+                    self._recarregar()
+            finally:
+                self._lock_recarga.release()
+
+        if self._thread_flush is None:
+            with self._lock:
+                if self._thread_flush is None:
+                    self._thread_flush = threading.Thread(target=self._loop_flush, name="templates-flush", daemon=True)
+                    self._thread_flush.start()
+
+    def escolher(self, tipo: str):
+        """Retorna o texto do template menos usado do tipo (ou None se não houver)."""
+        self._garantir_carregado()
+
+        with self._lock:
+            candidatos = self._por_tipo.get(tipo)
+            if not candidatos:
+                print(f"[TEMPLATES] AVISO: Nenhum template encontrado para o tipo '{tipo}'")
+                return None
+
+            escolhido = min(candidatos, key=lambda t: (t['uso'], t['id']))
+            escolhido['uso'] += 1
+            self._pendentes[escolhido['id']] = self._pendentes.get(escolhido['id'], 0) + 1
+            return escolhido['texto']
+
+    def flush(self):
+        """Grava no banco os usos acumulados. Se falhar, eles voltam para a próxima tentativa."""
+        with self._lock:
+            incrementos, self._pendentes = self._pendentes, {}
+
+        if incrementos and not incrementar_uso_templates(incrementos):
+            with self._lock:
+                for template_id, quantidade in incrementos.items():
+                    self._pendentes[template_id] = self._pendentes.get(template_id, 0) + quantidade
+
+    def _loop_flush(self):
+        while True:
+            time.sleep(self.intervalo_flush)
+            self.flush()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "tipos": {tipo: len(lista) for tipo, lista in self._por_tipo.items()},
+                "usos_pendentes": sum(self._pendentes.values())
+            }
+
+
+rodizio_templates = RodizioTemplates(TEMPLATES_RECARGA, TEMPLATES_FLUSH)
+
+# Grava os usos que ainda estão só em memória quando o processo termina
+atexit.register(rodizio_templates.flush)
+
+
+def get_template_mensagem_balanceado(tipo: str):
+    """
+    Busca um template de mensagem ativo para o tipo especificado,
+    usando lógica de load balance (menor uso primeiro).
+    """
+    return rodizio_templates.escolher(tipo)
@@ -1,10 +1,45 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from services.llm_registry import registrar_chain
+from utils.llm_cache import cache_llm, normalizar_nome
+
+
+system_prompt_match_nome = (
+    "Você é um especialista em nomes e apelidos culturais do Brasil. "
+    "Sua tarefa é comparar o 'Nome no CRM' com o 'Nome no Perfil do WhatsApp' "
+    "e dizer se é PROVÁVEL que sejam a mesma pessoa.\n\n"
+    "Regras de Match (Verdadeiro):\n"
+    "- Apelidos comuns (ex: Eduardo/Dudu, Francisca/Chica, Antonio/Tony).\n"
+    "- Abreviações (ex: Gustavo Silva/Gustavo, Ana Maria/Ana).\n"
+    "- Sobrenomes (ex: Roberto Carlos/Carlos).\n\n"
+    "Regras de Não Match (Falso):\n"
+    "- Nomes totalmente diferentes (ex: João/Maria).\n"
+    "- Nomes de empresas genéricos no WhatsApp (ex: 'Loja de Peças' vs 'João').\n\n"
+    "Responda APENAS com 'TRUE' ou 'FALSE'. Sem explicações."
+)
+
+human_prompt_match_nome = (
+    "Nome no CRM: {nome_lead}\n"
+    "Nome no WhatsApp: {nome_whatsapp}\n\n"
+    "É a mesma pessoa?"
+)
+
+match_nome_prompt = ChatPromptTemplate.from_messages([
+    ("system", system_prompt_match_nome),
+    ("human", human_prompt_match_nome)
+])
+
+match_nome_chain = registrar_chain(
+    "match_nome",
+    lambda llm: match_nome_prompt | llm | StrOutputParser(),
+    fake=lambda entrada: "FALSE",
+    timeout=15
+)
+
 
 def verificar_match_nome_llm(nome_lead: str, nome_whatsapp: str) -> bool:
     """
@@ -16,42 +51,21 @@ def verificar_match_nome_llm(nome_lead: str, nome_whatsapp: str) -> bool:
         return False
 
     # Se for idêntico, nem gasta token
-    if nome_lead.strip().lower() == nome_whatsapp.strip().lower():
+    lead_normalizado = normalizar_nome(nome_lead)
+    whatsapp_normalizado = normalizar_nome(nome_whatsapp)
+    if lead_normalizado == whatsapp_normalizado:
         return True
 
-    print(f"[TEXT UTILS] Validando match de nome via LLM: '{nome_lead}' vs '{nome_whatsapp}'")
+    chave_cache = f"{lead_normalizado}|{whatsapp_normalizado}"
+    veredito_cache = cache_llm.get("match_nome", chave_cache)
+    if veredito_cache:
+        print(f"[TEXT UTILS] Veredito em cache: {veredito_cache}")
+        return veredito_cache == "TRUE"
 
-    system_prompt = (
-        "Você é um especialista em nomes e apelidos culturais do Brasil. "
-        "Sua tarefa é comparar o 'Nome no CRM' com o 'Nome no Perfil do WhatsApp' "
-        "e dizer se é PROVÁVEL que sejam a mesma pessoa.\n\n"
-        "Regras de Match (Verdadeiro):\n"
-        "- Apelidos comuns (ex: Eduardo/Dudu, Francisca/Chica, Antonio/Tony).\n"
-        "- Abreviações (ex: Gustavo Silva/Gustavo, Ana Maria/Ana).\n"
-        "- Sobrenomes (ex: Roberto Carlos/Carlos).\n\n"
-        "Regras de Não Match (Falso):\n"
-        "- Nomes totalmente diferentes (ex: João/Maria).\n"
-        "- Nomes de empresas genéricos no WhatsApp (ex: 'Loja de Peças' vs 'João').\n\n"
-        "Responda APENAS com 'TRUE' ou 'FALSE'. Sem explicações."
-    )
-
-    human_prompt = (
-        "Nome no CRM: {nome_lead}\n"
-        "Nome no WhatsApp: {nome_whatsapp}\n\n"
-        "É a mesma pessoa?"
-    )
+    print(f"[TEXT UTILS] Validando match de nome via LLM: '{nome_lead}' vs '{nome_whatsapp}'")
 
     try:
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.0)
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("human", human_prompt)
-        ])
-
-        chain = prompt | llm | StrOutputParser()
-
-        resultado = chain.invoke({
+        resultado = match_nome_chain.invoke({
             "nome_lead": nome_lead,
             "nome_whatsapp": nome_whatsapp
         })
@@ -59,7 +73,9 @@ def verificar_match_nome_llm(nome_lead: str, nome_whatsapp: str) -> bool:
         resultado_limpo = resultado.strip().upper()
         print(f"[TEXT UTILS] Veredito da LLM: {resultado_limpo}")
 
-        return "TRUE" in resultado_limpo
+        eh_match = "TRUE" in resultado_limpo
+        cache_llm.set("match_nome", chave_cache, "TRUE" if eh_match else "FALSE")
+        return eh_match
 
     except Exception as e:
         print(f"[TEXT UTILS] Erro na validação LLM: {e}")
@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+from typing import Callable
+
+
+POLITICA_REJEITAR = "rejeitar"
+POLITICA_DESCARTAR_ANTIGO = "descartar_antigo"
+
+
+class PoolTrabalho:
+    """
+    Pool de threads fixo com fila limitada.
+    Quando a fila enche, aplica a política configurada:
+    - 'rejeitar': recusa a tarefa nova (o webhook responde 503 e o remetente reenvia).
+    - 'descartar_antigo': descarta a tarefa mais antiga da fila e aceita a nova.
+    """
+
+    def __init__(self, nome: str, num_workers: int, tamanho_fila: int, politica: str = POLITICA_REJEITAR):
+        self.nome = nome
+        self.politica = politica
+        self._fila = queue.Queue(maxsize=tamanho_fila)
+        self._lock = threading.Lock()
+        self._workers = []
+
+        self._recebidas = 0
+        self._rejeitadas = 0
+        self._descartadas = 0
+        self._concluidas = 0
+        self._erros = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._execucao_total = 0.0
+        self._execucao_max = 0.0
+
+        for i in range(num_workers):
+            t = threading.Thread(target=self._loop_worker, name=f"{nome}-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def enviar(self, funcao: Callable, *args) -> bool:
+        """Enfileira a tarefa. Retorna False se ela foi recusada pela política."""
+        tarefa = (funcao, args, time.monotonic())
+
+        with self._lock:
+            self._recebidas += 1
+
+        try:
+            self._fila.put_nowait(tarefa)
+            return True
+        except queue.Full:
+            pass
+
+        if self.politica == POLITICA_DESCARTAR_ANTIGO:
+            try:
+                self._fila.get_nowait()
+                self._fila.task_done()
+                with self._lock:
+                    self._descartadas += 1
+            except queue.Empty:
+                pass
+            try:
+                self._fila.put_nowait(tarefa)
+                return True
+            except queue.Full:
+                pass
+
+        with self._lock:
+            self._rejeitadas += 1
+        print(f"[WORKER POOL] Fila '{self.nome}' cheia. Tarefa recusada.")
+        return False
+
+    def _loop_worker(self):
+        while True:
+            tarefa = self._fila.get()
+            if tarefa is None:
+                self._fila.task_done()
+                return
+
+            funcao, args, enfileirada_em = tarefa
+            inicio = time.monotonic()
+            espera = inicio - enfileirada_em
+            sucesso = True
+
+            try:
+                funcao(*args)
+            except Exception as e:
+                sucesso = False
+                print(f"[WORKER POOL] Erro na tarefa da fila '{self.nome}': {e}")
+            finally:
+                execucao = time.monotonic() - inicio
+                with self._lock:
+                    self._concluidas += 1
+                    if not sucesso:
+                        self._erros += 1
+                    self._espera_total += espera
+                    self._espera_max = max(self._espera_max, espera)
+                    self._execucao_total += execucao
+                    self._execucao_max = max(self._execucao_max, execucao)
+                self._fila.task_done()
+
+    def encerrar(self, timeout: float = None):
+        """
+        Processa o que já está na fila e para os workers.
+        `timeout` é o prazo total do encerramento, não o de cada worker.
+        """
+        for _ in self._workers:
+            self._fila.put(None)
+        prazo = None if timeout is None else time.monotonic() + timeout
+        for t in self._workers:
+            t.join(None if prazo is None else max(0.0, prazo - time.monotonic()))
+
+    def metricas(self) -> dict:
+        with self._lock:
+            concluidas = self._concluidas or 1
+            return {
+                "workers": len(self._workers),
+                "politica": self.politica,
+                "fila_atual": self._fila.qsize(),
+                "fila_maxima": self._fila.maxsize,
+                "recebidas": self._recebidas,
+                "rejeitadas": self._rejeitadas,
+                "descartadas": self._descartadas,
+                "concluidas": self._concluidas,
+                "erros": self._erros,
+                "espera_media_s": round(self._espera_total / concluidas, 4),
+                "espera_max_s": round(self._espera_max, 4),
+                "execucao_media_s": round(self._execucao_total / concluidas, 4),
+                "execucao_max_s": round(self._execucao_max, 4)
+            }
@@ -1,13 +1,22 @@
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, request, Response
+from flask import Flask, request, Response, jsonify
 import logging
-import threading
 import os
 
 import json
-from app_handler import processar_resposta_evolution, processar_disparo_kommo
-from services.db_manager import resetar_banco_para_testes
+import config
+from app_handler import processar_resposta_evolution, processar_disparo_kommo, invalidar_cache_webhook_kommo
+from agents.agente_responder_langgraph import iniciar_agente_resposta as run_agente_responder
+from services.db_manager import resetar_banco_para_testes, get_metricas_pool, get_metricas_cache_leads
+from utils.debounce_manager import restaurar_buffers, get_metricas_debounce
+from utils.llm_cache import cache_llm
+from utils.rate_limiter import limitador_envios
+from services.coordenacao import get_metricas_leases
+from utils.templates import rodizio_templates
+from services.fila_escrita import fila_escrita
+from services.api_clients import get_metricas_cache_kommo
+from utils.worker_pool import PoolTrabalho
 
 DB_HOST = os.getenv("DB_HOST")
 
@@ -15,6 +24,14 @@ log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 app = Flask(__name__)
 
+# Pools separados: um burst de mensagens da Evolution não atrasa os disparos do Kommo
+pool_kommo = PoolTrabalho(
+    "kommo", config.KOMMO_WORKERS, config.KOMMO_FILA_MAX, config.KOMMO_FILA_POLITICA
+)
+pool_evolution = PoolTrabalho(
+    "evolution", config.EVOLUTION_WORKERS, config.EVOLUTION_FILA_MAX, config.EVOLUTION_FILA_POLITICA
+)
+
 
 @app.route("/webhook/kommo", methods=["POST"])
 def receive_kommo_webhook():
@@ -22,6 +39,8 @@ def receive_kommo_webhook():
         data = request.form
 
         print("\n--------------- WEBHOOK KOMMO ---------------")
+        # O lead mudou no Kommo: a próxima consulta busca o payload novo
+        invalidar_cache_webhook_kommo(data)
         id_lead = None
 
 
@@ -45,8 +64,8 @@ def receive_kommo_webhook():
                 "origem": "webhook_kommo"
             }
 
-            thread = threading.Thread(target=processar_disparo_kommo, args=(params,))
-            thread.start()
+            if not pool_kommo.enviar(processar_disparo_kommo, params):
+                return Response(status=503)
 
             return Response(status=200)
         else:
@@ -66,8 +85,8 @@ def receive_evolution_webhook():
         print("\n--- WEBHOOK RECEBIDO ---")
 
         if data.get("event") == "messages.upsert":
-            thread = threading.Thread(target=processar_resposta_evolution, args=(data,))
-            thread.start()
+            if not pool_evolution.enviar(processar_resposta_evolution, data):
+                return Response(status=503)
 
         return Response(status=200)
     except Exception as e:
@@ -96,9 +115,27 @@ def receive_reset_webhook():
         return Response(status=500)
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Profundidade das filas, latências dos workers e estado do pool do banco."""
+    return jsonify({
+        "kommo": pool_kommo.metricas(),
+        "evolution": pool_evolution.metricas(),
+        "db_pool": get_metricas_pool(),
+        "cache_leads": get_metricas_cache_leads(),
+        "cache_llm": cache_llm.metricas(),
+        "debounce": get_metricas_debounce(),
+        "limite_envios": limitador_envios.metricas(),
+        "leases": get_metricas_leases(),
+        "templates": rodizio_templates.metricas(),
+        "fila_escrita": fila_escrita.metricas(),
+        "cache_kommo": get_metricas_cache_kommo()
+    })
+
 
 if __name__ == "__main__":
     if not DB_HOST:
         print("ERRO: Credenciais do banco de dados")
     else:
+        restaurar_buffers(run_agente_responder)
         app.run(host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,235 @@
+from dotenv import load_dotenv
+load_dotenv()
+import asyncio
+import contextlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response, JSONResponse
+from starlette.routing import Route
+
+import config
+from app_handler import processar_disparo_kommo, extrair_remote_jid, extrair_conteudo_mensagem, invalidar_cache_webhook_kommo
+from agents.agente_responder_async import iniciar_agente_resposta as run_agente_responder_async
+from services import db_manager_async
+from services.db_manager import resetar_banco_para_testes, get_metricas_cache_leads
+from utils.debounce_manager import adicionar_mensagem_buffer, restaurar_buffers, get_metricas_debounce
+from utils.llm_cache import cache_llm
+from utils.rate_limiter import limitador_envios
+from services.coordenacao import get_metricas_leases
+from utils.templates import rodizio_templates
+from services.fila_escrita import fila_escrita
+from services.api_clients import get_metricas_cache_kommo
+from utils.worker_pool import PoolTrabalho
+
+# Modo assíncrono (ASGI) do webhook_server.py. Mesmas rotas. O que é assíncrono de fato:
+# a leitura do contexto (aiomysql) e a chamada da LLM do Agente 2 (app.ainvoke). O debounce
+# segue na thread do agendador e devolve o buffer ao loop. Continuam síncronos, numa
+# thread do executor do loop (ASGI_THREADS):
+# os nós de ferramenta do grafo (envio na Evolution e Kommo com requests, escritas com
+# pymysql) e o resumo do histórico. A gravação da mensagem recebida vai para a fila_escrita.
+# O disparo do Kommo (Agente 1) continua no pool síncrono.
+# Rodar com: python webhook_server_asgi.py  (o webhook_server.py segue como fallback)
+# Carga com banco e LLM simulados: python -m services.verificacao_carga_asgi
+
+DB_HOST = os.getenv("DB_HOST")
+
+pool_kommo = PoolTrabalho(
+    "kommo", config.KOMMO_WORKERS, config.KOMMO_FILA_MAX, config.KOMMO_FILA_POLITICA
+)
+
+_loop = None
+_tarefas_evolution = set()
+
+
+def _agendar_agente(dados_finais: dict):
+    """Callback do debounce (roda na thread do timer): agenda o agente no event loop."""
+    asyncio.run_coroutine_threadsafe(run_agente_responder_async(dados_finais), _loop)
+
+
+async def processar_resposta_evolution(data: dict):
+    """Versão assíncrona de app_handler.processar_resposta_evolution."""
+    try:
+        instancia_recebida = data.get("instance")
+        mensagem_data = data.get('data', {})
+        push_name = mensagem_data.get('pushName', '')
+
+        remote_jid = extrair_remote_jid(data)
+        if not remote_jid:
+            return
+
+        numero_remetente_limpo = remote_jid.split('@')[0].lstrip('+')
+
+        contexto = await db_manager_async.buscar_contexto_conversa(numero_remetente_limpo)
+        if not contexto:
+            print(f"[ASGI] Ignorando msg. Lead não encontrado.")
+            return
+
+        status_atual = contexto.get('status_atual')
+        if status_atual not in ['aguardando resposta', 'sem envio', 'em tratativa']:
+            print(f"[ASGI] Bloqueio Ativo ({status_atual}). Ignorando.")
+            return
+
+        mensagem_recebida = extrair_conteudo_mensagem(mensagem_data.get('message', {}))
+        if not mensagem_recebida:
+            print("[ASGI] Mensagem vazia ou tipo não suportado. Ignorando.")
+            return
+
+        await db_manager_async.salvar_mensagem_usuario(contexto['numero_id'], mensagem_recebida)
+
+        input_data = {
+            "lead_id": contexto['lead_id'],
+            "numero_id": contexto['numero_id'],
+            "historico_chat": contexto['historico_chat'],
+            "historico_truncado": contexto['historico_truncado'],
+            "resumo_historico": contexto['resumo_historico'],
+            "numero_remetente": numero_remetente_limpo,
+            "mensagem_recebida": mensagem_recebida,
+            "instance_id": instancia_recebida,
+            "nome_perfil_whatsapp": push_name
+        }
+
+        adicionar_mensagem_buffer(
+            remote_jid=remote_jid,
+            input_data=input_data,
+            callback_funcao=_agendar_agente
+        )
+
+    except Exception as e:
+        print(f"[ASGI] ❌ Erro ao processar resposta: {e}")
+
+
+async def receive_kommo_webhook(request):
+    try:
+        data = await request.form()
+
+        print("\n--------------- WEBHOOK KOMMO (ASGI) ---------------")
+        # O lead mudou no Kommo: a próxima consulta busca o payload novo
+        invalidar_cache_webhook_kommo(data)
+        id_lead = None
+
+        for key in data.keys():
+            if 'leads[status]' in key and '[id]' in key:
+                id_lead = data[key]
+                break
+
+        if not id_lead:
+            for key in data.keys():
+                if 'leads[add]' in key and '[id]' in key:
+                    id_lead = data[key]
+                    break
+
+        if id_lead:
+            print(f"[WEBHOOK KOMMO] Lead ID detectado: {id_lead}")
+            params = {"id_lead": id_lead, "origem": "webhook_kommo"}
+            if not pool_kommo.enviar(processar_disparo_kommo, params):
+                return Response(status_code=503)
+        else:
+            print("[WEBHOOK KOMMO] Recebido, mas ID do lead não encontrado no payload.")
+
+        return Response(status_code=200)
+
+    except Exception as e:
+        print(f"[WEBHOOK KOMMO] Erro no endpoint: {e}")
+        return Response(status_code=500)
+
+
+async def receive_evolution_webhook(request):
+    try:
+        data = await request.json()
+        print("\n--- WEBHOOK RECEBIDO (ASGI) ---")
+        print(json.dumps(data, indent=2))
+
+        if data.get("event") == "messages.upsert":
+            if len(_tarefas_evolution) >= config.EVOLUTION_FILA_MAX:
+                print("[ASGI] Limite de tarefas da Evolution atingido. Tarefa recusada.")
+                return Response(status_code=503)
+
+            tarefa = asyncio.create_task(processar_resposta_evolution(data))
+            _tarefas_evolution.add(tarefa)
+            tarefa.add_done_callback(_tarefas_evolution.discard)
+
+        return Response(status_code=200)
+    except Exception as e:
+        print(f"WEBHOOK Erro no endpoint: {e}")
+        return Response(status_code=400)
+
+
+async def receive_reset_webhook(request):
+    print("\n" + "☢️ " * 10 + " WEBHOOK RESET " + "☢️ " * 10)
+    try:
+        sucesso = await asyncio.to_thread(resetar_banco_para_testes)
+        if sucesso:
+            return Response("Reset Realizado", status_code=200)
+        return Response("Erro no Reset", status_code=500)
+    except Exception as e:
+        print(f"Erro no Reset: {e}")
+        return Response(status_code=500)
+
+
+async def metrics(request):
+    pool_db = db_manager_async._pool
+    return JSONResponse({
+        "kommo": pool_kommo.metricas(),
+        "evolution": {
+            "tarefas_ativas": len(_tarefas_evolution),
+            "limite": config.EVOLUTION_FILA_MAX
+        },
+        "db_pool_async": {
+            "abertas": pool_db.size if pool_db else 0,
+            "livres": pool_db.freesize if pool_db else 0
+        },
+        "cache_leads": get_metricas_cache_leads(),
+        "cache_llm": cache_llm.metricas(),
+        "debounce": get_metricas_debounce(),
+        "limite_envios": limitador_envios.metricas(),
+        "leases": get_metricas_leases(),
+        "templates": rodizio_templates.metricas(),
+        "fila_escrita": fila_escrita.metricas(),
+        "cache_kommo": get_metricas_cache_kommo()
+    })
+
+
+async def on_startup():
+    global _loop
+    _loop = asyncio.get_running_loop()
+    _loop.set_default_executor(ThreadPoolExecutor(config.ASGI_THREADS, thread_name_prefix="asgi"))
+    restaurar_buffers(_agendar_agente)
+
+
+async def on_shutdown():
+    if _tarefas_evolution:
+        await asyncio.gather(*_tarefas_evolution, return_exceptions=True)
+    await asyncio.to_thread(fila_escrita.encerrar)
+    await db_manager_async.fechar_pool()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # on_startup/on_shutdown no construtor saíram do Starlette 1.0
+    await on_startup()
+    try:
+        yield
+    finally:
+        await on_shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route("/webhook/kommo", receive_kommo_webhook, methods=["POST"]),
+        Route("/webhook/evolution", receive_evolution_webhook, methods=["POST"]),
+        Route("/webhook/reset", receive_reset_webhook, methods=["POST"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    if not DB_HOST:
+        print("ERRO: Credenciais do banco de dados")
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="error")